@@ -0,0 +1,53 @@
+"""
+Compares the json codec with the standard library json module on
+synthetic records.
+
+Usage: python benchmark/bench_codec.py [--records 100000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "cloud_function"))
+
+import codec  # noqa: E402
+
+
+def measure(function) -> float:
+    """
+    Returns the duration of a function call in seconds.
+
+    :param function: Function to call.
+    """
+
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=100000)
+    args = parser.parse_args()
+
+    records = [
+        {"id": i, "name": f"name {i}", "city": "Zürich", "amount": i * 1.25, "active": i % 2 == 0, "tags": ["a", "b"]}
+        for i in range(args.records)
+    ]
+    message = {"gobits": [{"message_id": "1"}], "data": records}
+
+    encoded = json.dumps(message).encode("utf-8")
+    dumped = codec.dumps(message)
+
+    print(f"codec:       {'orjson' if codec.orjson else 'json'}")
+    print(f"equivalent:  {codec.loads(dumped) == message}, identical bytes: {dumped == encoded}")
+    print(f"json dumps:  {measure(lambda: json.dumps(message).encode('utf-8')):.3f}s ({len(encoded):,} bytes)")
+    print(f"codec dumps: {measure(lambda: codec.dumps(message)):.3f}s ({len(dumped):,} bytes)")
+    print(f"json loads:  {measure(lambda: json.loads(encoded)):.3f}s")
+    print(f"codec loads: {measure(lambda: codec.loads(encoded)):.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Measures the crossover between comparing records with the Datastore state
+by key lookups and by a single scan of the keys of the kind.
+
+A kind of --entities entities is compared with files holding a fraction of
+it, with every request to the in-memory fake of Datastore taking --latency
+seconds. Lookups fetch --chunk-size keys per request, --concurrency requests
+at a time, and scans fetch --page-size keys (and digests in digest mode)
+per request. In full mode the records found by a scan are still looked up,
+so a scan mostly pays off in digest mode. The time to find the records
+removed from a full snapshot is measured as well, as a scan finds their
+keys without any further request, and the requests are counted for both.
+
+The fastest fraction to scan from is a good value for state.scan_threshold.
+
+Finally the whole kind is compared twice with a digest cache, as a warm
+instance does with cache.enabled, the second time only reading the version
+marker of the kind.
+
+Usage: python benchmark/bench_diff.py [--entities 20000] [--latency 0.02] [--chunk-size 300]
+                                      [--concurrency 1] [--page-size 1000] [--mode full]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "cloud_function"))
+
+from cache import DigestCache  # noqa: E402
+from datastore import GoogleCloudDatastore  # noqa: E402
+from fakes import FakeDatastoreClient  # noqa: E402
+
+FRACTIONS = (0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.75, 1.0)
+KIND = "Bench"
+
+
+def record(i: int, version: int = 0) -> dict:
+    """
+    Returns a record of the benchmark kind.
+
+    :param i:       Key of the record.
+    :param version: Version of the record, changing its value.
+    """
+
+    return {"id": f"R{i:08d}", "name": f"name {i}", "amount": i * 1.25, "version": version}
+
+
+def measure(client: FakeDatastoreClient, args, fraction: float, scan: bool):
+    """
+    Compares a file with a fraction of the kind, a tenth of it changed.
+
+    :param client:   Fake Datastore client holding the kind.
+    :param args:     Benchmark arguments.
+    :param fraction: Fraction of the kind in the file.
+    :param scan:     Scan the kind instead of looking up the records.
+
+    :return: Seconds of the difference and of finding the removed records,
+             and the number of requests.
+    """
+
+    state = GoogleCloudDatastore(
+        args.mode, args.chunk_size, args.concurrency, client=client, scan_threshold=1e-9 if scan else 0
+    )
+    size = int(args.entities * fraction)
+    data = [record(i, 1 if i % 10 == 0 else 0) for i in range(size)]
+
+    requests = client.requests
+    start = time.perf_counter()
+    diff = state.diff(data, KIND, "id")
+    difference = time.perf_counter() - start
+    assert len(diff.changed) == len(range(0, size, 10)) and not diff.added
+
+    start = time.perf_counter()
+    removed = state.removed({item["id"] for item in data}, KIND, "id")
+    removal = time.perf_counter() - start
+    assert len(removed) == args.entities - size
+
+    return difference, removal, client.requests - requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entities", type=int, default=20000, help="number of entities of the kind")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds every request takes")
+    parser.add_argument("--chunk-size", type=int, default=300, help="keys per lookup")
+    parser.add_argument("--concurrency", type=int, default=1, help="concurrent lookups")
+    parser.add_argument("--page-size", type=int, default=1000, help="entities per page of a scan")
+    parser.add_argument("--mode", default="full", choices=("full", "digest"), help="datastore state mode")
+    args = parser.parse_args()
+
+    client = FakeDatastoreClient(page_size=args.page_size)
+    state = GoogleCloudDatastore(args.mode, client=client)
+    state.put_multi([record(i) for i in range(args.entities)], KIND, "id")
+    state.flush()
+    client.latency = args.latency
+
+    print(f"entities: {args.entities}, latency: {args.latency}s, chunk size: {args.chunk_size}, "
+          f"concurrency: {args.concurrency}, page size: {args.page_size}, mode: {args.mode}")
+    print(f"{'fraction':>8} {'lookup':>9} {'scan':>9} {'requests':>13} "
+          f"{'+removed lookup':>16} {'+removed scan':>14}  faster")
+
+    crossover = None
+    for fraction in FRACTIONS:
+        lookup, lookup_removal, lookup_requests = measure(client, args, fraction, False)
+        scan, scan_removal, scan_requests = measure(client, args, fraction, True)
+        faster = "scan" if scan < lookup else "lookup"
+        if faster == "scan" and crossover is None:
+            crossover = fraction
+        print(f"{fraction:8.2f} {lookup:8.3f}s {scan:8.3f}s {lookup_requests:6} {scan_requests:6} "
+              f"{lookup + lookup_removal:15.3f}s {scan + scan_removal:13.3f}s  {faster}")
+
+    print(f"\nscan is faster from a fraction of {crossover}" if crossover else "\nlookups are always faster")
+
+    cache = DigestCache()
+    data = [record(i) for i in range(args.entities)]
+    for run in ("cold", "warm"):
+        state = GoogleCloudDatastore(args.mode, args.chunk_size, args.concurrency, client=client, cache=cache)
+        requests = client.requests
+        start = time.perf_counter()
+        assert not state.diff(data, KIND, "id").records
+        print(f"{run} cache: {time.perf_counter() - start:.3f}s, {client.requests - requests} requests, "
+              f"hit rate {cache.stats['hit_rate']:.2f}, {cache.size / 2 ** 20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
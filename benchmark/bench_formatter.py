@@ -0,0 +1,95 @@
+"""
+Compares the per-record and the column-wise formatting of a DataFrame.
+
+With --workers, both are also measured in a pool of processes, once with
+the pool being started and once with the pool already running.
+
+Usage: python benchmark/bench_formatter.py [--rows 100000] [--workers 4]
+"""
+import argparse
+import os
+import sys
+import time
+from io import StringIO
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "cloud_function"))
+
+from event_formatter import Formatter  # noqa: E402
+
+TEMPLATE = {
+    "name": {"name": "name", "conversion": {"type": "lowercase"}},
+    "code": {"name": "code", "conversion": {"type": "uppercase"}},
+    "city": {"name": "city", "conversion": {"type": "capitalize"}},
+    "id": [
+        {"name": "id", "conversion": {"type": "numeric"}},
+        {"name": "reference", "conversion": {"type": "prefix_value", "format": "ref-"}},
+    ],
+    "amount": {"name": "amount", "conversion": {"type": "numeric"}},
+    "email": {"name": "email", "conversion": {"type": "hash"}},
+    "created": {"name": "created", "conversion": {"type": "datetime"}},
+    "longitude": {"name": "geometry", "conversion": {"type": "geojson", "format": "longitude"}},
+    "latitude": {"name": "geometry", "conversion": {"type": "geojson", "format": "latitude"}},
+    "remark": {"name": "remark"},
+}
+
+
+def generate(rows: int) -> str:
+    """
+    Generates a csv file matching the benchmark template.
+
+    :param rows: Number of rows to generate.
+    """
+
+    lines = ["name,code,city,id,amount,email,created,longitude,latitude,remark"]
+    for i in range(rows):
+        lines.append(
+            f"Name {i},c{i % 97},city {i % 13},{i},{i * 1.25},user{i}@example.com,"
+            f"2021-0{i % 9 + 1}-1{i % 10} 12:{i % 60:02d}:00,{4 + i % 3}.1,{52 + i % 2}.3,remark {i}"
+        )
+
+    return "\n".join(lines)
+
+
+def measure(function) -> float:
+    """
+    Returns the duration of a function call in seconds.
+
+    :param function: Function to call.
+    """
+
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--workers", type=int, default=1, help="number of processes")
+    args = parser.parse_args()
+
+    df = pd.read_csv(StringIO(generate(args.rows)))
+    formatter = Formatter(TEMPLATE)
+
+    records = measure(lambda: formatter.format(df.to_dict(orient="records")))
+    columns = measure(lambda: formatter.format_frame(df))
+
+    print(f"rows:       {args.rows}")
+    print(f"per-record: {records:.3f}s ({args.rows / records:,.0f} rows/s)")
+    print(f"per-column: {columns:.3f}s ({args.rows / columns:,.0f} rows/s)")
+
+    if args.workers > 1:
+        parallel = Formatter(TEMPLATE, args.workers, threshold=0)
+        start = measure(lambda: parallel.format(df.to_dict(orient="records")))
+        records = measure(lambda: parallel.format(df.to_dict(orient="records")))
+        columns = measure(lambda: parallel.format_frame(df))
+
+        print(f"workers:    {args.workers} (starting the pool {start - records:.3f}s)")
+        print(f"per-record: {records:.3f}s ({args.rows / records:,.0f} rows/s)")
+        print(f"per-column: {columns:.3f}s ({args.rows / columns:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
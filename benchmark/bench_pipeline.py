@@ -0,0 +1,335 @@
+"""
+Benchmarks every stage of the pipeline on synthetic csv, xlsx, json,
+line-delimited json, Atom and Parquet files, with in-memory fakes of
+Datastore and Pub/Sub. The Parquet file has typed id, amount and created
+columns.
+
+The stages are parsing the file (File.to_json with a template that keeps
+every column as is), Formatter.format with a template using every
+conversion type, File.to_json with that template, GoogleCloudDatastore
+difference and put_multi, a second difference against the stored state
+and Publisher.publish.
+
+Every format runs in its own process, so the peak RSS is measured per
+format. The data is generated from a fixed seed, so results written with
+--json can be compared across commits with --baseline.
+
+Usage: python benchmark/bench_pipeline.py [--rows 20000] [--columns 5] [--formats csv,xlsx,json,ndjson,atom,parquet]
+                                          [--repeat 1] [--json results.json] [--baseline results.json]
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "cloud_function"))
+
+from datastore import GoogleCloudDatastore  # noqa: E402
+from event_formatter import Formatter  # noqa: E402
+from fakes import FakeDatastoreClient, FakePublisherClient  # noqa: E402
+from publisher import Publisher  # noqa: E402
+from storage import File  # noqa: E402
+
+FORMATS = ("csv", "xlsx", "json", "ndjson", "atom", "parquet")
+STAGES = ("parse", "format", "to_json", "difference_new", "put_multi", "difference_unchanged", "publish")
+
+ATOM_HEAD = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<feed xmlns="http://www.w3.org/2005/Atom" '
+    'xmlns:m="http://schemas.microsoft.com/ado/2007/08/dataservices/metadata" '
+    'xmlns:d="http://schemas.microsoft.com/ado/2007/08/dataservices">'
+)
+
+
+def template(columns: int, subfields: bool) -> dict:
+    """
+    Returns a formatting template that uses every conversion type.
+
+    :param columns:   Number of extra columns without conversion.
+    :param subfields: Whether to format the nested details column.
+    """
+
+    template = {
+        "id": {"name": "id", "conversion": {"type": "numeric"}},
+        "name": {"name": "name", "conversion": {"type": "capitalize"}},
+        "code": {"name": "code", "conversion": {"type": "uppercase"}},
+        "email": {"name": "email", "conversion": {"type": "lowercase"}},
+        "created": {"name": "created", "conversion": {"type": "datetime"}},
+        "updated": {"name": "updated", "conversion": {"type": "datetime", "format": "%Y-%m-%d"}},
+        "reference": [
+            {"name": "reference", "conversion": {"type": "prefix_value", "format": "REF-"}},
+            {"name": "reference_hash", "conversion": {"type": "hash"}},
+        ],
+        "amount": {"name": "amount", "conversion": {"type": "numeric"}},
+        "lon": {"name": "geometry", "conversion": {"type": "geojson", "format": "longitude"}},
+        "lat": {"name": "geometry", "conversion": {"type": "geojson", "format": "latitude"}},
+    }
+    for i in range(columns):
+        template[f"column{i}"] = {"name": f"column{i}"}
+    if subfields:
+        template["details"] = {
+            "subfields": {
+                "status": {"name": "status", "conversion": {"type": "lowercase"}},
+                "owner": {"name": "owner"},
+            }
+        }
+
+    return template
+
+
+def generate(rows: int, columns: int, nested: bool, seed: int = 0) -> list:
+    """
+    Generates records with repeated timestamps and categories, like
+    most exports have.
+
+    :param rows:    Number of records.
+    :param columns: Number of extra columns.
+    :param nested:  Whether to add a nested details column.
+    :param seed:    Seed of the random generator.
+    """
+
+    rng = random.Random(seed)
+    records = []
+    for i in range(rows):
+        day = rng.randint(1, 28)
+        record = {
+            "id": str(i),
+            "name": f"name {rng.randint(0, 1000)}",
+            "code": f"code-{rng.randint(0, 100)}",
+            "email": f"User{i}@Example.com",
+            "created": f"2021-{rng.randint(1, 12):02d}-{day:02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00Z",
+            "updated": f"2021-{rng.randint(1, 12):02d}-{day:02d} 12:00:00",
+            "reference": f"R{rng.randint(0, 10 ** 6):06d}",
+            "amount": f"{rng.randint(0, 10 ** 6) / 100}",
+            "lon": f"{rng.uniform(3.3, 7.2):.6f}",
+            "lat": f"{rng.uniform(50.7, 53.5):.6f}",
+        }
+        for column in range(columns):
+            record[f"column{column}"] = f"value {rng.randint(0, 10 ** 4)}"
+        if nested:
+            record["details"] = {"status": rng.choice(["OPEN", "Closed"]), "owner": f"owner {i % 50}"}
+        records.append(record)
+
+    return records
+
+
+def serialize(records: list, format: str) -> bytes:
+    """
+    Serializes records to a file of a format.
+
+    :param records: The records to serialize.
+    :param format:  csv, xlsx, json, ndjson, atom or parquet.
+    """
+
+    if format == "csv":
+        text = io.StringIO()
+        writer = csv.DictWriter(text, fieldnames=list(records[0]))
+        writer.writeheader()
+        writer.writerows(records)
+        return text.getvalue().encode("utf-8")
+    elif format == "xlsx":
+        import pandas as pd
+
+        data = io.BytesIO()
+        pd.DataFrame(records).to_excel(data, index=False)
+        return data.getvalue()
+    elif format == "json":
+        return json.dumps({"rows": records}).encode("utf-8")
+    elif format == "ndjson":
+        return "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+    elif format == "parquet":
+        import pandas as pd
+
+        df = pd.DataFrame(records)
+        df["id"] = df["id"].astype(int)
+        df["amount"] = df["amount"].astype(float)
+        df["created"] = pd.to_datetime(df["created"])
+        data = io.BytesIO()
+        df.to_parquet(data, index=False)
+        return data.getvalue()
+
+    entries = [
+        '<entry><content type="application/xml"><m:properties>' +
+        "".join(f"<d:{key}>{escape(value)}</d:{key}>" for key, value in record.items()) +
+        "</m:properties></content></entry>"
+        for record in records
+    ]
+    return (ATOM_HEAD + "".join(entries) + "</feed>").encode("utf-8")
+
+
+def peak_rss() -> float:
+    """Returns the peak resident set size of the process in MiB."""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def run(format: str, args) -> dict:
+    """
+    Runs every stage once for a format.
+
+    :param format: csv, xlsx, json, ndjson, atom or parquet.
+    :param args:   Benchmark arguments.
+    """
+
+    nested = format == "json"
+    data = serialize(generate(args.rows, args.columns, nested), format)
+
+    identity = Formatter({key: {"name": key} for key in template(args.columns, nested)})
+    formatter = Formatter(template(args.columns, nested))
+    state = GoogleCloudDatastore(args.mode, client=FakeDatastoreClient())
+    publisher = Publisher(client=FakePublisherClient())
+
+    def file():
+        file = File(f"bench.{format}", data)
+        file.top_level_attribute = "rows"
+        return file
+
+    results = {}
+
+    def stage(name, function):
+        start = time.perf_counter()
+        result = function()
+        results[name] = {"seconds": time.perf_counter() - start, "rss_mib": peak_rss()}
+        return result
+
+    raw = stage("parse", lambda: file().to_json(identity))
+    stage("format", lambda: formatter.format(raw))
+    records = stage("to_json", lambda: file().to_json(formatter))
+    stage("difference_new", lambda: state.difference(records, "Bench", "id"))
+    stage("put_multi", lambda: state.put_multi(records, "Bench", "id"))
+    stage("difference_unchanged", lambda: state.difference(records, "Bench", "id"))
+    stage("publish", lambda: publisher.publish("project", "topic", records, {}, 100, "data", 9000000))
+
+    return {"bytes": len(data), "records": len(records), "stages": results}
+
+
+def worker(format: str, args):
+    """
+    Runs the stages of a format, keeping the fastest of the repeats, and
+    writes the result as json to stdout.
+
+    :param format: csv, xlsx, json, ndjson, atom or parquet.
+    :param args:   Benchmark arguments.
+    """
+
+    # Load the lazily imported modules before measuring
+    warm_up = argparse.Namespace(**{**vars(args), "rows": 10})
+    run(format, warm_up)
+
+    result = None
+    for _ in range(args.repeat):
+        run_result = run(format, args)
+        if result is None:
+            result = run_result
+            continue
+        for name, stage in run_result["stages"].items():
+            best = result["stages"][name]
+            best["seconds"] = min(best["seconds"], stage["seconds"])
+            best["rss_mib"] = max(best["rss_mib"], stage["rss_mib"])
+
+    result["peak_rss_mib"] = peak_rss()
+    json.dump(result, sys.stdout)
+
+
+def commit() -> str:
+    """Returns the current git commit, None outside of a git repository."""
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(results: dict, baseline: dict = None):
+    """
+    Prints the results, with the change to a baseline when given.
+
+    :param results:  Benchmark results.
+    :param baseline: Earlier benchmark results.
+    """
+
+    print(f"commit: {results['commit']}, python: {results['python']}, "
+          f"rows: {results['rows']}, columns: {results['columns']}, mode: {results['mode']}")
+    if baseline:
+        print(f"baseline commit: {baseline['commit']}")
+
+    for format, result in results["formats"].items():
+        if "skipped" in result:
+            print(f"\n{format}: skipped, {result['skipped']}")
+            continue
+
+        print(f"\n{format}: {result['bytes']:,} bytes, {result['records']} records, "
+              f"peak RSS {result['peak_rss_mib']:.1f} MiB")
+        base = ((baseline or {}).get("formats", {}).get(format) or {}).get("stages", {})
+        for name in STAGES:
+            stage = result["stages"][name]
+            line = (f"  {name:22} {stage['seconds']:8.3f}s {result['records'] / stage['seconds']:>12,.0f} rows/s "
+                    f"{stage['rss_mib']:8.1f} MiB")
+            if name in base:
+                line += f"  {(stage['seconds'] / base[name]['seconds'] - 1) * 100:+6.1f}%"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--columns", type=int, default=5, help="number of extra columns without conversion")
+    parser.add_argument("--formats", default=",".join(FORMATS))
+    parser.add_argument("--mode", default="full", choices=("full", "digest"), help="datastore state mode")
+    parser.add_argument("--repeat", type=int, default=1, help="number of runs, the fastest is reported")
+    parser.add_argument("--json", help="file to write the results to")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(args.worker, args)
+
+    results = {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "rows": args.rows,
+        "columns": args.columns,
+        "mode": args.mode,
+        "repeat": args.repeat,
+        "formats": {},
+    }
+
+    for format in args.formats.split(","):
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", format, "--rows", str(args.rows),
+             "--columns", str(args.columns), "--mode", args.mode, "--repeat", str(args.repeat)],
+            capture_output=True, text=True,
+        )
+        if process.returncode:
+            error = (process.stderr.strip().splitlines() or ["failed"])[-1]
+            results["formats"][format] = {"skipped": error}
+        else:
+            results["formats"][format] = json.loads(process.stdout)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    report(results, baseline)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
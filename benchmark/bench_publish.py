@@ -0,0 +1,40 @@
+"""
+Measures the throughput of Publisher.publish against a fake client
+with a simulated publish latency.
+
+Usage: python benchmark/bench_publish.py [--records 100000] [--batch-size 100] [--latency 0.01]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "cloud_function"))
+
+from fakes import FakePublisherClient  # noqa: E402
+from publisher import Publisher  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--max-messages", type=int, default=1000)
+    args = parser.parse_args()
+
+    records = [{"id": i, "name": f"name {i}", "amount": i * 1.5} for i in range(args.records)]
+    client = FakePublisherClient(args.latency, args.fail_rate, message_limit=args.max_messages)
+    publisher = Publisher(client=client)
+
+    start = time.perf_counter()
+    report = publisher.publish("project", "topic", records, {"gobits": "bench"}, args.batch_size, "data")
+    duration = time.perf_counter() - start
+
+    print(f"records:   {args.records}, batches: {len(report.batches)}, failed: {len(report.failed)}")
+    print(f"duration:  {duration:.3f}s ({len(report.published) / duration:,.0f} records/s)")
+
+
+if __name__ == "__main__":
+    main()
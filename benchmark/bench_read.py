@@ -0,0 +1,68 @@
+"""
+Measures reading and parsing a compressed csv blob through the storage
+readers, with a simulated download latency per ranged request.
+
+Usage: python benchmark/bench_read.py [--rows 200000] [--latency 0.02]
+"""
+import argparse
+import gzip
+import os
+import sys
+import time
+import tracemalloc
+
+import brotli
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "cloud_function"))
+
+from event_formatter import Formatter  # noqa: E402
+from fakes import FakeBlob  # noqa: E402
+from storage import File, open_blob  # noqa: E402
+
+
+def generate(rows: int) -> bytes:
+    """
+    Generates a csv file.
+
+    :param rows: Number of rows to generate.
+    """
+
+    lines = ["id,name,amount"]
+    lines.extend(f"{i},name {i},{i * 1.5}" for i in range(rows))
+
+    return "\n".join(lines).encode("utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    data = generate(args.rows)
+    formatter = Formatter({"id": {"name": "id"}, "name": {"name": "name"}, "amount": {"name": "amount"}})
+    compress = {None: lambda x: x, "gzip": gzip.compress, "br": brotli.compress}
+
+    # The storage readers import pandas lazily, keep that out of the first measurement
+    import pandas  # noqa: F401
+
+    print(f"rows: {args.rows}, size: {len(data):,} bytes, latency: {args.latency}s")
+    for encoding, function in compress.items():
+        blob = FakeBlob(function(data), encoding, args.latency)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        file = File("bench.csv", open_blob(blob))
+        records = sum(len(chunk) for chunk in file.iter_json(formatter, 10000))
+        duration = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        print(
+            f"{encoding or 'identity':>8}: {blob.size:>12,} bytes, {blob.requests:>3} requests, "
+            f"{records / duration:>10,.0f} rows/s, peak {peak / 2 ** 20:.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Compares processing the chunks of a file one after another with processing
+them in pipelined stages (streaming.pipelined), with in-memory fakes of
+Datastore and Pub/Sub that take --latency seconds per request.
+
+A csv file of --rows rows is read in chunks of --chunk-size records and
+processed twice against an empty state, once sequentially and once
+pipelined with a queue depth of --depth, and both runs have to publish
+and store the same records.
+
+Usage: python benchmark/bench_stages.py [--rows 50000] [--chunk-size 5000] [--latency 0.02] [--depth 2]
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "cloud_function"))
+
+import pipeline  # noqa: E402
+from configuration import Configuration  # noqa: E402
+from datastore import GoogleCloudDatastore  # noqa: E402
+from event_formatter import Formatter  # noqa: E402
+from fakes import FakeDatastoreClient, FakePublisherClient  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from publisher import Publisher  # noqa: E402
+from storage import File  # noqa: E402
+
+CONFIG = """
+topic: {id: bench, project_id: bench, batch_size: 500}
+state: {type: datastore, kind: Bench, property: id}
+format:
+  id: {name: id}
+  name: {name: name, conversion: {type: lowercase}}
+  amount: {name: amount}
+"""
+
+
+class Metadata:
+    """Gobits metadata of the messages."""
+
+    def to_json(self) -> dict:
+        return {"bench": True}
+
+
+def run(config: Configuration, data: bytes, args, pipelined: bool):
+    """
+    Processes the chunks of a csv file against an empty state.
+
+    :param config:    The configuration.
+    :param data:      Content of the csv file.
+    :param args:      Benchmark arguments.
+    :param pipelined: Process the chunks in pipelined stages.
+
+    :return: Seconds, metrics, published messages and stored entities.
+    """
+
+    client = FakeDatastoreClient(args.latency)
+    publisher_client = FakePublisherClient(args.latency)
+    state = GoogleCloudDatastore(chunk_size=300, client=client)
+    publisher = Publisher(client=publisher_client)
+    metrics = Metrics()
+
+    file = File("bench.csv", io.BytesIO(data))
+    file.metrics = metrics
+    chunks = file.iter_json(Formatter(config.template), args.chunk_size)
+
+    start = time.perf_counter()
+    if pipelined:
+        published = pipeline.process_chunks(config, chunks, state, publisher, Metadata(), metrics, args.depth)
+    else:
+        published = sum(pipeline.process(config, records, state, publisher, Metadata(), metrics) for records in chunks)
+    seconds = time.perf_counter() - start
+
+    assert published == args.rows
+    return seconds, metrics, len(publisher_client.messages), len(client.entities)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--chunk-size", type=int, default=5000, help="records per chunk")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds every request takes")
+    parser.add_argument("--depth", type=int, default=2, help="chunks waiting for every stage")
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as f:
+        f.write(CONFIG)
+    config = Configuration(f.name)
+    os.unlink(f.name)
+
+    data = ("id,name,amount\n" + "".join(f"R{i:08d},Name {i},{i * 1.25}\n" for i in range(args.rows))).encode()
+
+    print(f"rows: {args.rows}, chunk size: {args.chunk_size}, latency: {args.latency}s, depth: {args.depth}")
+    results = {}
+    for name, pipelined in (("sequential", False), ("pipelined", True)):
+        seconds, metrics, messages, entities = run(config, data, args, pipelined)
+        results[name] = (messages, entities)
+        stages = ", ".join(
+            f"{stage} {metrics.durations[stage]:.2f}"
+            for stage in ("parse", "format", "state_diff", "publish", "state_write")
+        )
+        print(f"{name:>10}: {seconds:6.2f}s ({stages})")
+
+    assert results["sequential"] == results["pipelined"]
+
+
+if __name__ == "__main__":
+    main()
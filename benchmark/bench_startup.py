@@ -0,0 +1,115 @@
+"""
+Measures the import time of main with -X importtime and the cold start
+of an invocation that is skipped by the prefix filter, each in a fresh
+interpreter, using config.yaml.example as configuration.
+
+Usage: python benchmark/bench_startup.py [--runs 5] [--top 15] [--json]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+CLOUD_FUNCTION = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "cloud_function"))
+
+# Dependencies that should only be imported when a file needs them
+HEAVY_MODULES = (
+    "pandas",
+    "numpy",
+    "dateutil",
+    "defusedxml",
+    "brotli",
+    "grpc",
+    "google.cloud.storage",
+    "google.cloud.datastore",
+    "google.cloud.pubsub_v1",
+    "werkzeug",
+)
+
+COLD_START = """
+import time
+start = time.perf_counter()
+import main
+main.handler({"bucket": "bucket", "name": "skipped/by/prefix/filter.json"}, None)
+print(time.perf_counter() - start)
+"""
+
+
+def run(arguments: list, directory: str) -> subprocess.CompletedProcess:
+    """
+    Runs python in a directory with the cloud function on the path.
+
+    :param arguments: Arguments of the python interpreter.
+    :param directory: Working directory holding config.yaml.
+    """
+
+    env = dict(os.environ, PYTHONPATH=CLOUD_FUNCTION)
+    return subprocess.run(
+        [sys.executable] + arguments, cwd=directory, env=env, capture_output=True, text=True, check=True
+    )
+
+
+def import_times(directory: str) -> dict:
+    """
+    Returns the cumulative import time in microseconds per module
+    when importing main.
+
+    :param directory: Working directory holding config.yaml.
+    """
+
+    result = run(["-X", "importtime", "-c", "import main"], directory)
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        times[module.strip()] = int(cumulative)
+
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", action="store_true", help="Print the results as json.")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        shutil.copy(os.path.join(CLOUD_FUNCTION, "config.yaml.example"), os.path.join(directory, "config.yaml"))
+
+        times = import_times(directory)
+        cold_starts = [float(run(["-c", COLD_START], directory).stdout) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(directory)
+
+    top_level = {module: cumulative for module, cumulative in times.items() if "." not in module}
+    results = {
+        "import_main_ms": times.get("main", 0) / 1000,
+        "cold_start_ms": statistics.median(cold_starts) * 1000,
+        "heavy_modules": [module for module in HEAVY_MODULES if module in times],
+        "top_imports_ms": {
+            module: cumulative / 1000
+            for module, cumulative in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]
+        },
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"import main:   {results['import_main_ms']:.1f} ms")
+    print(f"cold start:    {results['cold_start_ms']:.1f} ms (median of {args.runs})")
+    print(f"heavy modules: {', '.join(results['heavy_modules']) or 'none'}")
+    for module, duration in results["top_imports_ms"].items():
+        print(f"  {duration:8.1f} ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
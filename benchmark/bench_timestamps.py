@@ -0,0 +1,72 @@
+"""
+Compares the datetime conversion engine with parsing every value with
+dateutil on synthetic timestamp columns.
+
+Usage: python benchmark/bench_timestamps.py [--values 100000] [--distinct 20000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "cloud_function"))
+
+from timestamps import DEFAULT_FORMAT, TimestampConverter  # noqa: E402
+
+LAYOUTS = {
+    "iso": "%Y-%m-%dT%H:%M:%S",
+    "iso utc": "%Y-%m-%dT%H:%M:%SZ",
+    "date time": "%Y-%m-%d %H:%M:%S",
+    "month first": "%m/%d/%Y %H:%M",
+    "named month": "%d %b %Y %H:%M",
+}
+
+
+def dateutil_timestamp(value) -> str:
+    from dateutil import parser
+
+    return str(datetime.strftime(parser.parse(value), DEFAULT_FORMAT))
+
+
+def measure(function, values: list):
+    """
+    Returns the duration and result of converting values.
+
+    :param function: Conversion function.
+    :param values:   Values to convert.
+    """
+
+    start = time.perf_counter()
+    result = [function(value) for value in values]
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--values", type=int, default=100000)
+    parser.add_argument("--distinct", type=int, default=20000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    start = datetime(2021, 1, 1)
+    dates = [start + timedelta(seconds=random.randint(0, 3 * 365 * 86400)) for _ in range(args.distinct)]
+
+    for name, layout in LAYOUTS.items():
+        values = [random.choice(dates).strftime(layout) for _ in range(args.values)]
+
+        dateutil_time, expected = measure(dateutil_timestamp, values)
+        converter = TimestampConverter()
+        engine_time, result = measure(converter, values)
+        stats = converter.stats
+
+        print(
+            f"{name:12} dateutil {dateutil_time:.3f}s  engine {engine_time:.3f}s  "
+            f"speedup {dateutil_time / engine_time:5.1f}x  hit rate {stats['hit_rate']:.2f}  "
+            f"fast {stats['fast']}  fallback {stats['fallback']}  identical {result == expected}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Local in-memory stand-ins for the Google Cloud clients.
+"""
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class FakeBlob:
+    """
+    Blob that serves ranged downloads from memory.
+
+    :param data:             The (compressed) content of the blob.
+    :param content_encoding: Content encoding of the blob, e.g. br or gzip.
+    :param latency:          Seconds every download request takes.
+    :param md5_hash:         Base64 encoded MD5 checksum of the data.
+    :param crc32c:           Base64 encoded CRC32C checksum of the data.
+    """
+
+    def __init__(self, data: bytes, content_encoding: str = None, latency: float = 0.0,
+                 md5_hash: str = None, crc32c: str = None):
+        self.data = data
+        self.size = len(data)
+        self.content_encoding = content_encoding
+        self.latency = latency
+        self.md5_hash = md5_hash
+        self.crc32c = crc32c
+        self.requests = 0
+
+    def download_as_bytes(self, start: int = None, end: int = None, raw_download: bool = False) -> bytes:
+        self.requests += 1
+        time.sleep(self.latency)
+
+        start = start or 0
+        end = self.size - 1 if end is None else end
+
+        return self.data[start:end + 1]
+
+
+class FakeStorageClient:
+    """
+    Storage client that serves blobs from memory.
+
+    :param blobs: Dictionary of (bucket name, blob name) to FakeBlob.
+    """
+
+    def __init__(self, blobs: dict = None):
+        self.blobs = blobs if blobs is not None else {}
+
+    def bucket(self, name: str):
+        return FakeBucket(self, name)
+
+    def list_blobs(self, bucket: str, prefix: str = None) -> list:
+        blobs = []
+        for (bucket_name, name), blob in self.blobs.items():
+            if bucket_name == bucket and name.startswith(prefix or ""):
+                blob.name = name
+                blobs.append(blob)
+        return blobs
+
+
+class FakeBucket:
+    """Bucket of a FakeStorageClient."""
+
+    def __init__(self, client: FakeStorageClient, name: str):
+        self._client = client
+        self.name = name
+
+    def get_blob(self, name: str) -> FakeBlob:
+        return self._client.blobs.get((self.name, name))
+
+
+class FakePublisherClient:
+    """
+    PublisherClient that publishes to memory. Like the flow control of
+    the real client, publish blocks while message_limit messages are in
+    flight.
+
+    :param latency:       Seconds every publish takes to complete.
+    :param fail_rate:     Fraction of the publishes that fail.
+    :param workers:       Number of threads completing publishes.
+    :param message_limit: Maximum number of messages in flight.
+    """
+
+    def __init__(self, latency: float = 0.0, fail_rate: float = 0.0, workers: int = 10, message_limit: int = 1000):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.messages = []
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._in_flight = threading.BoundedSemaphore(message_limit)
+        self._random = random.Random(0)
+
+    def topic_path(self, project_id: str, topic_id: str) -> str:
+        return f"projects/{project_id}/topics/{topic_id}"
+
+    def publish(self, topic: str, data: bytes, **attributes) -> Future:
+        with self._lock:
+            fail = self._random.random() < self.fail_rate
+
+        self._in_flight.acquire()
+        future = self._executor.submit(self._publish, topic, data, attributes, fail)
+        future.add_done_callback(lambda f: self._in_flight.release())
+        return future
+
+    def _publish(self, topic: str, data: bytes, attributes: dict, fail: bool) -> str:
+        time.sleep(self.latency)
+        if fail:
+            raise ConnectionError("Fake publish failure")
+
+        with self._lock:
+            self.messages.append((topic, data, attributes))
+            return str(len(self.messages))
+
+
+class FakeKey:
+    """
+    Datastore key of a kind and name.
+    """
+
+    def __init__(self, kind: str, name):
+        self.kind = kind
+        self.id_or_name = name
+
+    def __eq__(self, other):
+        return (self.kind, self.id_or_name) == (other.kind, other.id_or_name)
+
+    def __hash__(self):
+        return hash((self.kind, self.id_or_name))
+
+
+class FakeEntity(dict):
+    """
+    Datastore entity with a key.
+    """
+
+    def __init__(self, key: FakeKey = None, exclude_from_indexes: tuple = ()):
+        super().__init__()
+        self.key = key
+
+
+class FakeQuery:
+    """
+    Datastore query of a kind with equality filters.
+    """
+
+    def __init__(self, client, kind: str, projection: list = ()):
+        self.kind = kind
+        self.projection = list(projection)
+        self._client = client
+        self._filters = []
+        self._keys_only = False
+
+    def add_filter(self, name: str, operator: str, value):
+        self._filters.append((name, value))
+
+    def keys_only(self):
+        self._keys_only = True
+
+    def fetch(self, limit: int = None):
+        return self._client.run_query(self.kind, self._filters, self._keys_only, limit, self.projection)
+
+
+class FakeDatastoreClient:
+    """
+    Datastore client that keeps entities in memory. Queries return pages
+    of entities, every page being a request. The __Stat_Kind__ statistics
+    are always up to date, and transactions run one at a time.
+
+    :param latency:   Seconds every request takes.
+    :param page_size: Number of entities per page of a query.
+    """
+
+    def __init__(self, latency: float = 0.0, page_size: int = 1000):
+        self.latency = latency
+        self.page_size = page_size
+        self.entities = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._transaction = threading.Lock()
+
+    def key(self, kind: str, name) -> FakeKey:
+        return FakeKey(kind, name)
+
+    def _request(self):
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency)
+
+    def get(self, key: FakeKey):
+        self._request()
+        return self.entities.get(key)
+
+    def get_multi(self, keys: list, missing: list = None) -> list:
+        self._request()
+        found = []
+        for key in keys:
+            if key in self.entities:
+                found.append(self.entities[key])
+            elif missing is not None:
+                missing.append(FakeEntity(key))
+        return found
+
+    def put(self, entity):
+        self.put_multi([entity])
+
+    def put_multi(self, entities: list):
+        self._request()
+        for entity in entities:
+            stored = FakeEntity(entity.key)
+            stored.update(entity)
+            self.entities[entity.key] = stored
+
+    def delete_multi(self, keys: list):
+        self._request()
+        for key in keys:
+            self.entities.pop(key, None)
+
+    @contextmanager
+    def transaction(self):
+        with self._transaction:
+            yield
+            self._request()
+
+    def query(self, kind: str = None, projection: list = ()) -> FakeQuery:
+        return FakeQuery(self, kind, projection)
+
+    def run_query(self, kind: str, filters: list, keys_only: bool, limit: int = None, projection: list = ()):
+        if kind == "__Stat_Kind__":
+            counts = {}
+            for key in self.entities:
+                counts[key.kind] = counts.get(key.kind, 0) + 1
+            entities = []
+            for name, count in counts.items():
+                entity = FakeEntity(FakeKey(kind, name))
+                entity.update({"kind_name": name, "count": count})
+                entities.append(entity)
+        else:
+            entities = [entity for key, entity in self.entities.items() if key.kind == kind]
+
+        entities = [entity for entity in entities if all(entity.get(name) == value for name, value in filters)]
+        if projection:
+            # Projections only return the entities holding the properties
+            entities = [entity for entity in entities if all(name in entity for name in projection)]
+        for start in range(0, len(entities[:limit]) or 1, self.page_size):
+            self._request()
+            for entity in entities[:limit][start:start + self.page_size]:
+                if keys_only or projection:
+                    projected = FakeEntity(entity.key)
+                    projected.update((name, entity[name]) for name in projection)
+                    yield projected
+                else:
+                    yield entity
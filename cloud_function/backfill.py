@@ -0,0 +1,261 @@
+"""
+Backfills the records of many files with the configuration of the function.
+
+Files are read, parsed and formatted in a pool of processes, while the
+state difference, publishing and state writes are applied in this process
+in the order of the files. All files share the state kind of the
+configuration, so the state is never applied out of order: the backfill
+stops at the first file that fails.
+
+A source is a local file, a local directory (its files sorted by name),
+a gs://bucket/object or a gs://bucket/prefix/ (its objects sorted by name).
+
+With state.deletions, every file is a full snapshot and the records of the
+state missing from it are published as deleted, as the function does.
+Files are always read and formatted whole, and every file is processed:
+state.fingerprint, state.append_only and streaming are not used.
+
+With --dry-run the difference with the state is calculated, but nothing is
+published or written to the state. Every file is then compared with the
+state as it was before the backfill.
+
+Usage: python backfill.py [--config config.yaml] [--workers N] [--dry-run] SOURCE [SOURCE ...]
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+from collections import deque
+
+import clients
+import pipeline
+from configuration import Configuration
+from event_formatter import Formatter
+from metrics import Metrics
+from publisher import Publisher
+from storage import File, GoogleCloudStorage
+
+_config = None
+_formatter = None
+
+
+def get_sources(arguments: list) -> list:
+    """
+    Expands sources to a list of (bucket, name) tuples, the bucket
+    being None for local files.
+
+    :param arguments: Local files or directories and gs:// objects or prefixes.
+    """
+
+    sources = []
+    for argument in arguments:
+        if argument.startswith("gs://"):
+            bucket, _, name = argument[5:].partition("/")
+            if not name or name.endswith("/"):
+                blobs = clients.storage_client().list_blobs(bucket, prefix=name or None)
+                sources.extend(sorted((bucket, blob.name) for blob in blobs if not blob.name.endswith("/")))
+            else:
+                sources.append((bucket, name))
+        elif os.path.isdir(argument):
+            sources.extend(
+                (None, os.path.join(argument, name)) for name in sorted(os.listdir(argument))
+                if os.path.isfile(os.path.join(argument, name))
+            )
+        else:
+            sources.append((None, argument))
+
+    return sources
+
+
+def init_worker(config_path: str):
+    """
+    Reads the configuration and compiles the template once per worker.
+
+    :param config_path: Path of the configuration file.
+    """
+
+    global _config, _formatter
+
+    logging.getLogger().setLevel(logging.WARNING)
+    _config = Configuration(config_path)
+    _formatter = Formatter(_config.template)
+
+
+def format_source(source: tuple):
+    """
+    Reads and formats the records of a source in a worker.
+
+    :param source: Tuple of bucket, None for a local file, and name.
+
+    :return: The records and the metrics counts and durations.
+    """
+
+    bucket, name = source
+    metrics = Metrics()
+
+    if bucket:
+        file = GoogleCloudStorage().read(name, bucket, metrics)
+        records = _format(file)
+    else:
+        with open(name, "rb") as f:
+            file = File(name, f)
+            file.metrics = metrics
+            records = _format(file)
+
+    return records, dict(file.metrics.counts), dict(file.metrics.durations)
+
+
+def _format(file: File) -> list:
+    """
+    Formats the records of a file with the configuration of the worker.
+
+    :param file: The file to format.
+    """
+
+    file.top_level_attribute = _config.top_level_attribute
+    file.csv_dialect_parameters = _config.csv_dialect_parameters
+
+    return file.to_json(_formatter)
+
+
+def backfill(config_path: str, sources: list, workers: int, dry_run: bool = False) -> Metrics:
+    """
+    Formats sources in a pool of processes and applies them in order.
+
+    :param config_path: Path of the configuration file.
+    :param sources:     List of (bucket, name) tuples.
+    :param workers:     Number of worker processes.
+    :param dry_run:     Stop before publishing and writing the state.
+
+    :return: Metrics of the backfill.
+    """
+
+    from gobits import Gobits
+
+    config = Configuration(config_path)
+    metrics = Metrics()
+    state = pipeline.get_state(config)
+    deletions = pipeline.publishes_deletions(config, state)
+    for option, enabled in (
+        ("state.fingerprint", config.state.fingerprint),
+        ("state.append_only", config.state.append_only),
+        ("streaming.enabled", config.streaming.enabled),
+    ):
+        if state and enabled:
+            logging.warning(f"The backfill reads and processes every file whole, ignoring {option}")
+    publisher = None
+    if not dry_run:
+        publisher = Publisher(config.topic.batch_settings, config.topic.flow_control, config.topic.compression)
+    metadata = Gobits()
+
+    # Spawned workers do not inherit the gRPC channels of this process
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers, initializer=init_worker, initargs=(config_path,)) as pool:
+        # Format at most two files per worker ahead of the file being applied
+        pending = deque()
+        remaining = iter(sources)
+        for source in remaining:
+            pending.append((source, pool.apply_async(format_source, (source,))))
+            if len(pending) >= 2 * workers:
+                break
+
+        while pending:
+            (bucket, name), result = pending.popleft()
+            for source in remaining:
+                pending.append((source, pool.apply_async(format_source, (source,))))
+                break
+
+            try:
+                records, counts, durations = result.get()
+            except Exception:
+                logging.error(f"Failed to format {bucket + '/' if bucket else ''}{name}, stopping")
+                raise
+            for key, value in counts.items():
+                metrics.add(key, value)
+            for key, value in durations.items():
+                metrics.durations[key] += value
+            metrics.add("files")
+
+            keys = {record[config.state.property] for record in records} if deletions else set()
+            if deletions and (not keys or counts.get("records_dropped")):
+                logging.warning(f"Not publishing deletions of {name}, the file has no records "
+                                f"or records failed to format")
+                keys = set()
+
+            if dry_run:
+                if state:
+                    with metrics.stage("state_diff"):
+                        records = state.difference(records, config.state.kind, config.state.property)
+                        removed = state.removed(keys, config.state.kind, config.state.property) if keys else []
+                    metrics.add("records_removed", len(removed))
+                metrics.add("records_new", len(records))
+                published = 0
+            else:
+                try:
+                    published = pipeline.process(config, records, state, publisher, metadata, metrics)
+                    if keys:
+                        published += pipeline.process_removed(config, keys, state, publisher, metadata, metrics)
+                finally:
+                    if state:
+                        with metrics.stage("state_write"):
+                            state.flush()
+
+            logging.info(f"{bucket + '/' if bucket else ''}{name}: {counts.get('records_out', 0)} records, "
+                         f"{published} published")
+
+    return metrics
+
+
+def summary(metrics: Metrics, workers: int, dry_run: bool) -> str:
+    """
+    Returns the throughput summary of a backfill.
+
+    :param metrics: Metrics of the backfill.
+    :param workers: Number of worker processes.
+    :param dry_run: Whether nothing was published.
+    """
+
+    entry = metrics.entry()["metrics"]
+    counts = entry["counts"]
+    durations = entry["durations"]
+    total = durations["total"]
+    records = counts.get("records_out", 0)
+
+    lines = [
+        f"files:     {counts.get('files', 0)} in {total:.1f}s with {workers} workers"
+        f"{' (dry run)' if dry_run else ''}",
+        f"records:   {counts.get('records_in', 0)} read, {records} formatted, "
+        f"{counts.get('records_dropped', 0)} dropped, {counts.get('records_new', 0)} new, "
+        f"{counts.get('records_removed', 0)} removed, {counts.get('records_published', 0)} published",
+        f"rate:      {records / total if total else 0:,.0f} records/s, "
+        f"{counts.get('bytes_downloaded', 0) / 2 ** 20 / total if total else 0:,.1f} MiB/s downloaded",
+        "seconds:   " + ", ".join(f"{name} {value:.1f}" for name, value in durations.items() if name != "total"),
+    ]
+
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sources", nargs="+", help="local files or directories, gs:// objects or prefixes")
+    parser.add_argument("--config", default="config.yaml", help="configuration file, defaults to config.yaml")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of processes")
+    parser.add_argument("--dry-run", action="store_true", help="do not publish or write the state")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    sources = get_sources(args.sources)
+    logging.info(f"Backfilling {len(sources)} files")
+
+    try:
+        metrics = backfill(args.config, sources, args.workers, args.dry_run)
+    finally:
+        clients.reset()
+
+    print(summary(metrics, args.workers, args.dry_run))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
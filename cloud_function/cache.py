@@ -0,0 +1,182 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Approximate bytes of an entry besides its key name and digest: the key and
+# value tuples, the expiry time and the slot and links in the ordered dict
+ENTRY_OVERHEAD = 200
+
+
+class DigestCache:
+    """
+    Bounded in-memory cache of the digests of records known to be equal
+    to their state, kept by a warm instance between invocations.
+
+    Entries are evicted least recently used first when the cache exceeds
+    its size, and expire after a number of seconds. Every kind has a
+    version, the version marker of the state the entries were read from,
+    and the entries of a kind are invalidated when the marker changes.
+
+    :param max_bytes: Approximate maximum size of the cache in bytes.
+    :param ttl:       Seconds an entry is valid.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 3600):
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self.invalidated = 0
+
+    @property
+    def stats(self) -> dict:
+        """Counters of the lookups, evictions and invalidations."""
+
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "invalidated": self.invalidated,
+        }
+
+    @property
+    def size(self) -> int:
+        """Approximate size of the cache in bytes."""
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, kind: str, name):
+        """
+        Returns the digest of a record, None when it is not cached or
+        expired.
+
+        :param kind: Kind name.
+        :param name: Key of the record.
+        """
+
+        with self._lock:
+            entry = self._entries.get((kind, name))
+            if entry is None:
+                self.misses += 1
+                return None
+
+            digest, expires = entry
+            if expires < time.monotonic():
+                self._remove((kind, name))
+                self.expired += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end((kind, name))
+            self.hits += 1
+
+            return digest
+
+    def put_many(self, kind: str, digests: dict):
+        """
+        Caches the digests of records, evicting the least recently used
+        entries beyond the size of the cache.
+
+        :param kind:    Kind name.
+        :param digests: Dictionary of record key to digest.
+        """
+
+        expires = time.monotonic() + self._ttl
+        with self._lock:
+            for name, digest in digests.items():
+                self._remove((kind, name))
+                self._entries[(kind, name)] = (digest, expires)
+                self._bytes += _entry_size(name, digest)
+
+            while self._bytes > self._max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evicted += 1
+
+    def discard(self, kind: str, names: list):
+        """
+        Removes the digests of records.
+
+        :param kind:  Kind name.
+        :param names: Keys of the records.
+        """
+
+        with self._lock:
+            for name in names:
+                self._remove((kind, name))
+
+    def version(self, kind: str):
+        """
+        Returns the version of the state the entries of a kind were read
+        from, None when it is not known.
+
+        :param kind: Kind name.
+        """
+
+        return self._versions.get(kind)
+
+    def validate(self, kind: str, version: str):
+        """
+        Sets the version of a kind, invalidating its entries unless they
+        were read from that version. Without a version, all entries of
+        the kind are invalidated.
+
+        :param kind:    Kind name.
+        :param version: The current version of the state.
+        """
+
+        self.advance(kind, version, version)
+
+    def advance(self, kind: str, previous: str, version: str):
+        """
+        Sets the version of a kind after it changed from a previous version,
+        invalidating its entries unless they were read from the previous
+        version. Without a previous version, all entries of the kind are
+        invalidated.
+
+        :param kind:     Kind name.
+        :param previous: The version the state changed from.
+        :param version:  The new version of the state.
+        """
+
+        with self._lock:
+            if previous is None or self._versions.get(kind) != previous:
+                stale = [key for key in self._entries if key[0] == kind]
+                for key in stale:
+                    self._remove(key)
+                if stale:
+                    self.invalidated += 1
+            self._versions[kind] = version
+
+    def _remove(self, key: tuple):
+        """
+        Removes an entry, if it exists.
+
+        :param key: Tuple of kind name and record key.
+        """
+
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= _entry_size(key[1], entry[0])
+
+
+def _entry_size(name, digest: str) -> int:
+    """
+    Returns the approximate size of an entry in bytes.
+
+    :param name:   Key of the record.
+    :param digest: Digest of the record.
+    """
+
+    return sys.getsizeof(name) + sys.getsizeof(digest) + ENTRY_OVERHEAD
@@ -0,0 +1,90 @@
+import json
+import logging
+import threading
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _get(key: tuple, factory):
+    """
+    Returns the client registered under a key, creating it once.
+
+    :param key:     Key of the client.
+    :param factory: Function creating the client.
+    """
+
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = factory()
+
+    return client
+
+
+def storage_client():
+    """Returns the shared Google Cloud Storage client."""
+
+    from google.cloud import storage
+
+    return _get(("storage",), storage.Client)
+
+
+def datastore_client():
+    """Returns the shared Google Cloud Datastore client."""
+
+    from google.cloud import datastore
+
+    return _get(("datastore",), datastore.Client)
+
+
+def publisher_client(batch_settings: dict = {}, flow_control: dict = {}):
+    """
+    Returns the shared Google Cloud Pub/Sub client for batch settings and
+    flow control limits. Publishing blocks while the limits are reached.
+
+    :param batch_settings: pubsub_v1.types.BatchSettings of the client.
+    :param flow_control:   Maximum number of messages in flight, max_messages
+                           (default 1000), and bytes in flight, max_bytes
+                           (default 100 MiB).
+    """
+
+    from google.cloud import pubsub_v1
+    from google.cloud.pubsub_v1 import types
+
+    def create():
+        publisher_options = types.PublisherOptions(
+            flow_control=types.PublishFlowControl(
+                message_limit=flow_control.get("max_messages", 1000),
+                byte_limit=flow_control.get("max_bytes", 100 * 1024 * 1024),
+                limit_exceeded_behavior=types.LimitExceededBehavior.BLOCK,
+            )
+        )
+        return pubsub_v1.PublisherClient(
+            batch_settings=types.BatchSettings(**batch_settings), publisher_options=publisher_options
+        )
+
+    return _get(
+        ("publisher", json.dumps(batch_settings, sort_keys=True), json.dumps(flow_control, sort_keys=True)),
+        create,
+    )
+
+
+def reset():
+    """
+    Discards all clients, so they are created again when needed.
+    Publisher clients are stopped first.
+    """
+
+    with _lock:
+        clients = list(_clients.items())
+        _clients.clear()
+
+    for key, client in clients:
+        if key[0] == "publisher":
+            try:
+                client.stop()
+            except Exception as e:
+                logging.warning(f"Failed to stop publisher client: {e}")
@@ -0,0 +1,133 @@
+import json
+import math
+from datetime import date, time
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+if orjson:
+    SEPARATOR = b","
+    OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+else:
+    SEPARATOR = b", "
+
+
+def dumps(obj) -> bytes:
+    """
+    Serializes an object to json bytes, with orjson when it is installed.
+
+    Without orjson the result is exactly json.dumps(obj).encode("utf-8").
+    With orjson the json is equivalent, but has no whitespace, writes
+    non-ASCII characters as UTF-8 instead of \\u escapes, writes NaN and
+    Infinity (e.g. empty pandas cells) as null instead of the non-standard
+    literals and serializes datetime and numpy values instead of raising.
+    Values orjson does not support, such as integers beyond 64 bits, fall
+    back to the standard library, with NaN and Infinity written as null as
+    well. Typed values read from Parquet and Arrow files that json does not
+    support are serialized with _default.
+
+    :param obj: The object to serialize.
+    """
+
+    if orjson:
+        try:
+            return orjson.dumps(obj, default=_default, option=OPTIONS)
+        except TypeError:
+            return json.dumps(
+                _finite(obj), separators=(",", ":"), ensure_ascii=False, default=lambda o: _finite(_default(o))
+            ).encode("utf-8")
+
+    return json.dumps(obj, default=_default).encode("utf-8")
+
+
+def _default(obj):
+    """
+    Serializes dates, times, decimals and arrays: dates and times in ISO
+    8601 format, missing timestamps (NaT) as null, decimals as numbers and
+    arrays as lists.
+
+    :param obj: The object json does not support.
+    """
+
+    if isinstance(obj, (date, time)):
+        # NaT is a datetime that is not equal to itself
+        return None if obj != obj else obj.isoformat()
+    elif isinstance(obj, Decimal):
+        return float(obj)
+    elif hasattr(obj, "tolist"):
+        return obj.tolist()
+
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _finite(obj):
+    """
+    Returns an object with NaN and Infinity replaced by None, as orjson
+    writes them.
+
+    :param obj: The object to serialize.
+    """
+
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    elif isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+
+    return obj
+
+
+def plain(obj):
+    """
+    Returns an object with the values that are not json types replaced as
+    they are serialized, so they are also stored as such in the state:
+    dates and times by ISO 8601 strings, missing timestamps (NaT) by None,
+    decimals by numbers and arrays by lists.
+
+    :param obj: The object to convert.
+    """
+
+    if isinstance(obj, dict):
+        return {key: plain(value) for key, value in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [plain(value) for value in obj]
+    elif isinstance(obj, (date, time, Decimal)) or hasattr(obj, "tolist"):
+        return plain(_default(obj))
+
+    return obj
+
+
+def loads(data):
+    """
+    Deserializes json bytes or string, with orjson when it is installed.
+
+    :param data: The json to deserialize.
+    """
+
+    if orjson:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+
+    return json.loads(data)
+
+
+def canonical(obj) -> bytes:
+    """
+    Serializes an object to canonical json bytes, with sorted keys and
+    without whitespace.
+
+    Always uses the standard library, so digests of the output stay the
+    same whether or not orjson is installed.
+
+    :param obj: The object to serialize.
+    """
+
+    return json.dumps(
+        obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    ).encode("utf-8")
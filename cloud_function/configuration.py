@@ -1,12 +1,16 @@
 import yaml
+from digest import record_digest
 
 
 class Configuration:
     """
     Class that holds configuration variables.
+
+    :path: Path of the configuration file.
     """
 
-    def __init__(self):
+    def __init__(self, path: str = 'config.yaml'):
+        self._path = path
         self._configuration = self._read()
 
     def _read(self) -> dict:
@@ -14,11 +18,16 @@ class Configuration:
         Reads configuration from a config.py file.
         """
 
-        with open('config.yaml') as f:
+        with open(self._path) as f:
             configuration = yaml.safe_load(f)
 
         return configuration
 
+    @property
+    def digest(self):
+        """Digest of the configuration."""
+        return record_digest(self._configuration)
+
     @property
     def prefix_filter(self):
         """Prefix to filter files on."""
@@ -56,6 +65,30 @@ class Configuration:
         content = self._configuration.get('topic', {})
         return TopicConfiguration(content)
 
+    @property
+    def streaming(self):
+        """Configuration about reading files in chunks."""
+        content = self._configuration.get('streaming', {})
+        return StreamingConfiguration(content)
+
+    @property
+    def parallel(self):
+        """Configuration about formatting in parallel."""
+        content = self._configuration.get('parallel', {})
+        return ParallelConfiguration(content)
+
+    @property
+    def profiling(self):
+        """Configuration about profiling invocations."""
+        content = self._configuration.get('profiling', {})
+        return ProfilingConfiguration(content)
+
+    @property
+    def cache(self):
+        """Configuration about caching the state between invocations."""
+        content = self._configuration.get('cache', {})
+        return CacheConfiguration(content)
+
 
 class TopicConfiguration:
     """
@@ -70,6 +103,10 @@ class TopicConfiguration:
         self._subject = configuration.get("subject")
         self._batch_size = configuration.get("batch_size")
         self._batch_settings = configuration.get("batch_settings", {})
+        self._flow_control = configuration.get("flow_control", {})
+        self._max_message_bytes = configuration.get("max_message_bytes")
+        self._compression = configuration.get("compression")
+        self._delete_action = configuration.get("delete_action", "delete")
 
     @property
     def project_id(self):
@@ -121,6 +158,46 @@ class TopicConfiguration:
         """Batch_settings setter."""
         self._batch_settings = value
 
+    @property
+    def flow_control(self):
+        """Limits of messages in flight, max_messages and max_bytes."""
+        return self._flow_control
+
+    @flow_control.setter
+    def flow_control(self, value):
+        """Flow_control setter."""
+        self._flow_control = value
+
+    @property
+    def max_message_bytes(self):
+        """Maximum message size in bytes to pack records into."""
+        return self._max_message_bytes
+
+    @max_message_bytes.setter
+    def max_message_bytes(self, value):
+        """Max_message_bytes setter."""
+        self._max_message_bytes = value
+
+    @property
+    def compression(self):
+        """Message compression, gzip or br."""
+        return self._compression
+
+    @compression.setter
+    def compression(self, value):
+        """Compression setter."""
+        self._compression = value
+
+    @property
+    def delete_action(self):
+        """Action attribute of messages with deleted records."""
+        return self._delete_action
+
+    @delete_action.setter
+    def delete_action(self, value):
+        """Delete_action setter."""
+        self._delete_action = value
+
 
 class StateConfiguration:
     """
@@ -133,6 +210,16 @@ class StateConfiguration:
         self._type = state.get("type")
         self._kind = state.get("kind")
         self._property = state.get("property")
+        self._mode = state.get("mode", "full")
+        self._bucket = state.get("bucket")
+        self._prefix = state.get("prefix", "state/")
+        self._directory = state.get("directory")
+        self._fingerprint = state.get("fingerprint", False)
+        self._append_only = state.get("append_only", False)
+        self._deletions = state.get("deletions", False)
+        self._scan_threshold = state.get("scan_threshold", 0.5)
+        self._chunk_size = state.get("chunk_size", 300)
+        self._concurrency = state.get("concurrency", 1)
 
     @property
     def type(self):
@@ -154,6 +241,107 @@ class StateConfiguration:
         """Kind setter"""
         self._kind = value
 
+    @property
+    def mode(self):
+        """State mode, full records or digests of records."""
+        return self._mode
+
+    @mode.setter
+    def mode(self, value):
+        """Mode setter."""
+        self._mode = value
+
+    @property
+    def bucket(self):
+        """Bucket holding the state snapshots."""
+        return self._bucket
+
+    @bucket.setter
+    def bucket(self, value):
+        """Bucket setter."""
+        self._bucket = value
+
+    @property
+    def prefix(self):
+        """Prefix of the state snapshot names."""
+        return self._prefix
+
+    @prefix.setter
+    def prefix(self, value):
+        """Prefix setter."""
+        self._prefix = value
+
+    @property
+    def directory(self):
+        """Local directory holding the state snapshots."""
+        return self._directory
+
+    @directory.setter
+    def directory(self, value):
+        """Directory setter."""
+        self._directory = value
+
+    @property
+    def fingerprint(self):
+        """Skip files identical to the last processed file."""
+        return self._fingerprint
+
+    @fingerprint.setter
+    def fingerprint(self, value):
+        """Fingerprint setter."""
+        self._fingerprint = value
+
+    @property
+    def append_only(self):
+        """Only read the content appended since the last processed file."""
+        return self._append_only
+
+    @append_only.setter
+    def append_only(self, value):
+        """Append_only setter."""
+        self._append_only = value
+
+    @property
+    def deletions(self):
+        """Files are full snapshots, publish the records missing from a file as deleted."""
+        return self._deletions
+
+    @deletions.setter
+    def deletions(self, value):
+        """Deletions setter."""
+        self._deletions = value
+
+    @property
+    def scan_threshold(self):
+        """Fraction of a Datastore kind above which the kind is scanned instead of looked up."""
+        return self._scan_threshold
+
+    @scan_threshold.setter
+    def scan_threshold(self, value):
+        """Scan_threshold setter."""
+        self._scan_threshold = value
+
+    @property
+    def chunk_size(self):
+        """Number of Datastore entities per lookup or write."""
+        return self._chunk_size
+
+    @chunk_size.setter
+    def chunk_size(self, value):
+        """Chunk_size setter."""
+        self._chunk_size = value
+
+    @property
+    def concurrency(self):
+        """Number of concurrent Datastore lookups or writes."""
+        return self._concurrency
+
+    @concurrency.setter
+    def concurrency(self, value):
+        """Concurrency setter."""
+        self._concurrency = value
+
+    # Defined last, as it shadows the property decorator in the class body
     @property
     def property(self):
         """"Datastore property name."""
@@ -163,3 +351,208 @@ class StateConfiguration:
     def property(self, value):
         """Property setter."""
         self._property = value
+
+
+class StreamingConfiguration:
+    """
+    Class that holds streaming configuration.
+
+    :streaming: Dictionary with streaming information.
+    """
+
+    def __init__(self, streaming: dict):
+        self._enabled = streaming.get("enabled", False)
+        self._chunk_size = streaming.get("chunk_size", 10000)
+        self._pipelined = streaming.get("pipelined", False)
+        self._queue_depth = streaming.get("queue_depth", 2)
+
+    @property
+    def enabled(self):
+        """Read, format, publish and store records in chunks."""
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        """Enabled setter."""
+        self._enabled = value
+
+    @property
+    def chunk_size(self):
+        """Maximum number of records per chunk."""
+        return self._chunk_size
+
+    @chunk_size.setter
+    def chunk_size(self, value):
+        """Chunk_size setter."""
+        self._chunk_size = value
+
+    @property
+    def pipelined(self):
+        """Compare, publish and store chunks while the next ones are read."""
+        return self._pipelined
+
+    @pipelined.setter
+    def pipelined(self, value):
+        """Pipelined setter."""
+        self._pipelined = value
+
+    @property
+    def queue_depth(self):
+        """Maximum number of chunks waiting for every pipelined stage."""
+        return self._queue_depth
+
+    @queue_depth.setter
+    def queue_depth(self, value):
+        """Queue_depth setter."""
+        self._queue_depth = value
+
+
+class ParallelConfiguration:
+    """
+    Class that holds parallel formatting configuration.
+
+    :parallel: Dictionary with parallel formatting information.
+    """
+
+    def __init__(self, parallel: dict):
+        self._workers = parallel.get("workers", 1)
+        self._threshold = parallel.get("threshold", 100000)
+        self._chunk_size = parallel.get("chunk_size", 10000)
+
+    @property
+    def workers(self):
+        """Number of processes to format records with."""
+        return self._workers
+
+    @workers.setter
+    def workers(self, value):
+        """Workers setter."""
+        self._workers = value
+
+    @property
+    def threshold(self):
+        """Minimum number of records to format in parallel."""
+        return self._threshold
+
+    @threshold.setter
+    def threshold(self, value):
+        """Threshold setter."""
+        self._threshold = value
+
+    @property
+    def chunk_size(self):
+        """Number of records per chunk sent to a process."""
+        return self._chunk_size
+
+    @chunk_size.setter
+    def chunk_size(self, value):
+        """Chunk_size setter."""
+        self._chunk_size = value
+
+
+class ProfilingConfiguration:
+    """
+    Class that holds profiling configuration.
+
+    :profiling: Dictionary with profiling information.
+    """
+
+    def __init__(self, profiling: dict):
+        self._enabled = profiling.get("enabled", False)
+        self._sample_rate = profiling.get("sample_rate", 1.0)
+        self._cpu = profiling.get("cpu", True)
+        self._memory = profiling.get("memory", False)
+        self._top = profiling.get("top", 20)
+
+    @property
+    def enabled(self):
+        """Profile invocations and log the results with the metrics."""
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        """Enabled setter."""
+        self._enabled = value
+
+    @property
+    def sample_rate(self):
+        """Fraction of the invocations to profile."""
+        return self._sample_rate
+
+    @sample_rate.setter
+    def sample_rate(self, value):
+        """Sample_rate setter."""
+        self._sample_rate = value
+
+    @property
+    def cpu(self):
+        """Profile function calls with cProfile."""
+        return self._cpu
+
+    @cpu.setter
+    def cpu(self, value):
+        """Cpu setter."""
+        self._cpu = value
+
+    @property
+    def memory(self):
+        """Trace memory allocations with tracemalloc."""
+        return self._memory
+
+    @memory.setter
+    def memory(self, value):
+        """Memory setter."""
+        self._memory = value
+
+    @property
+    def top(self):
+        """Number of functions and lines to report."""
+        return self._top
+
+    @top.setter
+    def top(self, value):
+        """Top setter."""
+        self._top = value
+
+
+class CacheConfiguration:
+    """
+    Class that holds state cache configuration.
+
+    :cache: Dictionary with cache information.
+    """
+
+    def __init__(self, cache: dict):
+        self._enabled = cache.get("enabled", False)
+        self._max_bytes = cache.get("max_bytes", 64 * 1024 * 1024)
+        self._ttl = cache.get("ttl", 3600)
+
+    @property
+    def enabled(self):
+        """Cache the digests of records in the Datastore state."""
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        """Enabled setter."""
+        self._enabled = value
+
+    @property
+    def max_bytes(self):
+        """Approximate maximum size of the cache in bytes."""
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, value):
+        """Max_bytes setter."""
+        self._max_bytes = value
+
+    @property
+    def ttl(self):
+        """Seconds a cached digest is valid."""
+        return self._ttl
+
+    @ttl.setter
+    def ttl(self, value):
+        """Ttl setter."""
+        self._ttl = value
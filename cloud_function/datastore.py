@@ -1,15 +1,74 @@
-from google.cloud import datastore
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import clients
+from cache import DigestCache
+from diff import Diff
+from digest import record_digest
+from retry.api import retry_call
+
+
+def transient_errors() -> tuple:
+    """Returns the Google API errors that are worth retrying."""
+
+    from google.api_core import exceptions
+
+    return (
+        exceptions.Aborted,
+        exceptions.DeadlineExceeded,
+        exceptions.InternalServerError,
+        exceptions.ServiceUnavailable,
+        exceptions.TooManyRequests,
+    )
 
 
 class GoogleCloudDatastore:
     """
     Class to interact with Google Cloud Datastore.
+
+    :param mode:           State mode, "full" stores the records as entities
+                           and "digest" only stores a digest of every record.
+    :param chunk_size:     Number of entities per lookup or write.
+    :param concurrency:    Number of chunks to look up or write concurrently.
+    :param client:         Datastore client to use instead of the shared one.
+    :param scan_threshold: Fraction of a kind from which the records are
+                           compared with a scan of the kind instead of
+                           lookups by key, 0 to always look up.
+    :param cache:          Cache of the digests of records equal to their
+                           entities, to skip their lookups.
     """
 
-    chunk_size = 300
+    digest_property = "_digest"
+    metadata_kind = "EventPublisherMetadata"
+
+    def __init__(self, mode: str = "full", chunk_size: int = 300, concurrency: int = 1, client=None,
+                 scan_threshold: float = 0.5, cache: DigestCache = None):
+        self._client = client or clients.datastore_client()
+        self._mode = mode or "full"
+        self._chunk_size = chunk_size or 300
+        self._concurrency = concurrency or 1
+        self._scan_threshold = scan_threshold
+        self._counts = {}
+        self._scans = {}
+        self._cache = cache
+        self._validated = set()
+        self._written = {}
+
+    def _map(self, function, chunks) -> list:
+        """
+        Applies a function to every chunk, concurrently when configured.
+        The results are returned in the order of the chunks.
+
+        :param function: Function to apply.
+        :param chunks:   Chunks to apply the function to.
+        """
+
+        if self._concurrency > 1:
+            with ThreadPoolExecutor(max_workers=self._concurrency) as executor:
+                return list(executor.map(function, chunks))
 
-    def __init__(self):
-        self._client = datastore.Client()
+        return [function(chunk) for chunk in chunks]
 
     def put_multi(self, data: list, kind: str, property: str):
         """
@@ -19,15 +78,131 @@ class GoogleCloudDatastore:
         :param property: Datastore property name.
         """
 
-        for chunk in self._chunks(data, GoogleCloudDatastore.chunk_size):
+        from google.cloud import datastore
+
+        def put_chunk(chunk):
             entities = []
             for item in chunk:
                 entity = datastore.Entity(
                     key=self._client.key(kind, item[property]))
-                entity.update(item)
+                if self._mode == "digest":
+                    entity[GoogleCloudDatastore.digest_property] = record_digest(item)
+                else:
+                    entity.update(item)
                 entities.append(entity)
+            self._put_multi(entities)
+
+            # Keep a scan of the kind up to date for the next chunks
+            if kind in self._scans:
+                self._scans[kind].update((entity.key.id_or_name, self._scanned(entity)) for entity in entities)
+
+        self._map(put_chunk, self._chunks(data, self._chunk_size))
+
+        written = self._written.setdefault(kind, {})
+        if self._cache is not None:
+            # The digests are cached once the version marker is written
+            written.update((item[property], record_digest(item)) for item in data)
+
+    def delete_multi(self, data: list, kind: str, property: str):
+        """
+        Delete the entities of multiple records from datastore.
+
+        :param kind:     Datastore kind name.
+        :param property: Datastore property name.
+        """
+
+        def delete_chunk(chunk):
+            keys = [self._client.key(kind, item[property]) for item in chunk]
+            self._retry(self._client.delete_multi, keys)
+
+            if kind in self._scans:
+                for key in keys:
+                    self._scans[kind].pop(key.id_or_name, None)
+
+        self._map(delete_chunk, self._chunks(data, self._chunk_size))
+
+        written = self._written.setdefault(kind, {})
+        if self._cache is not None:
+            keys = [item[property] for item in data]
+            self._cache.discard(kind, keys)
+            for key in keys:
+                written.pop(key, None)
+
+    def _validate_cache(self, kind: str):
+        """
+        Invalidates the cached digests of a kind when the kind was changed
+        by another instance since they were cached, or has no version
+        marker, once per invocation.
+
+        :param kind: Datastore kind name.
+        """
+
+        if kind not in self._validated:
+            marker = self.get_metadata(kind, "version")
+            self._cache.validate(kind, marker["version"] if marker else None)
+            self._validated.add(kind)
+
+    def _update_version(self, kind: str):
+        """
+        Writes a new version marker of a kind after changing it, whether or
+        not this instance caches, so the caches of other instances are
+        invalidated. The cached digests of this instance are kept when the
+        marker was still the version they were read from, and invalidated
+        when another instance changed the kind in the meantime.
+
+        :param kind: Datastore kind name.
+        """
+
+        version = uuid.uuid4().hex
+        key = self._metadata_key(kind, "version")
+
+        def update():
             with self._client.transaction():
-                self._client.put_multi(entities)
+                marker = self._client.get(key)
+                self._client.put(self._metadata_entity(key, {"version": version}))
+            return marker["version"] if marker else None
+
+        previous = self._retry(update)
+        if self._cache is not None:
+            self._cache.advance(kind, previous, version)
+
+    def _retry(self, function, *args):
+        """
+        Calls a function, retrying with backoff on transient errors.
+
+        :param function: The function to call.
+        :param args:     Arguments of the function.
+        """
+
+        return retry_call(
+            function, fargs=args, exceptions=transient_errors(),
+            tries=5, delay=0.5, backoff=2, jitter=(0, 0.5), logger=None,
+        )
+
+    def _put_multi(self, entities: list):
+        """
+        Puts entities, retrying on transient errors.
+
+        :param entities: The entities to put.
+        """
+
+        self._retry(self._client.put_multi, entities)
+
+    def _get_multi(self, keys: list):
+        """
+        Gets entities, retrying on transient errors.
+
+        :param keys: The keys of the entities.
+
+        :return: The entities found and the keys of the missing entities.
+        """
+
+        def get_multi():
+            missing = []
+            found = self._client.get_multi(keys, missing=missing)
+            return found, [entity.key for entity in missing]
+
+        return self._retry(get_multi)
 
     def _chunks(self, lst: list, n: int):
         """
@@ -40,29 +215,252 @@ class GoogleCloudDatastore:
         for i in range(0, len(lst), n):
             yield lst[i:i + n]
 
-    def difference(self, data: list, kind: str, property: str):
+    def _changed(self, new: dict, entity) -> bool:
         """
-        Returns a list of objects that are not in datastore,
-        given an entity and property.
+        Indicates whether a record differs from its state entity.
+
+        Entities holding a digest are compared by digest, entities holding
+        a full record field by field. Both modes therefore accept state
+        written by the other.
+
+        :param new:    The new record.
+        :param entity: The state entity of the record.
+        """
+
+        if GoogleCloudDatastore.digest_property in entity:
+            return entity[GoogleCloudDatastore.digest_property] != record_digest(new)
+
+        for key, value in new.items():
+            if key not in entity:
+                return True
+            elif value != entity.get(key):
+                return True
+
+        return False
+
+    def _count(self, kind: str):
+        """
+        Returns the number of entities of a kind according to the Datastore
+        statistics, None when there are no statistics of the kind yet.
+
+        The statistics are updated about once a day, so the count is an
+        estimate.
+
+        :param kind: Datastore kind name.
+        """
+
+        def count():
+            query = self._client.query(kind="__Stat_Kind__")
+            query.add_filter("kind_name", "=", kind)
+            stats = list(query.fetch(limit=1))
+            return stats[0]["count"] if stats else None
+
+        if kind not in self._counts:
+            self._counts[kind] = self._retry(count)
+
+        return self._counts[kind]
+
+    def _scanned(self, entity):
+        """
+        Returns what a scan of a kind holds of an entity: the entity when it
+        only holds a digest, None when it has to be looked up.
+
+        :param entity: Datastore entity.
+        """
+
+        return entity if set(entity) == {GoogleCloudDatastore.digest_property} else None
+
+    def _scan(self, kind: str, size: int):
+        """
+        Returns the entities of a kind by key name when a number of records
+        is compared with a scan of the kind, None when they are looked up.
+
+        A kind is scanned once when the records are at least the scan
+        threshold fraction of it, after which the scan is kept up to date.
+        The scan is a keys-only query, so only records in the kind are looked
+        up and full records are never all held in memory. In digest mode the
+        digests are read with a projection query as well, and records equal
+        to their digest are not looked up either. Keys of entities that have
+        to be looked up map to None.
+
+        :param kind: Datastore kind name.
+        :param size: Number of records to compare.
+        """
+
+        if kind not in self._scans:
+            # A single lookup is always cheaper than a scan
+            if not self._scan_threshold or size <= self._chunk_size:
+                return None
+
+            count = self._count(kind)
+            if count is None or size < self._scan_threshold * count:
+                return None
+
+            logging.info(f"Scanning the keys of about {count} entities of {kind} to compare {size} records")
+
+            def scan():
+                query = self._client.query(kind=kind)
+                query.keys_only()
+                entities = {entity.key.id_or_name: None for entity in query.fetch()}
+                if self._mode == "digest":
+                    query = self._client.query(kind=kind, projection=[GoogleCloudDatastore.digest_property])
+                    entities.update((entity.key.id_or_name, entity) for entity in query.fetch())
+                return entities
+
+            self._scans[kind] = self._retry(scan)
+
+        return self._scans[kind]
+
+    def diff(self, data: list, kind: str, property: str) -> Diff:
+        """
+        Returns the records that are not in datastore or differ from it,
+        given an entity and property, in the order of the data.
+
+        The entities are looked up by key, or, when the records are a large
+        fraction of the kind, read with a single scan of the kind. Records
+        equal to their digest in the cache are skipped.
 
         :param kind:     Datastore kind name.
         :param property: Datastore property name.
         """
 
-        result = []
-        for chunk in self._chunks(data, GoogleCloudDatastore.chunk_size):
+        digests = {}
+        if self._cache is not None:
+            # Records equal to their cached digest are not compared again
+            self._validate_cache(kind)
+            digests = {item[property]: record_digest(item) for item in data}
+            data = [item for item in data if self._cache.get(kind, item[property]) != digests[item[property]]]
+
+        state = self._scan(kind, len(data))
+
+        def diff_chunk(chunk):
             records = {item[property]: item for item in chunk}
-            keys = [self._client.key(kind, key) for key in records.keys()]
-            missing_items = []
-            state = self._client.get_multi(keys, missing=missing_items)
-            for record in state:
-                new = records[record.key.id_or_name]
-                for key, value in new.items():
-                    if key not in record:
-                        result.append(new)
-                        break
-                    elif value != record.get(key):
-                        result.append(new)
-                        break
-            result.extend([records[missing.key.id_or_name] for missing in missing_items])
+            if state is None:
+                lookup = list(records)
+            else:
+                # Records missing from the scan are new
+                lookup = [key for key in records if key in state and state[key] is None]
+            found, _ = self._get_multi([self._client.key(kind, key) for key in lookup]) if lookup else ([], [])
+            entities = {entity.key.id_or_name: entity for entity in found}
+            if state is not None:
+                entities.update((key, state[key]) for key in records if state.get(key) is not None)
+
+            added = {key for key in records if key not in entities}
+            changed = {key for key in records if key in entities and self._changed(records[key], entities[key])}
+            if self._cache is not None:
+                self._cache.put_many(kind, {
+                    key: digests[key] for key in records if key in entities and key not in changed
+                })
+
+            return [item for key, item in records.items() if key in added or key in changed], added, changed
+
+        result = Diff([], set(), set())
+        for records, added, changed in self._map(diff_chunk, self._chunks(data, self._chunk_size)):
+            result.records.extend(records)
+            result.added.update(added)
+            result.changed.update(changed)
+
         return result
+
+    def difference(self, data: list, kind: str, property: str):
+        """
+        Returns a list of objects that are not in datastore,
+        given an entity and property, in the order of the data.
+
+        :param kind:     Datastore kind name.
+        :param property: Datastore property name.
+        """
+
+        return self.diff(data, kind, property).records
+
+    def removed(self, keys: set, kind: str, property: str) -> list:
+        """
+        Returns the records in datastore whose keys are not in a set of
+        keys. Records stored as digest only hold their key.
+
+        :param keys:     Keys of all records of a full snapshot.
+        :param kind:     Datastore kind name.
+        :param property: Datastore property name.
+        """
+
+        state = self._scans.get(kind)
+        if state is None:
+            def names():
+                query = self._client.query(kind=kind)
+                query.keys_only()
+                return {entity.key.id_or_name: None for entity in query.fetch()}
+
+            state = self._retry(names)
+
+        entities = [entity for name, entity in state.items() if name not in keys and entity is not None]
+        missing = [name for name, entity in state.items() if name not in keys and entity is None]
+        for found, _ in self._map(
+            lambda chunk: self._get_multi([self._client.key(kind, name) for name in chunk]),
+            self._chunks(missing, self._chunk_size),
+        ):
+            entities.extend(found)
+
+        return [
+            {property: entity.key.id_or_name} if GoogleCloudDatastore.digest_property in entity else dict(entity)
+            for entity in entities
+        ]
+
+    def flush(self):
+        """
+        Writes a new version marker of every kind changed since the last
+        flush, once per invocation, and caches the digests of the records
+        written. Entities are written immediately.
+        """
+
+        for kind, digests in sorted(self._written.items()):
+            self._update_version(kind)
+            if self._cache is not None:
+                self._cache.put_many(kind, digests)
+        self._written.clear()
+
+    def _metadata_key(self, kind: str, name: str):
+        """
+        Returns the key of metadata stored for a kind.
+
+        :param kind: Datastore kind name.
+        :param name: Name of the metadata.
+        """
+
+        return self._client.key(GoogleCloudDatastore.metadata_kind, f"{kind}/{name}")
+
+    def _metadata_entity(self, key, value: dict):
+        """
+        Returns the entity of metadata, with unindexed properties.
+
+        :param key:   Key of the metadata.
+        :param value: Dictionary with the metadata.
+        """
+
+        from google.cloud import datastore
+
+        entity = datastore.Entity(key=key, exclude_from_indexes=tuple(value))
+        entity.update(value)
+        return entity
+
+    def get_metadata(self, kind: str, name: str):
+        """
+        Returns metadata stored for a kind, None if it does not exist.
+
+        :param kind: Datastore kind name.
+        :param name: Name of the metadata.
+        """
+
+        entity = self._retry(self._client.get, self._metadata_key(kind, name))
+
+        return dict(entity) if entity else None
+
+    def put_metadata(self, kind: str, name: str, value: dict):
+        """
+        Stores metadata for a kind.
+
+        :param kind:  Datastore kind name.
+        :param name:  Name of the metadata.
+        :param value: Dictionary with the metadata.
+        """
+
+        self._retry(self._client.put, self._metadata_entity(self._metadata_key(kind, name), value))
@@ -0,0 +1,13 @@
+class Diff:
+    """
+    Difference of records with the state of a kind.
+
+    :param records: The added and changed records, in the order of the data.
+    :param added:   Keys of the records that are not in the state.
+    :param changed: Keys of the records that differ from the state.
+    """
+
+    def __init__(self, records: list, added: set, changed: set):
+        self.records = records
+        self.added = added
+        self.changed = changed
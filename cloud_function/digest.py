@@ -0,0 +1,16 @@
+from hashlib import sha256
+
+from codec import canonical
+
+
+def record_digest(record: dict) -> str:
+    """
+    Returns a stable digest of a formatted record.
+
+    The record is serialized with sorted keys and without whitespace, so
+    equal records always have the same digest.
+
+    :param record: The record to digest.
+    """
+
+    return sha256(canonical(record)).hexdigest()
@@ -1,19 +1,46 @@
 import logging
-from datetime import datetime
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from hashlib import sha256
+from itertools import chain, islice
 
-from dateutil import parser
+from timestamps import DEFAULT_FORMAT, TimestampConverter
+
+# Conversion plan step types
+CONVERT = "convert"
+GEOJSON = "geojson"
+SUBFIELDS = "subfields"
 
 
 class Formatter:
     """
     Formatter class to format json records.
 
-    :layout: Contains information for the formatter.
+    Large record sets can be formatted in chunks by a pool of processes,
+    which is started once and kept for the lifetime of the formatter.
+
+    :layout:     Contains information for the formatter.
+    :workers:    Number of processes to format with, 1 formats serially.
+    :threshold:  Minimum number of records to format in parallel.
+    :chunk_size: Number of records per chunk sent to a process.
     """
 
-    def __init__(self, template: dict = {}):
+    def __init__(self, template: dict = {}, workers: int = 1, threshold: int = 100000, chunk_size: int = 10000):
         self._template = template
+        self._timestamps = {}
+        self._compile_coordinates(template)
+        self._plan = self._compile(template)
+        self._workers = workers or 1
+        self._threshold = threshold
+        self._chunk_size = chunk_size
+        self._pool = None
+
+    @property
+    def keys(self) -> list:
+        """Message keys the template formats."""
+        return list(self._plan)
 
     def _is_float(self, x) -> bool:
         """
@@ -63,19 +90,21 @@ class Formatter:
         :param value: Value to convert to string timestamp.
         """
 
-        if not format:
-            format = "%Y-%m-%dT%H:%M:%SZ"
+        return self._timestamp_converter(format)(value)
 
-        if self._is_int(value) or self._is_float(value):
-            if len(str(int(value))) == 13:
-                value = value / 1000
-            date_object = datetime.fromtimestamp(value)
-        else:
-            date_object = parser.parse(value)
+    def _timestamp_converter(self, format: str = None) -> TimestampConverter:
+        """
+        Returns the datetime converter of a format, created once per
+        formatter so all fields with that format share its memo.
+
+        :param format: Optional strftime format of the result.
+        """
 
-        date_string = str(datetime.strftime(date_object, format))
+        converter = self._timestamps.get(format)
+        if converter is None:
+            converter = self._timestamps[format] = TimestampConverter(format)
 
-        return date_string
+        return converter
 
     def _geojson(self, message: dict) -> dict:
         """
@@ -87,45 +116,158 @@ class Formatter:
         longitude = None
         latitude = None
 
-        for key, value in message.items():
-            mapping = self._template.get(key, {})
-
-            for map in get_mapping_list(mapping):
-                conversion = map.get("conversion", {})
-                if conversion.get("type") == "geojson":
-                    if conversion.get("format") == "longitude":
-                        longitude = value
-                    elif conversion.get("format") == "latitude":
-                        latitude = value
+        if self._coordinate_scan:
+            for key, value in message.items():
+                coordinate = self._coordinate_keys.get(key)
+                if coordinate == "longitude":
+                    longitude = value
+                elif coordinate == "latitude":
+                    latitude = value
+        else:
+            longitude = message.get(self._longitude_key)
+            latitude = message.get(self._latitude_key)
 
         geojson = {"type": "Point", "coordinates": [float(longitude), float(latitude)]}
 
         return geojson
 
-    def _convert(self, value, type: str, format: str = None):
+    def _converters(self, format: str = None) -> dict:
         """
-        Converts fields of a message.
+        Returns the conversion functions for a formatting format, except
+        the datetime conversion, which _converter shares per format.
 
-        :param  value: The value to format.
-        :param   type: Formatting type to lookup.
         :param format: Optional formatting format.
-
         """
 
-        result = {
+        return {
             "lowercase": lambda x: x.lower(),
             "uppercase": lambda x: x.upper(),
             "capitalize": lambda x: x.capitalize(),
-            "numeric": lambda x: self._to_numeric(x),
-            "datetime": lambda x: self._to_timestamp(x, format),
+            "numeric": self._to_numeric,
             "prefix_value": lambda x: f"{format}{x}",
             "hash": lambda x: sha256(x.encode("utf-8")).hexdigest(),
             "no_conversion": lambda x: x,
-        }[type](value)
+        }
 
-        return result
+    def _converter(self, type: str, format: str = None):
+        """
+        Resolves a conversion type to a function. Datetime conversions of
+        the same format resolve to the same TimestampConverter.
+
+        Unknown types resolve to a function that raises a KeyError when
+        called, so a misconfigured field only fails for records holding it.
+
+        :param   type: Formatting type to lookup.
+        :param format: Optional formatting format.
+        """
+
+        if type == "datetime":
+            return self._timestamp_converter(format)
+
+        converter = self._converters(format).get(type)
+
+        if converter is None:
+            def converter(x):
+                raise KeyError(type)
+
+        return converter
+
+    def _convert(self, value, type: str, format: str = None):
+        """
+        Converts fields of a message.
+
+        :param  value: The value to format.
+        :param   type: Formatting type to lookup.
+        :param format: Optional formatting format.
+
+        """
+
+        return self._converter(type, format)(value)
+
+    def _compile_coordinates(self, template: dict):
+        """
+        Precomputes the message keys holding geojson coordinates.
+
+        :param template: The top level formatting template.
+        """
+
+        self._coordinate_keys = {}
+        for key, mapping in template.items():
+            for map in get_mapping_list(mapping) or []:
+                conversion = map.get("conversion", {})
+                if conversion.get("type") == "geojson" and \
+                        conversion.get("format") in ("longitude", "latitude"):
+                    self._coordinate_keys[key] = conversion["format"]
+
+        longitude_keys = [k for k, v in self._coordinate_keys.items() if v == "longitude"]
+        latitude_keys = [k for k, v in self._coordinate_keys.items() if v == "latitude"]
+
+        # With more than one source key per coordinate the last key in
+        # message order wins, which requires scanning the message.
+        self._coordinate_scan = len(longitude_keys) > 1 or len(latitude_keys) > 1
+        self._longitude_key = longitude_keys[0] if longitude_keys else None
+        self._latitude_key = latitude_keys[0] if latitude_keys else None
+
+    def _compile(self, template: dict) -> dict:
+        """
+        Compiles a formatting template into a conversion plan.
+
+        The plan maps every message key to a tuple of steps. A step is
+        either a conversion with its resolved function and (type, format),
+        a geojson point or the compiled plan of its subfields.
+
+        :param template: The formatting template to compile.
+        """
+
+        plan = {}
+        for key, mapping in template.items():
+            if not mapping:
+                continue
+
+            steps = []
+            for map in get_mapping_list(mapping):
+                conversion = map.get("conversion", {})
+                subfields = map.get("subfields")
+                if subfields:
+                    steps.append((SUBFIELDS, None, self._compile(subfields), None))
+                elif conversion.get("type") == "geojson":
+                    steps.append((GEOJSON, map["name"], None, None))
+                else:
+                    type = conversion.get("type", "no_conversion")
+                    format = conversion.get("format")
+                    steps.append((CONVERT, map["name"], self._converter(type, format), (type, format)))
+
+            plan[key] = tuple(steps)
+
+        return plan
+
+    def _apply(self, plan: dict, message: dict) -> dict:
+        """
+        Runs a conversion plan against a single message.
+
+        :param    plan: Compiled conversion plan.
+        :param message: The message to format.
+        """
+
+        msg = {}
+        for key, value in message.items():
+            steps = plan.get(key)
+            if not steps:
+                continue
+
+            for step, name, target, _ in steps:
+                if step == CONVERT:
+                    msg[name] = target(value)
+                elif step == GEOJSON:
+                    msg[name] = self._geojson(message)
+                else:
+                    try:
+                        msg.update(self._apply(target, value))
+                    except parser_error() as e:
+                        logging.info(f"Failed to format message: {str(e)} ({value})")
+
+        return msg
 
-    # flake8: noqa: C901
     def format(self, messages: list, template=None) -> list:
         """
         Formats a message.
@@ -135,35 +277,40 @@ class Formatter:
         if isinstance(messages, dict):
             messages = [messages]
 
-        if not template:
-            template = self._template
+        if template:
+            return self._format(messages, self._compile(template))
+
+        if self._workers > 1:
+            # Only start formatting in parallel when there are enough records
+            if not isinstance(messages, list):
+                messages = iter(messages)
+                head = list(islice(messages, self._threshold))
+                if len(head) < self._threshold:
+                    return self._format(head, self._plan)
+                messages = chain(head, messages)
+            elif len(messages) < self._threshold:
+                return self._format(messages, self._plan)
+
+            formatted = []
+            for chunk in self._parallel(_format_chunk, _chunks(messages, self._chunk_size)):
+                formatted.extend(chunk)
+            return formatted
+
+        return self._format(messages, self._plan)
+
+    def _format(self, messages, plan: dict) -> list:
+        """
+        Formats messages one by one, dropping the ones that fail to parse.
+
+        :param messages: An iterable of json messages.
+        :param     plan: Compiled conversion plan.
+        """
 
         formatted = []
         for message in messages:
-            msg = {}
-
             try:
-                for key, value in message.items():
-                    mapping = template.get(key)
-                    if mapping:
-                        for map in get_mapping_list(mapping):
-                            conversion = map.get("conversion", {})
-                            subfields = map.get("subfields")
-                            if subfields:
-                                subfield_formatted = self.format(
-                                    messages=[value], template=subfields
-                                )
-                                for subfield_msg in subfield_formatted:
-                                    msg.update(subfield_msg)
-                            elif conversion.get("type") == "geojson":
-                                msg[map["name"]] = self._geojson(message)
-                            else:
-                                msg[map["name"]] = self._convert(
-                                    value,
-                                    conversion.get("type", "no_conversion"),
-                                    conversion.get("format"),
-                                )
-            except parser.ParserError as e:
+                msg = self._apply(plan, message)
+            except parser_error() as e:
                 logging.info(f"Failed to format message: {str(e)} ({message})")
                 continue
             else:
@@ -171,6 +318,256 @@ class Formatter:
 
         return formatted
 
+    def _parallel(self, function, chunks):
+        """
+        Yields the results of a function applied to chunks in the process
+        pool, in the order of the chunks.
+
+        At most two chunks per process are submitted ahead, so a stream
+        of records is not read into memory at once.
+
+        :param function: Module level function to apply.
+        :param   chunks: Iterable of chunks.
+        """
+
+        if self._pool is None:
+            # Spawned processes do not inherit the gRPC channels of this process
+            self._pool = ProcessPoolExecutor(
+                self._workers, multiprocessing.get_context("spawn"),
+                initializer=_init_worker, initargs=(self._template, logging.getLogger().getEffectiveLevel()),
+            )
+
+        pending = deque()
+        try:
+            for chunk in chunks:
+                pending.append(self._pool.submit(function, chunk))
+                if len(pending) > 2 * self._workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        except BrokenProcessPool:
+            self._pool = None
+            raise
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def timestamp_stats(self) -> dict:
+        """
+        Returns the summed statistics of the datetime conversions of the template.
+        """
+
+        stats = {"hits": 0, "misses": 0, "fast": 0, "fallback": 0}
+        for converter in self._timestamps.values():
+            for key in stats:
+                stats[key] += converter.stats[key]
+
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+
+        return stats
+
+    def _map_column(self, converter, values: list, errors: dict) -> list:
+        """
+        Applies a conversion function to every value of a column.
+
+        The first error of a row is kept in errors, so the row can be
+        dropped or the error raised just like the per-record path does.
+
+        :param converter: Conversion function.
+        :param    values: Column values.
+        :param    errors: Dictionary of row index to first exception.
+        """
+
+        result = []
+        for idx, value in enumerate(values):
+            try:
+                result.append(converter(value))
+            except Exception as e:
+                errors.setdefault(idx, e)
+                result.append(None)
+
+        return result
+
+    def _convert_column(self, column, type: str, format: str, converter, errors: dict) -> list:
+        """
+        Converts a DataFrame column as a whole where possible.
+
+        Columns that cannot be converted in bulk without changing the
+        result are converted value by value.
+
+        :param    column: The pandas Series to convert.
+        :param      type: Formatting type.
+        :param    format: Optional formatting format.
+        :param converter: Resolved conversion function of the type.
+        :param    errors: Dictionary of row index to first exception.
+        """
+
+        import numpy as np
+        from pandas.api.types import infer_dtype
+
+        kind = column.dtype.kind
+        is_string = kind == "O" and infer_dtype(column, skipna=False) == "string"
+
+        if type == "no_conversion":
+            return column.tolist()
+        elif type == "lowercase" and is_string:
+            return column.str.lower().tolist()
+        elif type == "uppercase" and is_string:
+            return column.str.upper().tolist()
+        elif type == "capitalize" and is_string:
+            return column.str.capitalize().tolist()
+        elif type == "prefix_value" and (is_string or kind in "iuf"):
+            return (f"{format}" + column.astype(str)).tolist()
+        elif type == "numeric" and kind in "iub" and \
+                (kind == "b" or column.abs().max() < 2 ** 53 or column.empty):
+            return column.astype(int).tolist()
+        elif type == "datetime" and kind == "M" and not column.isna().any():
+            return column.dt.strftime(format or DEFAULT_FORMAT).tolist()
+        elif type == "numeric" and kind == "f" and not np.isinf(column.values).any():
+            values = column.values
+            integral = (values == np.floor(values)).tolist()
+            return [int(v) if i else v for v, i in zip(values.tolist(), integral)]
+
+        return self._map_column(converter, column.tolist(), errors)
+
+    def _frame_supported(self, df) -> bool:
+        """
+        Indicates whether a DataFrame can be formatted column by column.
+
+        :param df: The pandas DataFrame to format.
+        """
+
+        if not df.columns.is_unique or self._coordinate_scan:
+            return False
+
+        for key in df.columns:
+            for step, _, _, _ in self._plan.get(key) or ():
+                if step == SUBFIELDS:
+                    return False
+                if step == GEOJSON and (self._longitude_key not in df.columns or
+                                        self._latitude_key not in df.columns):
+                    return False
+
+        return True
+
+    def format_frame(self, df) -> list:
+        """
+        Formats the rows of a pandas DataFrame column by column.
+
+        Gives the same result as formatting df.to_dict(orient="records")
+        with format(), but converts whole columns instead of single values
+        and only builds the records at the very end.
+
+        :param df: The pandas DataFrame to format.
+        """
+
+        if not self._frame_supported(df):
+            return self.format(df.to_dict(orient="records"))
+
+        if self._workers > 1 and len(df) >= self._threshold:
+            chunks = (df.iloc[i:i + self._chunk_size] for i in range(0, len(df), self._chunk_size))
+            formatted = []
+            for chunk in self._parallel(_format_frame_chunk, chunks):
+                formatted.extend(chunk)
+            return formatted
+
+        columns = {}
+        errors = {}
+        geojson = None
+        for key in df.columns:
+            for step, name, target, conversion in self._plan.get(key) or ():
+                if step == CONVERT:
+                    columns[name] = self._convert_column(df[key], *conversion, target, errors)
+                elif step == GEOJSON:
+                    if geojson is None:
+                        longitude = self._map_column(float, df[self._longitude_key].tolist(), errors)
+                        latitude = self._map_column(float, df[self._latitude_key].tolist(), errors)
+                        geojson = list(zip(longitude, latitude))
+                    columns[name] = [
+                        {"type": "Point", "coordinates": [lon, lat]} for lon, lat in geojson
+                    ]
+
+        for idx in sorted(errors):
+            if not isinstance(errors[idx], parser_error()):
+                raise errors[idx]
+            message = df.iloc[[idx]].to_dict(orient="records")[0]
+            logging.info(f"Failed to format message: {str(errors[idx])} ({message})")
+
+        if not columns:
+            return [{} for idx in range(len(df)) if idx not in errors]
+
+        names = list(columns)
+        return [
+            dict(zip(names, row))
+            for idx, row in enumerate(zip(*columns.values()))
+            if idx not in errors
+        ]
+
+
+# Formatter of a process in the pool of a parallel Formatter
+_worker = None
+
+
+def _init_worker(template: dict, level: int):
+    """
+    Compiles the template once per process of the pool.
+
+    :param template: The formatting template.
+    :param    level: Logging level of the parent process.
+    """
+
+    global _worker
+
+    logging.basicConfig(level=level)
+    _worker = Formatter(template)
+
+
+def _format_chunk(messages: list) -> list:
+    """
+    Formats a chunk of messages in a process of the pool.
+
+    :param messages: A list of json messages.
+    """
+
+    return _worker.format(messages)
+
+
+def _format_frame_chunk(df) -> list:
+    """
+    Formats a chunk of DataFrame rows in a process of the pool.
+
+    :param df: The pandas DataFrame to format.
+    """
+
+    return _worker.format_frame(df)
+
+
+def _chunks(messages, n: int):
+    """
+    Yield successive n-sized lists from an iterable of messages.
+
+    :param messages: The messages to chunk.
+    :param        n: The number of messages per list.
+    """
+
+    iterator = iter(messages)
+    chunk = list(islice(iterator, n))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, n))
+
+
+def parser_error():
+    """
+    Returns the dateutil ParserError class, importing dateutil only
+    when an error has to be handled.
+    """
+
+    from dateutil.parser import ParserError
+
+    return ParserError
+
 
 def get_mapping_list(mapping):
     """
@@ -1,75 +1,213 @@
 import logging
+import random
+from contextlib import nullcontext
 
+import clients
+import pipeline
+from cache import DigestCache
 from configuration import Configuration
-from datastore import GoogleCloudDatastore
 from event_formatter import Formatter
-from gobits import Gobits
-from publisher import Publisher
+from metrics import Metrics, Profiler
+from publisher import PublishError, Publisher
 from storage import GoogleCloudStorage
 
 config = Configuration()
+formatter = Formatter(
+    config.template, config.parallel.workers, config.parallel.threshold, config.parallel.chunk_size
+)
+cache = DigestCache(config.cache.max_bytes, config.cache.ttl) if config.cache.enabled else None
 
 logging.getLogger().setLevel(logging.INFO)
 
 
+def get_state():
+    """
+    Returns the state backend, or None when all messages are loaded.
+    """
+
+    return pipeline.get_state(config, cache)
+
+
+def get_fingerprint(file, state):
+    """
+    Returns the fingerprint of a file and the configuration it is
+    processed with, or None when fingerprints are not used.
+
+    :param file:  The file to process.
+    :param state: State backend, None for a full load.
+    """
+
+    if not state or not config.state.fingerprint or not file.fingerprint:
+        return None
+
+    return {"file": file.fingerprint, "configuration": config.digest}
+
+
+def get_profiler():
+    """
+    Returns a profiler for the invocation, or None when it is not profiled.
+    """
+
+    if not config.profiling.enabled or random.random() >= config.profiling.sample_rate:
+        return None
+
+    return Profiler(config.profiling.cpu, config.profiling.memory, config.profiling.top)
+
+
+def process(records: list, state, publisher: Publisher, metadata, metrics: Metrics) -> int:
+    """
+    Publishes the new records of a list and adds them to the state.
+
+    :param records:   List of formatted records.
+    :param state:     State backend, None for a full load.
+    :param publisher: Publisher to publish the records with.
+    :param metadata:  Gobits metadata of the messages.
+    :param metrics:   Metrics of the invocation.
+
+    :return: The number of published records.
+    """
+
+    return pipeline.process(config, records, state, publisher, metadata, metrics)
+
+
 def handler(data, context):
     """
     Handler method that calculates the difference of a dataset
     and sends messages to Google Cloud Pub/Sub.
 
+    Logs the metrics of the invocation as a single json entry.
+
     :param: data    Dictionary like object that holds trigger information.
     :param: context Google Cloud Function context.
     """
 
+    metrics = Metrics()
+    profiler = get_profiler()
+    timestamps = formatter.timestamp_stats()
+    cached = cache.stats if cache is not None else {}
+
     try:
-        bucket_name = data["bucket"]
-        file_name = data["name"]
+        with profiler or nullcontext():
+            response = handle(data, context, metrics)
+    except Exception as e:
+        logging.exception(e)
+        from google.api_core.exceptions import GoogleAPIError
 
-        # Exit when file does not need to be processed
-        if not file_name.startswith(config.prefix_filter):
-            logging.info("Do not process file, exiting...")
-            return "OK", 204
+        # Recreate clients on the next invocation, in case they are broken
+        if isinstance(e, (GoogleAPIError, ConnectionError, PublishError)):
+            clients.reset()
+        response = "Bad Request", 400
 
-        file = GoogleCloudStorage().read(file_name, bucket_name)
-        file.top_level_attribute = config.top_level_attribute
-        file.csv_dialect_parameters = config.csv_dialect_parameters
+    for key, value in formatter.timestamp_stats().items():
+        if key != "hit_rate":
+            metrics.add(f"timestamp_{key}", value - timestamps[key])
+    for key, value in (cache.stats if cache is not None else {}).items():
+        if key != "hit_rate":
+            metrics.add(f"cache_{key}", value - cached[key])
 
-        records = file.to_json(Formatter(config.template))
+    fields = {"file": data.get("name"), "status": response[1]}
+    if profiler:
+        fields["profile"] = profiler.result
+    metrics.log(**fields)
 
-        if not config.full_load:
-            if config.state.type == "datastore":
-                records = GoogleCloudDatastore().difference(
-                    records, config.state.kind, config.state.property
-                )
-            else:
-                raise NotImplementedError("Unkown state type!")
+    return response
 
-        # Exit when no new records exist
-        if not len(records):
-            logging.info("No new records found, exiting...")
-            return "OK", 204
 
-        metadata = Gobits.from_context(context=context)
-        publisher = Publisher(config.topic.batch_settings)
-        publisher.publish(
-            config.topic.project_id,
-            config.topic.id,
-            records,
-            metadata.to_json(),
-            config.topic.batch_size,
-            config.topic.subject,
+def handle(data, context, metrics: Metrics):
+    """
+    Calculates the difference of a dataset and sends messages
+    to Google Cloud Pub/Sub.
+
+    :param: data    Dictionary like object that holds trigger information.
+    :param: context Google Cloud Function context.
+    :param: metrics Metrics of the invocation.
+    """
+
+    bucket_name = data["bucket"]
+    file_name = data["name"]
+
+    # Exit when file does not need to be processed
+    if not file_name.startswith(config.prefix_filter):
+        logging.info("Do not process file, exiting...")
+        return "OK", 204
+
+    state = get_state()
+
+    # Only read the content appended since the watermark of the last run
+    watermark_name = f"watermark:{file_name}"
+    if state and config.state.append_only:
+        with metrics.stage("state_diff"):
+            watermark = state.get_metadata(config.state.kind, watermark_name)
+        file = GoogleCloudStorage().read_appended(
+            file_name, bucket_name, watermark, metrics, config.csv_dialect_parameters
         )
+    else:
+        file = GoogleCloudStorage().read(file_name, bucket_name, metrics)
+    file.top_level_attribute = config.top_level_attribute
+    file.csv_dialect_parameters = config.csv_dialect_parameters
+
+    # Exit when the file is identical to the last processed file
+    fingerprint = get_fingerprint(file, state)
+    fingerprint_name = f"fingerprint:{config.prefix_filter}"
+    if fingerprint:
+        with metrics.stage("state_diff"):
+            unchanged = state.get_metadata(config.state.kind, fingerprint_name) == fingerprint
+        if unchanged:
+            logging.info("File is unchanged, exiting...")
+            return "OK", 204
 
-        # Store the new state records
-        if not config.full_load:
-            if config.state.type == "datastore":
-                logging.info("Adding new items to state")
-                GoogleCloudDatastore().put_multi(
-                    records, config.state.kind, config.state.property
-                )
+    if config.streaming.enabled:
+        chunks = file.iter_json(formatter, config.streaming.chunk_size)
+    else:
+        chunks = [file.to_json(formatter)]
 
-    except Exception as e:
-        logging.exception(e)
-        return "Bad Request", 400
+    from gobits import Gobits
+
+    metadata = Gobits.from_context(context=context)
+    publisher = Publisher(
+        config.topic.batch_settings, config.topic.flow_control, config.topic.compression
+    )
+
+    deletions = pipeline.publishes_deletions(config, state)
+    keys = set()
+
+    def collect_keys(chunks):
+        for records in chunks:
+            if deletions:
+                keys.update(record[config.state.property] for record in records)
+            yield records
+
+    published = 0
+    try:
+        if config.streaming.enabled and config.streaming.pipelined:
+            published += pipeline.process_chunks(
+                config, collect_keys(chunks), state, publisher, metadata, metrics, config.streaming.queue_depth
+            )
+        else:
+            for records in collect_keys(chunks):
+                published += process(records, state, publisher, metadata, metrics)
+
+        if deletions:
+            if not keys or metrics.counts["records_dropped"]:
+                logging.warning("Not publishing deletions, the file has no records or records failed to format")
+            else:
+                published += pipeline.process_removed(config, keys, state, publisher, metadata, metrics)
+    finally:
+        # Write the changes of the published records, also when publishing failed
+        if state:
+            with metrics.stage("state_write"):
+                state.flush()
+
+    if fingerprint:
+        with metrics.stage("state_write"):
+            state.put_metadata(config.state.kind, fingerprint_name, fingerprint)
+
+    if file.watermark:
+        file.watermark["rows"] += metrics.counts["records_in"]
+        with metrics.stage("state_write"):
+            state.put_metadata(config.state.kind, watermark_name, file.watermark)
+
+    if not published:
+        logging.info("No new records found, exiting...")
 
     return "OK", 204
@@ -0,0 +1,225 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from io import RawIOBase
+
+STAGES = ("download", "decompress", "parse", "format", "state_diff", "publish", "state_write")
+
+
+class Metrics:
+    """
+    Durations and counts of the stages of a single invocation.
+
+    Stages can be nested, the time spent in an inner stage is not
+    counted for the outer stage. Stages are timed on the calling thread,
+    so the stages of concurrent threads add up to more than the total.
+    """
+
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    @property
+    def _stack(self) -> list:
+        """Stages of the calling thread, innermost last."""
+
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _enter(self, name: str):
+        """Starts a stage, pausing the stage it is nested in."""
+
+        now = time.perf_counter()
+        stack = self._stack
+        if stack:
+            outer = stack[-1]
+            with self._lock:
+                self.durations[outer[0]] += now - outer[1]
+        stack.append([name, now])
+
+    def _exit(self):
+        """Ends the current stage, resuming the stage it is nested in."""
+
+        now = time.perf_counter()
+        stack = self._stack
+        name, start = stack.pop()
+        with self._lock:
+            self.durations[name] += now - start
+        if stack:
+            stack[-1][1] = now
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Times a stage, pausing the stage it is nested in.
+
+        :param name: Name of the stage.
+        """
+
+        self._enter(name)
+        try:
+            yield
+        finally:
+            self._exit()
+
+    def iterate(self, name: str, iterable, count: str = None):
+        """
+        Yields the items of an iterable, timing the retrieval of every
+        item as a stage.
+
+        :param name:     Name of the stage.
+        :param iterable: The iterable to time.
+        :param count:    Name of the count to add the number of items to.
+        """
+
+        iterator = iter(iterable)
+        while True:
+            self._enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._exit()
+            if count:
+                self.add(count)
+            yield item
+
+    def add(self, name: str, value: int = 1):
+        """
+        Adds to a count.
+
+        :param name:  Name of the count.
+        :param value: Value to add.
+        """
+
+        with self._lock:
+            self.counts[name] += value
+
+    def entry(self, **fields) -> dict:
+        """
+        Returns the metrics as a dictionary.
+
+        :param fields: Additional fields of the entry.
+        """
+
+        durations = {name: round(self.durations.get(name, 0.0), 6) for name in STAGES}
+        durations.update({name: round(value, 6) for name, value in self.durations.items() if name not in durations})
+        durations["total"] = round(time.perf_counter() - self._start, 6)
+
+        return {"metrics": {"durations": durations, "counts": dict(self.counts), **fields}}
+
+    def log(self, **fields):
+        """
+        Logs the metrics as a single json entry.
+
+        :param fields: Additional fields of the entry.
+        """
+
+        logging.info(json.dumps(self.entry(**fields), default=str))
+
+
+class MeteredReader(RawIOBase):
+    """
+    Binary file object that times the reads of another file object as a
+    stage and counts the bytes read.
+
+    :param stream:  The file object to read from.
+    :param metrics: Metrics to add the stage and bytes to.
+    :param name:    Name of the stage.
+    :param count:   Name of the count of bytes.
+    """
+
+    def __init__(self, stream, metrics: Metrics, name: str, count: str):
+        self._stream = stream
+        self._metrics = metrics
+        self._name = name
+        self._count = count
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        with self._metrics.stage(self._name):
+            size = self._stream.readinto(buffer)
+        self._metrics.add(self._count, size or 0)
+        return size
+
+    def readall(self) -> bytes:
+        with self._metrics.stage(self._name):
+            data = self._stream.read()
+        self._metrics.add(self._count, len(data))
+        return data
+
+    def close(self):
+        self._stream.close()
+        super().close()
+
+
+class Profiler:
+    """
+    Profiles a single invocation with cProfile and tracemalloc and adds
+    the top entries to its metrics.
+
+    :param cpu:    Profile function calls with cProfile.
+    :param memory: Trace memory allocations with tracemalloc.
+    :param top:    Number of functions and lines to report.
+    """
+
+    def __init__(self, cpu: bool = True, memory: bool = False, top: int = 20):
+        self._cpu = cpu
+        self._memory = memory
+        self._top = top
+        self.result = {}
+
+    def __enter__(self):
+        if self._memory:
+            import tracemalloc
+
+            tracemalloc.start()
+        if self._cpu:
+            import cProfile
+
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+        return self
+
+    def __exit__(self, *exc):
+        if self._cpu:
+            import pstats
+
+            self._profile.disable()
+            stats = pstats.Stats(self._profile)
+            functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+            self.result["cpu"] = [
+                {
+                    "function": f"{file}:{line}({function})",
+                    "calls": calls,
+                    "total": round(total, 6),
+                    "cumulative": round(cumulative, 6),
+                }
+                for (file, line, function), (_, calls, total, cumulative, _) in functions[:self._top]
+            ]
+        if self._memory:
+            import tracemalloc
+
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.result["memory"] = {
+                "peak_bytes": peak,
+                "top": [
+                    {"line": str(stat.traceback), "size": stat.size, "count": stat.count}
+                    for stat in snapshot.statistics("lineno")[:self._top]
+                ],
+            }
+
+        return False
@@ -0,0 +1,337 @@
+import logging
+import queue
+import threading
+from contextlib import suppress
+
+from cache import DigestCache
+from configuration import Configuration
+from datastore import GoogleCloudDatastore
+from metrics import Metrics
+from publisher import PublishError, Publisher
+from snapshot import GoogleCloudStorageStore, LocalStore, SnapshotState
+
+# Marks the end of the items passed to a stage
+_END = object()
+
+
+def get_state(config: Configuration, cache: DigestCache = None):
+    """
+    Returns the state backend, or None when all messages are loaded.
+
+    :param config: The configuration.
+    :param cache:  Cache of record digests of the Datastore state.
+    """
+
+    if config.full_load:
+        return None
+
+    if config.state.type == "datastore":
+        return GoogleCloudDatastore(
+            config.state.mode, config.state.chunk_size, config.state.concurrency,
+            scan_threshold=config.state.scan_threshold, cache=cache,
+        )
+    elif config.state.type == "storage":
+        if not config.state.bucket:
+            raise ValueError("Storage state requires state.bucket!")
+        return SnapshotState(GoogleCloudStorageStore(config.state.bucket), config.state.prefix)
+    elif config.state.type == "local":
+        return SnapshotState(LocalStore(config.state.directory), config.state.prefix)
+
+    raise NotImplementedError("Unkown state type!")
+
+
+def process(config: Configuration, records: list, state, publisher: Publisher, metadata, metrics: Metrics) -> int:
+    """
+    Publishes the new records of a list and adds them to the state.
+
+    :param config:    The configuration.
+    :param records:   List of formatted records.
+    :param state:     State backend, None for a full load.
+    :param publisher: Publisher to publish the records with.
+    :param metadata:  Gobits metadata of the messages.
+    :param metrics:   Metrics of the invocation.
+
+    :return: The number of published records.
+    """
+
+    report = publish_new(config, find_new(config, records, state, metrics), publisher, metadata, metrics)
+
+    return store_published(config, report, state, metrics)
+
+
+def process_chunks(config: Configuration, chunks, state, publisher: Publisher, metadata, metrics: Metrics,
+                   depth: int = 2) -> int:
+    """
+    Publishes the new records of chunks and adds them to the state, with
+    the stages of consecutive chunks running concurrently: while a chunk
+    is read and formatted on the calling thread, the previous chunks are
+    compared with the state, published and added to the state on a thread
+    per stage. The records of a chunk are only added to the state once
+    its messages are published.
+
+    :param config:    The configuration.
+    :param chunks:    Iterable of lists of formatted records.
+    :param state:     State backend, None for a full load.
+    :param publisher: Publisher to publish the records with.
+    :param metadata:  Gobits metadata of the messages.
+    :param metrics:   Metrics of the invocation.
+    :param depth:     Maximum number of chunks waiting for every stage.
+
+    :return: The number of published records.
+    """
+
+    stages = [
+        lambda records: find_new(config, records, state, metrics),
+        lambda records: publish_new(config, records, publisher, metadata, metrics),
+        lambda report: store_published(config, report, state, metrics),
+    ]
+
+    return sum(run_stages(chunks, stages, depth))
+
+
+def find_new(config: Configuration, records: list, state, metrics: Metrics) -> list:
+    """
+    Returns the records that are new or changed according to the state.
+
+    :param config:  The configuration.
+    :param records: List of formatted records.
+    :param state:   State backend, None for a full load.
+    :param metrics: Metrics of the invocation.
+    """
+
+    if state:
+        with metrics.stage("state_diff"):
+            result = state.diff(
+                records, config.state.kind, config.state.property
+            )
+        records = result.records
+        metrics.add("records_added", len(result.added))
+        metrics.add("records_changed", len(result.changed))
+
+    metrics.add("records_new", len(records))
+
+    return records
+
+
+def publish_new(config: Configuration, records: list, publisher: Publisher, metadata, metrics: Metrics):
+    """
+    Publishes new records.
+
+    :param config:    The configuration.
+    :param records:   List of new records.
+    :param publisher: Publisher to publish the records with.
+    :param metadata:  Gobits metadata of the messages.
+    :param metrics:   Metrics of the invocation.
+
+    :return: PublishReport of the records, None without records.
+    """
+
+    if not len(records):
+        return None
+
+    return publish(config, records, publisher, metadata, metrics)
+
+
+def store_published(config: Configuration, report, state, metrics: Metrics) -> int:
+    """
+    Adds the published records of a report to the state.
+
+    :param config:  The configuration.
+    :param report:  PublishReport of the new records, None without records.
+    :param state:   State backend, None for a full load.
+    :param metrics: Metrics of the invocation.
+
+    :return: The number of published records.
+    """
+
+    if report is None:
+        return 0
+
+    # Store the published records only
+    published = report.published
+    metrics.add("records_published", len(published))
+    if state and published:
+        logging.info("Adding new items to state")
+        with metrics.stage("state_write"):
+            state.put_multi(
+                published, config.state.kind, config.state.property
+            )
+
+    check(report, metrics)
+
+    return len(published)
+
+
+def run_stages(items, functions: list, depth: int) -> list:
+    """
+    Passes items through a sequence of functions, every function running
+    on a thread of its own, and returns the results of the last function
+    in the order of the items. The items are iterated on the calling
+    thread.
+
+    At most `depth` results wait for every function, so a slow function
+    holds up the functions before it. When a function raises, the
+    functions before it stop, the functions after it finish the results
+    they received, and the error is raised.
+
+    :param items:     Iterable of items of the first function.
+    :param functions: Functions of the stages, in order.
+    :param depth:     Maximum number of items waiting for every function.
+    """
+
+    queues = [queue.Queue(depth) for _ in functions]
+    failures = []
+    results = []
+
+    def stopped(index: int) -> bool:
+        return any(failure > index for failure, _ in failures)
+
+    def put(index: int, item) -> bool:
+        # Give up once a later stage failed, nothing consumes its queue anymore
+        while not stopped(index):
+            try:
+                queues[index + 1].put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def end(index: int):
+        if not put(index, _END):
+            # A stopped stage waiting for an item still has to end
+            with suppress(queue.Full):
+                queues[index + 1].put_nowait(_END)
+
+    def run(index: int):
+        try:
+            for item in iter(queues[index].get, _END):
+                if stopped(index):
+                    break
+                result = functions[index](item)
+                if index == len(functions) - 1:
+                    results.append(result)
+                elif not put(index, result):
+                    break
+        except Exception as e:
+            failures.append((index, e))
+        finally:
+            if index < len(functions) - 1:
+                end(index)
+
+    threads = [threading.Thread(target=run, args=(index,), daemon=True) for index in range(len(functions))]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for item in items:
+            if not put(-1, item):
+                break
+    finally:
+        end(-1)
+        for thread in threads:
+            thread.join()
+
+    if failures:
+        raise failures[0][1]
+
+    return results
+
+
+def publishes_deletions(config: Configuration, state) -> bool:
+    """
+    Indicates whether files are full snapshots of the state, of which the
+    records missing from the state are published as deleted. Not when only
+    the appended records of files are read.
+
+    :param config: The configuration.
+    :param state:  State backend, None for a full load.
+    """
+
+    return bool(state) and bool(config.state.deletions) and not config.state.append_only
+
+
+def process_removed(config: Configuration, keys: set, state, publisher: Publisher, metadata, metrics: Metrics) -> int:
+    """
+    Publishes the records of the state that are missing from a full
+    snapshot with the delete action and removes them from the state.
+
+    :param config:    The configuration.
+    :param keys:      Keys of all records of the snapshot.
+    :param state:     State backend.
+    :param publisher: Publisher to publish the records with.
+    :param metadata:  Gobits metadata of the messages.
+    :param metrics:   Metrics of the invocation.
+
+    :return: The number of published deleted records.
+    """
+
+    with metrics.stage("state_diff"):
+        removed = state.removed(keys, config.state.kind, config.state.property)
+
+    metrics.add("records_removed", len(removed))
+    if not removed:
+        return 0
+
+    report = publish(config, removed, publisher, metadata, metrics, {"action": config.topic.delete_action})
+
+    # Only remove the published records from the state
+    published = report.published
+    metrics.add("records_deleted", len(published))
+    if published:
+        logging.info("Removing deleted items from state")
+        with metrics.stage("state_write"):
+            state.delete_multi(
+                published, config.state.kind, config.state.property
+            )
+
+    check(report, metrics)
+
+    return len(published)
+
+
+def publish(config: Configuration, records: list, publisher: Publisher, metadata, metrics: Metrics,
+            attributes: dict = None):
+    """
+    Publishes records, counting the messages and bytes published.
+
+    :param config:     The configuration.
+    :param records:    List of formatted records.
+    :param publisher:  Publisher to publish the records with.
+    :param metadata:   Gobits metadata of the messages.
+    :param metrics:    Metrics of the invocation.
+    :param attributes: Attributes of every message.
+
+    :return: PublishReport of the records.
+    """
+
+    with metrics.stage("publish"):
+        report = publisher.publish(
+            config.topic.project_id,
+            config.topic.id,
+            records,
+            metadata.to_json(),
+            config.topic.batch_size,
+            config.topic.subject,
+            config.topic.max_message_bytes,
+            attributes,
+        )
+
+    metrics.add("messages", len(report.batches))
+    metrics.add("bytes_published", sum(batch.compressed_size or batch.size for batch in report.batches))
+
+    return report
+
+
+def check(report, metrics: Metrics):
+    """
+    Raises a PublishError when batches of a report failed.
+
+    :param report:  PublishReport of the records.
+    :param metrics: Metrics of the invocation.
+    """
+
+    if report.failed:
+        metrics.add("batches_failed", len(report.failed))
+        raise PublishError(
+            f"Failed to publish {len(report.failed)} of {len(report.batches)} batches"
+        )
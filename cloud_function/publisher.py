@@ -1,9 +1,74 @@
-import json
+import gzip
 import logging
+import math
 import time
 
-from google.cloud import pubsub_v1
-from google.cloud.pubsub_v1 import types
+import clients
+import codec
+
+
+class PublishError(Exception):
+    """
+    Raised when one or more batches could not be published.
+    """
+
+
+class BatchResult:
+    """
+    Result of publishing a batch of records in a single message.
+
+    :param records:    The records in the message.
+    :param message_id: Pub/Sub message id when published.
+    :param exception:  Exception when publishing failed.
+    """
+
+    def __init__(self, records: list, message_id: str = None, exception: Exception = None):
+        self.records = records
+        self.message_id = message_id
+        self.exception = exception
+        self.size = 0
+        self.compressed_size = 0
+        self.compression_time = 0.0
+
+    @property
+    def compression_ratio(self):
+        """Ratio of the message size to the compressed message size."""
+        return self.size / self.compressed_size if self.compressed_size else 1.0
+
+    @property
+    def success(self):
+        """Indicates whether the batch was published."""
+        return self.exception is None
+
+
+class PublishReport:
+    """
+    Report of the batches published by Publisher.publish.
+    """
+
+    def __init__(self):
+        self.batches = []
+
+    @property
+    def published(self) -> list:
+        """Records of the published batches."""
+        return [record for batch in self.batches if batch.success for record in batch.records]
+
+    @property
+    def failed(self) -> list:
+        """Results of the batches that failed."""
+        return [batch for batch in self.batches if not batch.success]
+
+    @property
+    def compression_ratio(self):
+        """Ratio of the total message size to the total compressed size."""
+        compressed = sum(batch.compressed_size for batch in self.batches)
+        return sum(batch.size for batch in self.batches) / compressed if compressed else 1.0
+
+    @property
+    def compression_time(self):
+        """Total number of seconds spent compressing messages."""
+        return sum(batch.compression_time for batch in self.batches)
 
 
 class Publisher:
@@ -12,15 +77,24 @@ class Publisher:
 
     :param batch_settings: pubsub_v1.types.BatchSettings to
                            initialize pubsub PublisherClient.
+    :param flow_control:   Limits of the messages in flight of the client,
+                           max_messages and max_bytes.
+    :param compression:    Optional message compression, gzip or br.
+    :param client:         PublisherClient to use instead of the shared one.
     """
 
-    def __init__(self, batch_settings: dict = {}):
-        self._client = pubsub_v1.PublisherClient(
-            batch_settings=types.BatchSettings(**batch_settings),
-        )
+    compressions = ("gzip", "br")
+
+    def __init__(self, batch_settings: dict = {}, flow_control: dict = {}, compression: str = None, client=None):
+        if compression and compression not in Publisher.compressions:
+            raise ValueError(f"Unknown compression {compression}!")
+
+        self._client = client or clients.publisher_client(batch_settings, flow_control)
+        self._compression = compression
 
     def publish(self, project_id: str, topic_id: str, messages: list,
-                gobits: dict, batch_size: int, subject: str = "data"):
+                gobits: dict, batch_size: int, subject: str = "data",
+                max_bytes: int = None, attributes: dict = None):
         """
         Publishes messages to pub/sub.
 
@@ -30,42 +104,116 @@ class Publisher:
         :param messages:    A list of messages to be send.
         :param gobits:      Gobits dictionary that has metadata about the messages.
         :param batch_size:  Indicates whether messages should be send as a list or stand alone.
+        :param max_bytes:   Maximum message size in bytes, batch_size then is the
+                            optional maximum number of records per message.
+        :param attributes:  Attributes of every message.
+
+        :return: PublishReport with the result of every batch.
         """
 
         topic_path = self._client.topic_path(project_id, topic_id)
         logging.info(f"Publishing {len(messages)} new records to {topic_path}")
 
-        batches = list(self._chunks(messages, batch_size))
-        logging.info(f"Sending messages in {len(batches)} batches with batch_size {batch_size}")
+        if max_bytes:
+            batches = self._pack(messages, gobits, subject, max_bytes, batch_size)
+            logging.info(f"Sending messages of at most {max_bytes} bytes with batch_size {batch_size}")
+        else:
+            batches = (
+                (batch, codec.dumps({"gobits": [gobits], subject: batch}))
+                for batch in self._chunks(messages, batch_size)
+            )
+            logging.info(
+                f"Sending messages in {math.ceil(len(messages) / batch_size)} batches with batch_size {batch_size}"
+            )
+
+        futures = []
+        for batch, data in batches:
+            result = BatchResult(batch)
+            data, encoding = self._compress(data, result)
+
+            # Blocks while the flow control limits of the client are reached
+            future = self._client.publish(topic_path, data, **(attributes or {}), **encoding)
+            futures.append((result, future))
+
+        report = PublishReport()
+        for result, future in futures:
+            try:
+                result.message_id = future.result()
+            except Exception as e:
+                logging.error(f"Failed to publish batch of {len(result.records)} records to {topic_path}: {e}")
+                result.exception = e
+            report.batches.append(result)
+
+        if self._compression:
+            logging.info(
+                f"Compressed messages with {self._compression}, ratio {report.compression_ratio:.2f} "
+                f"in {report.compression_time:.3f}s"
+            )
+
+        return report
+
+    def _compress(self, data: bytes, result: BatchResult):
+        """
+        Compresses a message when compression is configured, recording
+        its size and compression time in the batch result.
+
+        :param data:   The serialized message.
+        :param result: BatchResult of the message.
+
+        :return: The message data and its attributes.
+        """
+
+        result.size = len(data)
+        if not self._compression:
+            return data, {}
 
-        futures = dict()
+        start = time.perf_counter()
+        if self._compression == "br":
+            import brotli
 
-        def get_callback(f, data):
-            def callback(f):
-                try:
-                    futures.pop(data)
-                except:  # noqa
-                    print("Please handle {} for {}.".format(f.exception(), data))
-                    raise
+            data = brotli.compress(data, quality=5)
+        else:
+            data = gzip.compress(data, compresslevel=6)
+        result.compression_time = time.perf_counter() - start
+        result.compressed_size = len(data)
 
-            return callback
+        return data, {"content-encoding": self._compression}
 
-        for idx, batch in enumerate(batches):
+    def _pack(self, messages: list, gobits: dict, subject: str, max_bytes: int, batch_size: int = None):
+        """
+        Yield batches of records with their serialized message, filling
+        every message up to a number of bytes.
+
+        Records are serialized once and joined into the same message as
+        codec.dumps would produce, including the gobits envelope.
+
+        :param messages:   A list of messages to pack.
+        :param gobits:     Gobits dictionary that has metadata about the messages.
+        :param subject:    Subject of the message data.
+        :param max_bytes:  Maximum message size in bytes.
+        :param batch_size: Optional maximum number of records per message.
+        """
 
-            msg = {
-                "gobits": [gobits],
-                subject: batch
-            }
+        head = codec.dumps({"gobits": [gobits], subject: []})[:-2]
+        envelope = len(head) + len(b"]}")
 
-            futures.update({idx: None})
+        batch, parts, size = [], [], envelope
+        for message in messages:
+            part = codec.dumps(message)
+            if envelope + len(part) > max_bytes:
+                logging.warning(f"Record of {len(part)} bytes exceeds the message size of {max_bytes} bytes")
 
-            future = self._client.publish(topic_path, json.dumps(msg).encode('utf-8'))
+            full = batch_size and len(batch) >= batch_size
+            if batch and (full or size + len(codec.SEPARATOR) + len(part) > max_bytes):
+                yield batch, head + codec.SEPARATOR.join(parts) + b"]}"
+                batch, parts, size = [], [], envelope
 
-            futures[idx] = future
-            future.add_done_callback(get_callback(future, idx))
+            size += len(part) + (len(codec.SEPARATOR) if parts else 0)
+            batch.append(message)
+            parts.append(part)
 
-        while futures:
-            time.sleep(0.1)
+        if batch:
+            yield batch, head + codec.SEPARATOR.join(parts) + b"]}"
 
     def _chunks(self, lst: list, n: int):
         """
@@ -0,0 +1,243 @@
+import json
+from io import BufferedReader, TextIOWrapper
+
+import codec
+
+WHITESPACE = " \t\n\r"
+
+
+class JsonStream:
+    """
+    Incremental reader for json documents in a binary stream.
+
+    Only the text of the value being decoded is kept in memory, so the
+    elements of a large json array can be read one by one.
+
+    :param stream:    Binary file object with utf-8 encoded json.
+    :param read_size: Number of characters to read at a time.
+    """
+
+    def __init__(self, stream, read_size: int = 1 << 16):
+        self._stream = TextIOWrapper(stream, encoding="utf-8-sig")
+        self._read_size = read_size
+        self._decoder = json.JSONDecoder()
+        self._text = ""
+        self._position = 0
+        self._eof = False
+
+    def _fill(self, size: int = None) -> bool:
+        """
+        Reads more text from the stream, dropping the consumed text.
+
+        :param size: Number of characters to read.
+        """
+
+        if self._eof:
+            return False
+
+        chunk = self._stream.read(size or self._read_size)
+        if not chunk:
+            self._eof = True
+            return False
+
+        self._text = self._text[self._position:] + chunk
+        self._position = 0
+
+        return True
+
+    def peek(self) -> str:
+        """Returns the next non-whitespace character without consuming it."""
+
+        while True:
+            while self._position < len(self._text) and self._text[self._position] in WHITESPACE:
+                self._position += 1
+            if self._position < len(self._text):
+                return self._text[self._position]
+            if not self._fill():
+                return ""
+
+    def expect(self, character: str):
+        """
+        Consumes the next non-whitespace character.
+
+        :param character: The character that is expected.
+        """
+
+        found = self.peek()
+        if found != character:
+            raise json.JSONDecodeError(f"Expecting '{character}'", self._text, self._position)
+        self._position += 1
+
+    def decode(self):
+        """Decodes the next json value."""
+
+        self.peek()
+        size = self._read_size
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._text, self._position)
+            except json.JSONDecodeError:
+                # The value may continue beyond the text read so far
+                if not self._fill(size):
+                    raise
+            else:
+                # Numbers and literals may continue beyond the text read so far
+                if end < len(self._text) or not self._fill(size):
+                    self._position = end
+                    return value
+            size *= 2
+
+    def array(self):
+        """Yields the elements of the json array at the current position."""
+
+        self.expect("[")
+        if self.peek() == "]":
+            self._position += 1
+            return
+
+        while True:
+            yield self.decode()
+            if self.peek() == ",":
+                self._position += 1
+            else:
+                self.expect("]")
+                return
+
+
+def iter_json(stream, top_level_attribute: str = None, read_size: int = 1 << 16):
+    """
+    Yields the records of a json file one by one.
+
+    The file can hold an array of records, an object with the records in
+    the top level attribute, a single record or line-delimited records.
+
+    :param stream:              Binary file object with json content.
+    :param top_level_attribute: Top level attribute holding the records.
+    :param read_size:           Number of characters to read at a time.
+    """
+
+    reader = JsonStream(stream, read_size)
+
+    while reader.peek():
+        if reader.peek() == "[":
+            yield from reader.array()
+        elif reader.peek() == "{":
+            yield from _iter_object(reader, top_level_attribute)
+        else:
+            yield reader.decode()
+
+
+def iter_lines(stream):
+    """
+    Yields the records of a line-delimited json file one by one,
+    skipping empty lines.
+
+    :param stream: Binary file object with a json record on every line.
+    """
+
+    for line in BufferedReader(stream, 1 << 16):
+        if line.strip():
+            yield codec.loads(line)
+
+
+def _iter_object(reader: JsonStream, top_level_attribute: str = None):
+    """
+    Yields the records of a json object.
+
+    When the object holds the top level attribute its records are yielded
+    while reading, otherwise the object itself is the record.
+
+    :param reader:              JsonStream positioned at the object.
+    :param top_level_attribute: Top level attribute holding the records.
+    """
+
+    reader.expect("{")
+    data = {}
+    found = False
+
+    if reader.peek() == "}":
+        reader.expect("}")
+        yield data
+        return
+
+    while True:
+        key = reader.decode()
+        reader.expect(":")
+
+        if key == top_level_attribute and not found:
+            found = True
+            data = None
+            if reader.peek() == "[":
+                yield from reader.array()
+            else:
+                yield reader.decode()
+        elif found:
+            reader.decode()
+        else:
+            data[key] = reader.decode()
+
+        if reader.peek() == ",":
+            reader.expect(",")
+        else:
+            reader.expect("}")
+            break
+
+    if not found:
+        yield data
+
+
+def iter_xml(stream):
+    """
+    Yields the properties of the entries of an Atom feed one by one.
+
+    The feed is parsed incrementally and every entry is cleared once it
+    has been read, so memory usage does not grow with the feed size.
+
+    :param stream: Binary file object with the xml content.
+    """
+
+    from defusedxml import ElementTree as ET
+
+    depth = 0
+    root = None
+    namespace = None
+
+    for event, element in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if depth == 1:
+                root = element
+                namespace = element.tag[:-4]
+            continue
+
+        depth -= 1
+        if depth != 1:
+            continue
+
+        if element.tag == f"{namespace}entry":
+            yield from _entry_properties(element.find(f"{namespace}content"))
+
+        root.clear()
+
+
+def _entry_properties(content):
+    """
+    Yields the properties of an Atom entry content element.
+
+    Properties without text are skipped and the properties are yielded
+    once for every properties element of the content.
+
+    :param content: The content element of an entry.
+    """
+
+    items = {}
+    count = 0
+    for properties in content:
+        if properties.tag.endswith("}properties"):
+            for prop in properties:
+                if prop.text:
+                    items[prop.tag.split("}")[-1]] = prop.text
+            count += 1
+
+    for _ in range(count):
+        yield items
@@ -0,0 +1,356 @@
+import fcntl
+import gzip
+import logging
+import os
+
+import clients
+import codec
+from diff import Diff
+from digest import record_digest
+
+
+class SnapshotConflict(Exception):
+    """
+    Raised when a snapshot was written by someone else since it was read.
+    """
+
+
+class SnapshotState:
+    """
+    State backend that keeps a sorted key to digest snapshot per kind.
+
+    Every run reads the snapshot of a kind once, calculates the difference
+    and applies its changes in memory, and writes back a new snapshot once
+    on flush, guarded by the generation of the snapshot that was read.
+
+    :param store:   Store to read and write snapshot objects.
+    :param prefix:  Prefix of the snapshot object names.
+    :param retries: Number of times to merge and retry a conflicting write.
+    """
+
+    def __init__(self, store, prefix: str = "state/", retries: int = 3):
+        self._store = store
+        self._prefix = prefix or ""
+        self._retries = retries
+        self._snapshots = {}
+        self._updates = {}
+
+    def _name(self, kind: str) -> str:
+        """
+        Returns the object name of the snapshot of a kind.
+
+        :param kind: Kind name.
+        """
+
+        return f"{self._prefix}{kind}.json.gz"
+
+    def _load(self, kind: str):
+        """
+        Reads the snapshot of a kind.
+
+        :param kind: Kind name.
+
+        :return: Dictionary of key to digest and the generation read.
+        """
+
+        data, generation = self._store.read(self._name(kind))
+        digests = {}
+        if data:
+            digests = {key: digest for key, digest in codec.loads(gzip.decompress(data))["records"]}
+
+        self._snapshots[kind] = (digests, generation)
+
+        return self._snapshots[kind]
+
+    def _snapshot(self, kind: str) -> dict:
+        """
+        Returns the key to digest dictionary of a kind, reading it once.
+
+        :param kind: Kind name.
+        """
+
+        if kind not in self._snapshots:
+            self._load(kind)
+
+        return self._snapshots[kind][0]
+
+    def _dump(self, digests: dict) -> bytes:
+        """
+        Serializes a key to digest dictionary into a compressed snapshot.
+
+        :param digests: Dictionary of key to digest.
+        """
+
+        records = sorted(digests.items(), key=lambda item: (isinstance(item[0], str), item[0]))
+        return gzip.compress(codec.dumps({"records": records}))
+
+    def diff(self, data: list, kind: str, property: str) -> Diff:
+        """
+        Returns the records that are new or changed according to the
+        snapshot of a kind, in the order of the data.
+
+        :param kind:     Kind name.
+        :param property: Property holding the record key.
+        """
+
+        digests = self._snapshot(kind)
+
+        result = Diff([], set(), set())
+        for item in data:
+            digest = digests.get(item[property])
+            if digest is None:
+                result.added.add(item[property])
+            elif digest != record_digest(item):
+                result.changed.add(item[property])
+            else:
+                continue
+            result.records.append(item)
+
+        return result
+
+    def difference(self, data: list, kind: str, property: str):
+        """
+        Returns a list of records that are new or changed according
+        to the snapshot of a kind.
+
+        :param kind:     Kind name.
+        :param property: Property holding the record key.
+        """
+
+        return self.diff(data, kind, property).records
+
+    def removed(self, keys: set, kind: str, property: str) -> list:
+        """
+        Returns the records in the snapshot of a kind whose keys are not in
+        a set of keys. The records only hold their key.
+
+        :param keys:     Keys of all records of a full snapshot.
+        :param kind:     Kind name.
+        :param property: Property holding the record key.
+        """
+
+        return [{property: key} for key in self._snapshot(kind) if key not in keys]
+
+    def put_multi(self, data: list, kind: str, property: str):
+        """
+        Adds records to the snapshot of a kind, written back on flush.
+
+        :param kind:     Kind name.
+        :param property: Property holding the record key.
+        """
+
+        self._change(kind, {item[property]: record_digest(item) for item in data})
+
+    def delete_multi(self, data: list, kind: str, property: str):
+        """
+        Removes records from the snapshot of a kind, written back on flush.
+
+        :param kind:     Kind name.
+        :param property: Property holding the record key.
+        """
+
+        self._change(kind, {item[property]: None for item in data})
+
+    def _change(self, kind: str, changes: dict):
+        """
+        Applies changes to the snapshot of a kind in memory.
+
+        :param kind:    Kind name.
+        :param changes: Dictionary of key to digest, None for removed keys.
+        """
+
+        self._updates.setdefault(kind, {}).update(changes)
+        _apply(self._snapshot(kind), changes)
+
+    def flush(self):
+        """
+        Writes back the snapshots of the kinds changed since the last flush.
+
+        When a snapshot was changed by a concurrent run, the changes of
+        this run are merged into the latest snapshot and written again.
+        """
+
+        for kind in list(self._updates):
+            self._write(kind)
+
+    def _write(self, kind: str):
+        """
+        Writes back the snapshot of a kind with its pending changes.
+
+        :param kind: Kind name.
+        """
+
+        updates = self._updates[kind]
+        digests, generation = self._snapshots[kind]
+
+        for attempt in range(self._retries + 1):
+            try:
+                self._snapshots[kind] = (digests, self._store.write(self._name(kind), self._dump(digests), generation))
+                break
+            except SnapshotConflict:
+                if attempt == self._retries:
+                    raise
+                logging.warning(f"Snapshot of {kind} was changed concurrently, merging and retrying")
+                digests, generation = self._load(kind)
+                _apply(digests, updates)
+
+        del self._updates[kind]
+
+    def get_metadata(self, kind: str, name: str):
+        """
+        Returns metadata stored for a kind, None if it does not exist.
+
+        :param kind: Kind name.
+        :param name: Name of the metadata.
+        """
+
+        data, _ = self._store.read(f"{self._prefix}{kind}.metadata/{name}.json")
+
+        return codec.loads(data) if data else None
+
+    def put_metadata(self, kind: str, name: str, value: dict):
+        """
+        Stores metadata for a kind.
+
+        :param kind:  Kind name.
+        :param name:  Name of the metadata.
+        :param value: Dictionary with the metadata.
+        """
+
+        self._store.write(f"{self._prefix}{kind}.metadata/{name}.json", codec.dumps(value))
+
+
+def _apply(digests: dict, changes: dict) -> dict:
+    """
+    Applies changes to a key to digest dictionary.
+
+    :param digests: Dictionary of key to digest.
+    :param changes: Dictionary of key to digest, None for removed keys.
+    """
+
+    for key, digest in changes.items():
+        if digest is None:
+            digests.pop(key, None)
+        else:
+            digests[key] = digest
+
+    return digests
+
+
+class GoogleCloudStorageStore:
+    """
+    Class that reads and writes snapshot objects in Google Cloud Storage.
+
+    :param bucket_name: The bucket holding the snapshots.
+    """
+
+    def __init__(self, bucket_name: str):
+        self._bucket = clients.storage_client().bucket(bucket_name)
+
+    def read(self, name: str):
+        """
+        Reads an object.
+
+        :param name: The name of the object.
+
+        :return: The content, None if it does not exist, and its generation.
+        """
+
+        blob = self._bucket.get_blob(name)
+        if not blob:
+            return None, 0
+
+        return blob.download_as_bytes(if_generation_match=blob.generation), blob.generation
+
+    def write(self, name: str, data: bytes, generation: int = None) -> int:
+        """
+        Writes an object if its generation is still the one read.
+
+        :param name:       The name of the object.
+        :param data:       The content to write.
+        :param generation: Expected generation, 0 when it did not exist
+                           and None to write unconditionally.
+
+        :return: The new generation.
+        """
+
+        from google.api_core.exceptions import PreconditionFailed
+
+        blob = self._bucket.blob(name)
+        try:
+            blob.upload_from_string(data, content_type="application/octet-stream", if_generation_match=generation)
+        except PreconditionFailed:
+            raise SnapshotConflict(name)
+
+        return blob.generation
+
+
+class LocalStore:
+    """
+    Class that reads and writes snapshot objects in a local directory,
+    keeping a generation counter next to every object.
+
+    :param directory: The directory holding the snapshots.
+    """
+
+    def __init__(self, directory: str):
+        self._directory = directory
+
+    def _path(self, name: str) -> str:
+        path = os.path.join(self._directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _generation(self, path: str) -> int:
+        try:
+            with open(f"{path}.generation") as f:
+                return int(f.read())
+        except FileNotFoundError:
+            return 0
+
+    def read(self, name: str):
+        """
+        Reads an object.
+
+        :param name: The name of the object.
+
+        :return: The content, None if it does not exist, and its generation.
+        """
+
+        path = self._path(name)
+        with open(f"{path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            generation = self._generation(path)
+            if not generation:
+                return None, 0
+            with open(path, "rb") as f:
+                return f.read(), generation
+
+    def write(self, name: str, data: bytes, generation: int = None) -> int:
+        """
+        Writes an object if its generation is still the one read.
+
+        :param name:       The name of the object.
+        :param data:       The content to write.
+        :param generation: Expected generation, 0 when it did not exist
+                           and None to write unconditionally.
+
+        :return: The new generation.
+        """
+
+        path = self._path(name)
+        with open(f"{path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if generation is None:
+                generation = self._generation(path)
+            elif self._generation(path) != generation:
+                raise SnapshotConflict(name)
+
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(data)
+            os.replace(f"{path}.tmp", path)
+
+            with open(f"{path}.generation", "w") as f:
+                f.write(str(generation + 1))
+
+        return generation + 1
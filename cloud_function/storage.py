@@ -1,23 +1,46 @@
-import json
-from io import BytesIO
-
-import brotli
-import pandas as pd
-from defusedxml import ElementTree as ET
+import base64
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from gzip import GzipFile
+from io import BufferedReader, BytesIO, RawIOBase
+from tempfile import SpooledTemporaryFile
+
+import clients
+import codec
 from event_formatter import Formatter
-from google.cloud import storage
+from metrics import MeteredReader, Metrics
+from readers import iter_json, iter_lines, iter_xml
 from retry import retry
 
+# File types that can be read from a watermark, and those with a header line
+APPENDABLE = ("csv", "ndjson", "jsonl")
+HEADER = ("csv",)
+HEADER_SIZE = 1 << 12
+
+# Csv parameters that change which lines are rows, with which a tail cannot be read
+ROW_PARAMETERS = ("header", "names", "skiprows", "skipfooter", "nrows", "comment", "lineterminator", "encoding")
+
+# Size from which the appended content is kept in a temporary file instead of memory
+SPOOL_SIZE = 1 << 25
+
+# File types that are read in part from a seekable file object
+SEEKABLE = ("parquet", "arrow", "feather")
+
 
 class File:
     """
     Class that represents a file with records, which can be converted
-    to json from other formats, such as xml, csv and xlsx.
+    to json from other formats, such as xml, csv, xlsx, line-delimited
+    json, Parquet and Arrow.
 
     :param name:             The name of the file.
-    :param content:          The content of the file in string format.
+    :param content:          The content of the file in string format
+                             or a binary file object.
     :csv_dialect_parameters: Parameters for reading csv files.
     :top_level_attribute:    Top level json attribute holding the records.
+    :fingerprint:            Fingerprint of the content, if known.
+    :watermark:              Watermark of the end of an append-only file.
+    :metrics:                Metrics of parsing and formatting the file.
     """
 
     def __init__(self, name: str, content: str):
@@ -25,6 +48,9 @@ class File:
         self.content = content
         self.csv_dialect_parameters = {}
         self.top_level_attribute = None
+        self.fingerprint = None
+        self.watermark = None
+        self.metrics = Metrics()
 
     @property
     def type(self):
@@ -51,6 +77,40 @@ class File:
         if self.type == "csv":
             return True
 
+    def _is_ndjson(self):
+        """Indicates whether it is a line-delimited json file"""
+        if self.type in ("ndjson", "jsonl"):
+            return True
+
+    def _is_parquet(self):
+        """Indicates whether it is a Parquet file"""
+        if self.type == "parquet":
+            return True
+
+    def _is_arrow(self):
+        """Indicates whether it is an Arrow IPC file or stream"""
+        if self.type in ("arrow", "feather", "arrows"):
+            return True
+
+    def _open(self):
+        """Returns the content as a binary file object."""
+        if hasattr(self.content, "read"):
+            return self.content
+        return BytesIO(self.content)
+
+    def _read(self):
+        """Returns the content in string format."""
+        if hasattr(self.content, "read"):
+            return self.content.read()
+        return self.content
+
+    def _open_seekable(self):
+        """Returns the content as a seekable binary file object."""
+        content = self._open()
+        if content.seekable():
+            return content
+        return BytesIO(content.read())
+
     def to_json(self, formatter: Formatter):
         """
         Transforms multiple file formats to json.
@@ -59,89 +119,651 @@ class File:
                     given a formatting template.
         """
 
+        import pandas as pd
+
         if self._is_xlsx():
-            df = pd.read_excel(BytesIO(self.content), dtype=str)
-            df[df.isnull()] = None
-            data = df.to_dict(orient="records")
+            with self.metrics.stage("parse"):
+                df = pd.read_excel(BytesIO(self._read()), dtype=str)
+                df[df.isnull()] = None
+            return self._format_frame(formatter, df)
         elif self._is_csv():
-            df = pd.read_csv(BytesIO(self.content), **self.csv_dialect_parameters)
-            data = df.to_dict(orient="records")
+            with self.metrics.stage("parse"):
+                df = pd.read_csv(self._open(), **self.csv_dialect_parameters)
+            return self._format_frame(formatter, df)
+        elif self._is_parquet() or self._is_arrow():
+            with self.metrics.stage("parse"):
+                df = self._read_table(formatter).to_pandas()
+            return self._format_frame(formatter, df)
         elif self._is_xml():
-            data = self._xml_to_json(self.content)
+            data = self.metrics.iterate("parse", iter_xml(self._open()), "records_in")
+        elif self._is_ndjson():
+            data = self.metrics.iterate("parse", iter_lines(self._open()), "records_in")
         elif self._is_json():
-            data = json.loads(self.content)
-            if isinstance(data, dict):
-                data = data.get(self.top_level_attribute, data)
+            with self.metrics.stage("parse"):
+                data = codec.loads(self._read())
+                if isinstance(data, dict):
+                    data = data.get(self.top_level_attribute, data)
         else:
             raise NotImplementedError("Unknown file type!")
 
-        data = formatter.format(data)
+        return self._format(formatter, data)
 
-        return data
+    def iter_json(self, formatter: Formatter, chunk_size: int):
+        """
+        Transforms multiple file formats to json in chunks of records.
+
+        Csv, json, xml, Parquet and Arrow files are read incrementally,
+        so only a chunk of records is kept in memory at a time.
+
+        :formatter:  Formatter to format a list of json records
+                     given a formatting template.
+        :chunk_size: Maximum number of records per chunk.
+        """
+
+        if self._is_csv():
+            import pandas as pd
+
+            with pd.read_csv(self._open(), chunksize=chunk_size, **self.csv_dialect_parameters) as reader:
+                for df in self.metrics.iterate("parse", reader):
+                    yield self._format_frame(formatter, df)
+        elif self._is_parquet() or self._is_arrow():
+            for df in self.metrics.iterate("parse", self._iter_frames(formatter, chunk_size)):
+                yield self._format_frame(formatter, df)
+        elif self._is_xml() or self._is_json() or self._is_ndjson():
+            if self._is_xml():
+                records = iter_xml(self._open())
+            elif self._is_ndjson():
+                records = iter_lines(self._open())
+            else:
+                records = iter_json(self._open(), self.top_level_attribute)
+            for chunk in self._chunks(self.metrics.iterate("parse", records), chunk_size):
+                yield self._format(formatter, chunk)
+        else:
+            yield from self._chunks(self.to_json(formatter), chunk_size)
+
+    def _columns(self, formatter: Formatter, names: list):
+        """
+        Returns the columns of a table the formatter uses, None for all
+        columns when it uses none of them.
+
+        :formatter: Formatter to format the records with.
+        :names:     Column names of the table.
+        """
+
+        keys = set(formatter.keys)
+        return [name for name in names if name in keys] or None
+
+    def _read_table(self, formatter: Formatter):
+        """
+        Reads the columns the formatter uses of a Parquet or Arrow file.
+
+        :formatter: Formatter to format the records with.
+        """
+
+        pa = import_pyarrow(self.type)
+
+        if self._is_parquet():
+            parquet = pa.parquet.ParquetFile(self._open_seekable())
+            return parquet.read(columns=self._columns(formatter, parquet.schema_arrow.names))
+        elif self.type == "arrows":
+            table = pa.ipc.open_stream(BufferedReader(self._open(), 1 << 20)).read_all()
+        else:
+            table = pa.ipc.open_file(self._open_seekable()).read_all()
+
+        columns = self._columns(formatter, table.column_names)
+        if columns:
+            table = pa.Table.from_arrays([table.column(name) for name in columns], names=columns)
+
+        return table
+
+    def _iter_frames(self, formatter: Formatter, chunk_size: int):
+        """
+        Yields the columns the formatter uses of a Parquet or Arrow file
+        as pandas DataFrames of at most chunk_size rows.
+
+        :formatter:  Formatter to format the records with.
+        :chunk_size: Maximum number of rows per DataFrame.
+        """
+
+        pa = import_pyarrow(self.type)
+
+        if self._is_parquet():
+            parquet = pa.parquet.ParquetFile(self._open_seekable())
+            columns = self._columns(formatter, parquet.schema_arrow.names)
+            for batch in parquet.iter_batches(batch_size=chunk_size, columns=columns):
+                yield batch.to_pandas()
+            return
+        elif self.type == "arrows":
+            reader = pa.ipc.open_stream(BufferedReader(self._open(), 1 << 20))
+            batches = iter(reader)
+        else:
+            reader = pa.ipc.open_file(self._open_seekable())
+            batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+
+        columns = self._columns(formatter, reader.schema.names)
+        for batch in batches:
+            if columns:
+                batch = pa.RecordBatch.from_arrays([batch.column(name) for name in columns], names=columns)
+            for offset in range(0, batch.num_rows, chunk_size):
+                yield batch.slice(offset, chunk_size).to_pandas()
+
+    def _format(self, formatter: Formatter, records) -> list:
+        """
+        Formats records, counting the records formatted and dropped.
+
+        :formatter: Formatter to format the records with.
+        :records:   Records read from the file, a single record or an
+                    iterator that counts the records in the metrics.
+        """
 
-    def _xml_to_json(self, xml: str):
+        before = self.metrics.counts["records_in"]
+        with self.metrics.stage("format"):
+            formatted = formatter.format(records)
+
+        if isinstance(records, (list, dict)):
+            self.metrics.add("records_in", len(records) if isinstance(records, list) else 1)
+        self.metrics.add("records_out", len(formatted))
+        self.metrics.add("records_dropped", self.metrics.counts["records_in"] - before - len(formatted))
+
+        return formatted
+
+    def _format_frame(self, formatter: Formatter, df) -> list:
         """
-        Transforms xml to json.
+        Formats the rows of a DataFrame, counting the records formatted
+        and dropped.
+
+        :formatter: Formatter to format the rows with.
+        :df:        The pandas DataFrame read from the file.
+        """
+
+        with self.metrics.stage("format"):
+            formatted = formatter.format_frame(df)
+            if self._is_parquet() or self._is_arrow():
+                # Typed columns hold dates, times and decimals the state cannot compare or store
+                formatted = codec.plain(formatted)
 
-        :xml: XML content in string format.
+        self.metrics.add("records_in", len(df))
+        self.metrics.add("records_out", len(formatted))
+        self.metrics.add("records_dropped", len(df) - len(formatted))
+
+        return formatted
+
+    def _chunks(self, records, n: int):
         """
+        Yield successive n-sized lists from an iterable of records.
 
-        tree = ET.fromstring(xml)
-        namespace = tree.tag[:-4]
-        contents = [
-            entry.find(f"{namespace}content")
-            for entry in tree.findall(f"{namespace}entry")
-        ]
+        :param records: The records to chunk.
+        :param n:       The number of items per list.
+        """
 
-        result = []
-        for content in contents:
-            items = {}
-            for properties in content:
-                if properties.tag.endswith("}properties"):
-                    for prop in properties:
-                        if prop.text:
-                            items[prop.tag.split("}")[-1]] = prop.text
-                    result.append(items)
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= n:
+                yield chunk
+                chunk = []
 
-        return result
+        if chunk:
+            yield chunk
 
 
 class GoogleCloudStorage:
     """
     Class that interacts with Google Cloud Storage.
+
+    :param client: Storage client to use instead of the shared one.
     """
 
-    def __init__(self):
-        self._client = storage.Client()
+    def __init__(self, client=None):
+        self._client = client or clients.storage_client()
 
     @retry(ConnectionError, tries=3, delay=2, backoff=2, logger=None)
-    def read(self, file_name: str, bucket_name: str):
+    def read(self, file_name: str, bucket_name: str, metrics: Metrics = None):
         """
-        Reads a file from Google Cloud Storage.
+        Reads a file from Google Cloud Storage. Only the metadata is
+        fetched, the content is downloaded while the file is read.
 
         :file_name:   The name of the file object.
         :bucket_name: The source bucket of the file object.
+        :metrics:     Metrics to time the download and decompression with.
         """
 
-        bucket = self._client.get_bucket(bucket_name)
-        blob = bucket.get_blob(file_name)
+        metrics = metrics or Metrics()
+        with metrics.stage("download"):
+            blob = self._client.bucket(bucket_name).get_blob(file_name)
 
-        data = blob.download_as_string(raw_download=True)
-        data = self._decompress(data, blob.content_encoding)
+        file = File(file_name, None)
+        file.content = open_blob(blob, metrics, seekable=file.type in SEEKABLE)
+        file.fingerprint = self._fingerprint(blob)
+        file.metrics = metrics
 
-        file = File(file_name, data)
+        return file
+
+    @retry(ConnectionError, tries=3, delay=2, backoff=2, logger=None)
+    def read_appended(self, file_name: str, bucket_name: str, watermark: dict = None, metrics: Metrics = None,
+                      csv_dialect_parameters: dict = None):
+        """
+        Reads a file that only grows by appending records. When the content
+        before the watermark of an earlier run is unchanged, only the content
+        after it is downloaded, preceded by the header line. Otherwise the
+        whole file is read, as it is when the csv dialect parameters change
+        which lines are rows.
+
+        The file gets the watermark of its end, to store once its records are
+        processed. Its row count is the number of rows before the content read.
+
+        :file_name:              The name of the file object.
+        :bucket_name:            The source bucket of the file object.
+        :watermark:              Watermark stored by an earlier run, if any.
+        :metrics:                Metrics to time the download and decompression with.
+        :csv_dialect_parameters: Parameters for reading csv files.
+        """
+
+        metrics = metrics or Metrics()
+        with metrics.stage("download"):
+            blob = self._client.bucket(bucket_name).get_blob(file_name)
+
+        file = File(file_name, None)
+        file.fingerprint = self._fingerprint(blob)
+        file.metrics = metrics
+
+        headed = file.type in HEADER
+        parameters = [name for name in csv_dialect_parameters or {} if name in ROW_PARAMETERS] if headed else []
+        if blob.content_encoding or file.type not in APPENDABLE or parameters or not blob.crc32c:
+            logging.info("File is compressed, cannot be appended to or has no checksum, reading the whole file")
+            file.content = open_blob(blob, metrics, seekable=file.type in SEEKABLE)
+            return file
+
+        # Only a file ending with a complete row can be continued from its end
+        with metrics.stage("download"):
+            last = blob.download_as_bytes(start=blob.size - 1, end=blob.size - 1, raw_download=True) \
+                if blob.size else b""
+        metrics.add("bytes_downloaded", len(last))
+        if last == b"\n":
+            file.watermark = {"offset": blob.size, "rows": 0, "crc32c": blob.crc32c}
+
+        content = None
+        if watermark and watermark.get("crc32c") and watermark["offset"] <= blob.size:
+            content = self._read_tail(blob, watermark, headed, metrics)
+
+        if content is None:
+            file.content = open_blob(blob, metrics)
+        else:
+            metrics.add("bytes_skipped", watermark["offset"])
+            file.content = content
+            if file.watermark:
+                file.watermark["rows"] = watermark["rows"]
 
         return file
 
-    def _decompress(self, data: str, content_encoding: str):
+    def _read_tail(self, blob, watermark: dict, headed: bool, metrics: Metrics):
         """
-        Decompresses data with Brotli algorithm.
+        Downloads the content of a blob after a watermark, preceded by the
+        header line, when the content before the watermark is unchanged:
+        the CRC32C of the content up to the watermark, extended with the
+        content after it, has to be the CRC32C of the blob.
+
+        :blob:      The Google Cloud Storage blob.
+        :watermark: Watermark stored by an earlier run.
+        :headed:    Whether the file starts with a header line.
+        :metrics:   Metrics to time the download with.
+
+        :return: Binary file object of the content, None when the content
+                 before the watermark changed.
+        """
+
+        import google_crc32c
+
+        offset = watermark["offset"]
+        header = b""
+        if headed:
+            # Download twice as much until the header line is complete
+            head, size = b"", HEADER_SIZE
+            while b"\n" not in head and len(head) < offset:
+                with metrics.stage("download"):
+                    part = blob.download_as_bytes(start=len(head), end=min(offset, size) - 1, raw_download=True)
+                metrics.add("bytes_downloaded", len(part))
+                head, size = head + part, size * 2
+            if b"\n" not in head:
+                logging.info("File has no header line before the watermark, reading the whole file")
+                return None
+            header = head[:head.index(b"\n") + 1]
+
+        crc = crc32c_value(watermark["crc32c"])
+        tail = SpooledTemporaryFile(SPOOL_SIZE)
+        stream = open_blob(blob, metrics, offset)
+        try:
+            for chunk in iter(lambda: stream.read(1 << 20), b""):
+                crc = google_crc32c.extend(crc, chunk)
+                tail.write(chunk)
+        finally:
+            stream.close()
+
+        if crc != crc32c_value(blob.crc32c):
+            logging.info("File was changed before the watermark, reading the whole file")
+            tail.close()
+            return None
+
+        logging.info(f"Reading from byte {offset}, skipping {watermark['rows']} rows")
+        tail.seek(0)
+
+        return PrefixedReader(header, tail)
+
+    def _fingerprint(self, blob):
+        """
+        Returns a fingerprint of the content of a blob from its metadata,
+        None when the blob has no checksum.
 
-        :data:             Data in string format.
-        :content-encoding: The encoding of the file.
+        :blob: The Google Cloud Storage blob.
         """
 
-        if content_encoding == "br":
-            return brotli.decompress(data)
+        checksum = blob.md5_hash or blob.crc32c
+        if not checksum:
+            return None
+
+        return f"{checksum}:{blob.size}:{blob.content_encoding or ''}"
+
 
+def import_pyarrow(file_type: str):
+    """
+    Returns the pyarrow module, which is not a requirement of the function.
+
+    :param file_type: Type of the file that is read with pyarrow.
+    """
+
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+    except ImportError as e:
+        raise ValueError(f"Reading {file_type} files requires pyarrow, add it to requirements.txt!") from e
+
+    return pyarrow
+
+
+def crc32c_value(checksum: str) -> int:
+    """
+    Returns the value of a base64 encoded CRC32C checksum of Cloud Storage.
+
+    :param checksum: The encoded checksum.
+    """
+
+    return int.from_bytes(base64.b64decode(checksum), "big")
+
+
+def open_blob(blob, metrics: Metrics = None, start: int = 0, seekable: bool = False):
+    """
+    Opens a blob as a binary file object, which downloads the blob in
+    chunks and decompresses Brotli or gzip content while it is read.
+
+    :blob:     The Google Cloud Storage blob to open.
+    :metrics:  Optional metrics to time the download and decompression with.
+    :start:    Byte to start reading from, for uncompressed blobs only.
+    :seekable: Open a seekable file object, that only downloads the ranges
+               read of an uncompressed blob. Compressed blobs are then
+               decompressed into memory.
+    """
+
+    if seekable and not blob.content_encoding:
+        return BlobFile(blob, metrics)
+
+    data = BlobReader(blob, start)
+    if metrics:
+        data = MeteredReader(data, metrics, "download", "bytes_downloaded")
+
+    if blob.content_encoding == "br":
+        data = BrotliReader(data)
+    elif blob.content_encoding == "gzip":
+        data = GzipFile(fileobj=data, mode="rb")
+    else:
         return data
+
+    if metrics:
+        data = MeteredReader(data, metrics, "decompress", "bytes_decompressed")
+    if seekable:
+        return BytesIO(data.read())
+
+    return data
+
+
+class ChunkReader(RawIOBase):
+    """
+    Read-only binary file object that serves reads from chunks of bytes.
+
+    Subclasses implement _next_chunk, returning empty bytes at the end.
+    """
+
+    def __init__(self):
+        self._chunk = memoryview(b"")
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def _next_chunk(self) -> bytes:
+        raise NotImplementedError()
+
+    def readinto(self, buffer) -> int:
+        """
+        Reads bytes from the current chunk into a buffer.
+
+        :param buffer: Writable buffer to read into.
+        """
+
+        while self._offset >= len(self._chunk):
+            chunk = self._next_chunk()
+            if not chunk:
+                return 0
+            self._chunk = memoryview(chunk)
+            self._offset = 0
+
+        size = min(len(buffer), len(self._chunk) - self._offset)
+        buffer[:size] = self._chunk[self._offset:self._offset + size]
+        self._offset += size
+
+        return size
+
+    def readall(self) -> bytes:
+        """Reads the remaining chunks."""
+
+        chunks = [self._chunk[self._offset:].tobytes()]
+        self._chunk = memoryview(b"")
+
+        chunk = self._next_chunk()
+        while chunk:
+            chunks.append(chunk)
+            chunk = self._next_chunk()
+
+        return b"".join(chunks)
+
+
+class BlobReader(ChunkReader):
+    """
+    Read-only binary file object that downloads a blob in ranged chunks,
+    so the blob does not have to be held in memory as a whole. The next
+    chunk is downloaded in the background while the current one is read.
+
+    :param blob:  The Google Cloud Storage blob to read.
+    :param start: Byte to start reading from.
+    """
+
+    chunk_size = 1 << 20
+
+    def __init__(self, blob, start: int = 0):
+        super().__init__()
+        self._blob = blob
+        self._size = blob.size or 0
+        self._position = start
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+
+    def _submit(self):
+        """Starts downloading the next range of the blob."""
+
+        if self._position >= self._size:
+            return None
+
+        end = min(self._position + BlobReader.chunk_size, self._size)
+        future = self._executor.submit(self._download, self._position, end - 1)
+        self._position = end
+
+        return future
+
+    def _next_chunk(self) -> bytes:
+        """Returns the next range of the blob and prefetches the one after."""
+
+        future = self._pending or self._submit()
+        if not future:
+            self._executor.shutdown(wait=False)
+            return b""
+
+        self._pending = self._submit()
+
+        return future.result()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        super().close()
+
+    @retry(ConnectionError, tries=3, delay=2, backoff=2, logger=None)
+    def _download(self, start: int, end: int) -> bytes:
+        """
+        Downloads a byte range of the blob.
+
+        :param start: First byte of the range.
+        :param end:   Last byte of the range (inclusive).
+        """
+
+        return self._blob.download_as_bytes(start=start, end=end, raw_download=True)
+
+
+class BlobFile(RawIOBase):
+    """
+    Seekable read-only binary file object that downloads exactly the byte
+    ranges read of a blob, so only the parts of a columnar file that are
+    needed are downloaded.
+
+    :param blob:    The uncompressed Google Cloud Storage blob to read.
+    :param metrics: Optional metrics to time the downloads with.
+    """
+
+    def __init__(self, blob, metrics: Metrics = None):
+        self._blob = blob
+        self._size = blob.size or 0
+        self._position = 0
+        self._metrics = metrics or Metrics()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += self._size
+        self._position = max(offset, 0)
+
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        """
+        Downloads the next bytes of the blob into a buffer.
+
+        :param buffer: Writable buffer to read into.
+        """
+
+        size = min(len(buffer), self._size - self._position)
+        if size <= 0:
+            return 0
+
+        with self._metrics.stage("download"):
+            data = self._download(self._position, self._position + size - 1)
+        self._metrics.add("bytes_downloaded", len(data))
+
+        buffer[:len(data)] = data
+        self._position += len(data)
+
+        return len(data)
+
+    def readall(self) -> bytes:
+        """Downloads the remaining bytes of the blob."""
+
+        return self.read(max(self._size - self._position, 0))
+
+    @retry(ConnectionError, tries=3, delay=2, backoff=2, logger=None)
+    def _download(self, start: int, end: int) -> bytes:
+        """
+        Downloads a byte range of the blob.
+
+        :param start: First byte of the range.
+        :param end:   Last byte of the range (inclusive).
+        """
+
+        return self._blob.download_as_bytes(start=start, end=end, raw_download=True)
+
+
+class PrefixedReader(ChunkReader):
+    """
+    Read-only binary file object that reads bytes followed by a stream.
+
+    :param prefix: The bytes to read first.
+    :param stream: Binary file object to read after the prefix.
+    """
+
+    read_size = 1 << 20
+
+    def __init__(self, prefix: bytes, stream):
+        super().__init__()
+        self._prefix = prefix
+        self._stream = stream
+
+    def _next_chunk(self) -> bytes:
+        """Returns the prefix, then the next part of the stream."""
+
+        if self._prefix:
+            chunk, self._prefix = self._prefix, b""
+            return chunk
+
+        return self._stream.read(PrefixedReader.read_size)
+
+    def close(self):
+        self._stream.close()
+        super().close()
+
+
+class BrotliReader(ChunkReader):
+    """
+    Read-only binary file object that decompresses a Brotli stream
+    incrementally while it is read.
+
+    :param stream: Binary file object with Brotli compressed data.
+    """
+
+    read_size = 1 << 16
+
+    def __init__(self, stream):
+        import brotli
+
+        super().__init__()
+        self._stream = stream
+        self._decompressor = brotli.Decompressor()
+        self._error = brotli.error
+
+    def _next_chunk(self) -> bytes:
+        """Decompresses the next part of the stream."""
+
+        chunk = b""
+        while not chunk:
+            data = self._stream.read(BrotliReader.read_size)
+            if not data:
+                if not self._decompressor.is_finished():
+                    raise self._error("Brotli stream is truncated")
+                return b""
+            chunk = self._decompressor.process(data)
+
+        return chunk
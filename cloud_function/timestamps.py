@@ -0,0 +1,287 @@
+import math
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+
+DEFAULT_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# Layouts tried for a value, in order, after datetime.fromisoformat. Only
+# month first layouts are listed, as dateutil reads ambiguous dates that way.
+LAYOUTS = (
+    "%Y-%m-%dT%H:%M:%S%z",
+    "%Y-%m-%dT%H:%M:%S.%f%z",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M",
+    "%Y-%m-%d %H:%M:%S%z",
+    "%Y-%m-%d %H:%M:%S.%f%z",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d",
+    "%Y/%m/%d %H:%M:%S",
+    "%Y/%m/%d %H:%M",
+    "%Y/%m/%d",
+    "%m/%d/%Y %H:%M:%S",
+    "%m/%d/%Y %H:%M",
+    "%m/%d/%Y",
+    "%m-%d-%Y %H:%M:%S",
+    "%m-%d-%Y %H:%M",
+    "%m-%d-%Y",
+)
+
+# Maps every digit to 9, so values with the same layout have the same shape
+SHAPE = str.maketrans("0123456789", "9999999999")
+
+
+class TimestampConverter:
+    """
+    Converts the values of a column to uniform string timestamps.
+
+    Gives the same result as parsing every value with dateutil, but infers
+    the layout of the values per shape (the value with all digits replaced
+    by 9) and parses matching values with datetime.fromisoformat or
+    datetime.strptime instead. A layout is only used after it gave the same
+    datetime as dateutil for the first values of its shape, and dateutil is
+    still used for every value the layout does not match.
+
+    Converted strings are kept in a bounded least recently used memo, as
+    many rows share the same timestamps.
+
+    :param format:     strftime format of the result.
+    :param cache_size: Maximum number of values in the memo.
+    :param validate:   Number of values per shape checked against dateutil.
+    """
+
+    max_shapes = 64
+
+    def __init__(self, format: str = None, cache_size: int = 10000, validate: int = 3):
+        self._format = format or DEFAULT_FORMAT
+        self._cache_size = cache_size
+        self._validate = validate
+        self._memo = OrderedDict()
+        self._memo_day = None
+        self._layouts = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fast = 0
+        self.fallback = 0
+
+    def __call__(self, value) -> str:
+        if not isinstance(value, str):
+            # Dates and datetimes of typed columns are formatted as they are
+            if isinstance(value, date):
+                return value.strftime(self._format)
+            return self._from_number(value)
+
+        # Values parsed by dateutil expire with the current date
+        if self._memo_day and self._memo_day != date.today():
+            self.clear()
+
+        try:
+            result = self._memo[value]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            try:
+                self._memo.move_to_end(value)
+            except KeyError:
+                pass
+            return result
+
+        self.misses += 1
+        if _is_number(value):
+            return self._from_number(value)
+
+        result = datetime.strftime(self._parse(value), self._format)
+
+        self._memo[value] = result
+        if len(self._memo) > self._cache_size:
+            try:
+                self._memo.popitem(last=False)
+            except KeyError:
+                pass
+
+        return result
+
+    @property
+    def stats(self) -> dict:
+        """Memo and parser statistics of the converted values."""
+
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "fast": self.fast,
+            "fallback": self.fallback,
+        }
+
+    def clear(self):
+        """Clears the memo."""
+
+        self._memo.clear()
+        self._memo_day = None
+
+    def _from_number(self, value) -> str:
+        """
+        Converts a Unix timestamp in seconds or milliseconds.
+
+        Values that are not numbers are parsed with dateutil.
+
+        :param value: The value to convert.
+        """
+
+        if _is_number(value):
+            if len(str(int(value))) == 13:
+                value = value / 1000
+            date_object = datetime.fromtimestamp(value)
+        else:
+            date_object = self._dateutil(value)
+
+        return str(datetime.strftime(date_object, self._format))
+
+    def _dateutil(self, value) -> datetime:
+        """
+        Parses a value with dateutil.
+
+        :param value: The value to parse.
+        """
+
+        from dateutil import parser
+
+        # dateutil completes partial timestamps with the current date
+        if not self._memo_day:
+            self._memo_day = date.today()
+
+        self.fallback += 1
+        return parser.parse(value)
+
+    def _parse(self, value: str) -> datetime:
+        """
+        Parses a string with the layout of its shape, falling back to dateutil.
+
+        :param value: The string to parse.
+        """
+
+        shape = value.translate(SHAPE)
+        layout = self._layouts.get(shape)
+
+        if layout is None:
+            if len(self._layouts) >= self.max_shapes:
+                return self._dateutil(value)
+            return self._infer(shape, value, self._validate)
+
+        parse, remaining = layout
+        if not parse:
+            if remaining:
+                return self._infer(shape, value, remaining)
+            return self._dateutil(value)
+
+        try:
+            date_object = parse(value)
+        except ValueError:
+            return self._dateutil(value)
+
+        if remaining:
+            expected = self._dateutil(value)
+            with self._lock:
+                if _same(date_object, expected):
+                    self._layouts[shape] = (parse, remaining - 1)
+                else:
+                    self._layouts[shape] = (None, 0)
+            return expected
+
+        self.fast += 1
+        return date_object
+
+    def _infer(self, shape: str, value: str, attempts: int) -> datetime:
+        """
+        Finds the layout of a shape that gives the same datetime as dateutil.
+
+        :param    shape: The shape of the value.
+        :param    value: The string to parse.
+        :param attempts: Number of values left to find the layout with.
+        """
+
+        expected = self._dateutil(value)
+
+        parse = None
+        for candidate in _parsers():
+            try:
+                if _same(candidate(value), expected):
+                    parse = candidate
+                    break
+            except ValueError:
+                continue
+
+        with self._lock:
+            if parse:
+                self._layouts[shape] = (parse, self._validate - 1)
+            else:
+                self._layouts[shape] = (None, attempts - 1)
+
+        return expected
+
+
+def _is_number(value) -> bool:
+    """
+    Returns true if a value converts to a number, with the same errors as
+    the numeric checks of the Formatter.
+
+    :param value: The value to check.
+    """
+
+    try:
+        number = float(value)
+    except ValueError:
+        return False
+
+    if not math.isnan(number):
+        int(number)
+
+    return True
+
+
+def _parsers():
+    """Yields the candidate parse functions, fromisoformat first."""
+
+    yield _tz(datetime.fromisoformat)
+    for layout in LAYOUTS:
+        yield _tz(lambda value, layout=layout: datetime.strptime(value, layout))
+
+
+def _tz(parse):
+    """
+    Wraps a parse function to give timezones in the same form as dateutil.
+
+    :param parse: Function parsing a string to a datetime.
+    """
+
+    def wrapper(value: str) -> datetime:
+        date_object = parse(value)
+        if date_object.tzinfo is None:
+            return date_object
+
+        from dateutil import tz
+
+        offset = date_object.utcoffset()
+        if not offset:
+            return date_object.replace(tzinfo=tz.UTC)
+        return date_object.replace(tzinfo=tz.tzoffset(None, offset.total_seconds()))
+
+    return wrapper
+
+
+def _same(a: datetime, b: datetime) -> bool:
+    """
+    Returns true if two datetimes format to the same string with any format.
+
+    :param a: The first datetime.
+    :param b: The second datetime.
+    """
+
+    return a.replace(tzinfo=None) == b.replace(tzinfo=None) and \
+        a.utcoffset() == b.utcoffset() and a.tzname() == b.tzname()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+sys.path.insert(0, os.path.join(ROOT, "cloud_function"))
+sys.path.insert(0, os.path.join(ROOT, "benchmark"))
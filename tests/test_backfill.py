@@ -0,0 +1,131 @@
+import json
+
+import pytest
+
+import backfill
+import clients
+from fakes import FakeBlob, FakePublisherClient, FakeStorageClient
+from snapshot import LocalStore, SnapshotState
+
+CONFIG = """
+topic: {{id: topic, project_id: project, subject: data, batch_size: 100}}
+state: {{type: local, directory: {directory}, kind: Kind, property: id, deletions: {deletions}}}
+format:
+  id: {{name: id}}
+  name: {{name: name, conversion: {{type: lowercase}}}}
+  created: {{name: created, conversion: {{type: datetime}}}}
+"""
+
+
+def csv(rows: list) -> bytes:
+    return ("id,name,created\n" + "".join(f"{id},{name},{created}\n" for id, name, created in rows)).encode()
+
+
+ROWS = [(f"R{i}", f"Name {i}", "2021-01-01") for i in range(10)]
+
+
+@pytest.fixture
+def publisher(monkeypatch) -> FakePublisherClient:
+    publisher = FakePublisherClient()
+    monkeypatch.setattr(clients, "publisher_client", lambda *args, **kwargs: publisher)
+    return publisher
+
+
+@pytest.fixture
+def run(tmp_path):
+    """Backfills files with the rows given, returning the metrics."""
+
+    def run(*files, deletions: bool = False, dry_run: bool = False):
+        config = tmp_path / "config.yaml"
+        config.write_text(CONFIG.format(directory=tmp_path / "state", deletions=str(deletions).lower()))
+        sources = []
+        for i, rows in enumerate(files):
+            path = tmp_path / f"{i:02d}.csv"
+            path.write_bytes(csv(rows))
+            sources.append((None, str(path)))
+        return backfill.backfill(str(config), sources, 2, dry_run)
+
+    return run
+
+
+def messages(publisher: FakePublisherClient) -> list:
+    """Records and action of every published message."""
+
+    return sorted(
+        (record["id"], attributes.get("action", ""))
+        for _, data, attributes in publisher.messages for record in json.loads(data)["data"]
+    )
+
+
+def stored(tmp_path) -> set:
+    """Keys of the records in the state."""
+    state = SnapshotState(LocalStore(str(tmp_path / "state")))
+    return {record["id"] for record in state.removed(set(), "Kind", "id")}
+
+
+def test_get_sources_order(tmp_path, monkeypatch):
+    for name in ("b.csv", "a.csv", "c.csv"):
+        (tmp_path / name).write_text("id\n")
+    (tmp_path / "directory").mkdir()
+    storage = FakeStorageClient({
+        ("bucket", "source/2.csv"): FakeBlob(b""),
+        ("bucket", "source/1.csv"): FakeBlob(b""),
+        ("bucket", "source/"): FakeBlob(b""),
+        ("bucket", "other/0.csv"): FakeBlob(b""),
+    })
+    monkeypatch.setattr(clients, "storage_client", lambda: storage)
+
+    sources = backfill.get_sources(["gs://bucket/source/", str(tmp_path), "gs://bucket/other/0.csv"])
+
+    assert sources == [
+        ("bucket", "source/1.csv"),
+        ("bucket", "source/2.csv"),
+        (None, str(tmp_path / "a.csv")),
+        (None, str(tmp_path / "b.csv")),
+        (None, str(tmp_path / "c.csv")),
+        ("bucket", "other/0.csv"),
+    ]
+
+
+def test_backfill_applies_files_in_order(tmp_path, publisher, run):
+    changed = ROWS[:5] + [("R5", "Other", "2021-01-01")] + ROWS[6:] + [("R10", "Name 10", "2021-01-01")]
+
+    metrics = run(ROWS, changed, ROWS[:3])
+
+    assert metrics.counts["files"] == 3
+    assert metrics.counts["records_published"] == 10 + 2
+    assert messages(publisher) == sorted([(f"R{i}", "") for i in range(11)] + [("R5", "")])
+    assert stored(tmp_path) == {f"R{i}" for i in range(11)}
+
+
+def test_backfill_dry_run(tmp_path, publisher, run):
+    metrics = run(ROWS, ROWS[:5], dry_run=True)
+
+    assert metrics.counts["records_new"] == 15
+    assert publisher.messages == []
+    assert stored(tmp_path) == set()
+
+
+def test_backfill_publishes_deletions(tmp_path, publisher, run):
+    metrics = run(ROWS, ROWS[:8], deletions=True)
+
+    assert metrics.counts["records_deleted"] == 2
+    assert messages(publisher) == sorted([(f"R{i}", "") for i in range(10)] + [("R8", "delete"), ("R9", "delete")])
+    assert stored(tmp_path) == {f"R{i}" for i in range(8)}
+
+
+def test_backfill_dry_run_counts_deletions(tmp_path, publisher, run):
+    run(ROWS)
+
+    metrics = run(ROWS[:8], deletions=True, dry_run=True)
+
+    assert metrics.counts["records_removed"] == 2
+    assert stored(tmp_path) == {f"R{i}" for i in range(10)}
+
+
+def test_backfill_no_deletions_when_records_dropped(tmp_path, publisher, run):
+    metrics = run(ROWS, ROWS[:8] + [("R8", "Name 8", "not a date")], deletions=True)
+
+    assert metrics.counts["records_dropped"] == 1
+    assert "records_deleted" not in metrics.counts
+    assert stored(tmp_path) == {f"R{i}" for i in range(10)}
@@ -0,0 +1,241 @@
+import pytest
+import retry.api
+from google.api_core import exceptions
+
+from cache import DigestCache
+from datastore import GoogleCloudDatastore
+from fakes import FakeDatastoreClient
+
+RECORDS = [{"id": f"R{i:03d}", "name": f"Name {i}"} for i in range(100)]
+
+
+class LookupClient(FakeDatastoreClient):
+    """Fake Datastore client that records the keys looked up and the queries run."""
+
+    def __init__(self):
+        super().__init__()
+        self.looked_up = []
+        self.queries = []
+
+    def get_multi(self, keys: list, missing: list = None) -> list:
+        self.looked_up.extend(key.id_or_name for key in keys)
+        return super().get_multi(keys, missing)
+
+    def run_query(self, kind: str, filters: list, keys_only: bool, limit: int = None, projection: list = ()):
+        self.queries.append((kind, keys_only, tuple(projection)))
+        return super().run_query(kind, filters, keys_only, limit, projection)
+
+
+def stored(mode: str = "full", records: list = RECORDS, **kwargs):
+    """Datastore state holding records, with a new client recording its requests."""
+
+    client = LookupClient()
+    GoogleCloudDatastore(mode, client=client).put_multi(records, "Kind", "id")
+    client.looked_up.clear()
+    client.queries.clear()
+
+    return GoogleCloudDatastore(mode, chunk_size=10, client=client, **kwargs), client
+
+
+def changed(records: list, *keys) -> list:
+    return [dict(record, name=record["name"].upper()) if record["id"] in keys else record for record in records]
+
+
+def test_count():
+    state, _ = stored()
+
+    assert state._count("Kind") == 100
+    assert state._count("Other") is None
+
+
+def test_lookup_below_threshold():
+    state, client = stored(scan_threshold=0.5)
+    data = changed(RECORDS[:40], "R001")
+
+    diff = state.diff(data, "Kind", "id")
+
+    assert diff.changed == {"R001"}
+    assert sorted(client.looked_up) == [record["id"] for record in data]
+    assert ("Kind", True, ()) not in client.queries
+
+
+def test_scan_looks_up_stored_records_only():
+    state, client = stored(scan_threshold=0.5)
+    data = changed(RECORDS[40:], "R050") + [{"id": "R100", "name": "Name 100"}]
+
+    diff = state.diff(data, "Kind", "id")
+
+    assert diff.added == {"R100"}
+    assert diff.changed == {"R050"}
+    assert client.queries.count(("Kind", True, ())) == 1
+    assert sorted(client.looked_up) == [record["id"] for record in RECORDS[40:]]
+
+
+def test_scan_digests_without_lookups():
+    state, client = stored("digest", scan_threshold=0.5)
+    data = changed(RECORDS[40:], "R050") + [{"id": "R100", "name": "Name 100"}]
+
+    diff = state.diff(data, "Kind", "id")
+
+    assert diff.added == {"R100"}
+    assert diff.changed == {"R050"}
+    assert ("Kind", False, ("_digest",)) in client.queries
+    assert client.looked_up == []
+
+
+def test_scan_digests_looks_up_full_records():
+    state, client = stored("digest", scan_threshold=0.5)
+    GoogleCloudDatastore("full", client=client).put_multi(RECORDS[90:], "Kind", "id")
+    client.looked_up.clear()
+
+    diff = state.diff(changed(RECORDS[40:], "R095"), "Kind", "id")
+
+    assert diff.changed == {"R095"}
+    assert sorted(client.looked_up) == [record["id"] for record in RECORDS[90:]]
+
+
+@pytest.mark.parametrize("mode", ["full", "digest"])
+def test_scan_updated_by_writes(mode):
+    state, client = stored(mode, scan_threshold=0.5)
+    data = changed(RECORDS[40:], "R050") + [{"id": "R100", "name": "Name 100"}]
+    diff = state.diff(data, "Kind", "id")
+
+    state.put_multi(diff.records, "Kind", "id")
+    state.delete_multi(RECORDS[:10], "Kind", "id")
+
+    assert state.diff(data, "Kind", "id").records == []
+    assert {record["id"] for record in state.removed({record["id"] for record in data}, "Kind", "id")} == {
+        record["id"] for record in RECORDS[10:40]
+    }
+    assert client.queries.count(("Kind", True, ())) == 1
+
+
+@pytest.mark.parametrize("scan_threshold", [0, 0.5])
+def test_removed_full_records(scan_threshold):
+    state, client = stored(scan_threshold=scan_threshold)
+    state.diff(RECORDS[40:], "Kind", "id")
+
+    removed = state.removed({record["id"] for record in RECORDS[40:]}, "Kind", "id")
+
+    assert sorted(removed, key=lambda record: record["id"]) == RECORDS[:40]
+
+
+@pytest.mark.parametrize("scan_threshold", [0, 0.5])
+def test_removed_digests(scan_threshold):
+    state, client = stored("digest", scan_threshold=scan_threshold)
+    state.diff(RECORDS[40:], "Kind", "id")
+    client.looked_up.clear()
+
+    removed = state.removed({record["id"] for record in RECORDS[40:]}, "Kind", "id")
+
+    assert sorted(removed, key=lambda record: record["id"]) == [{"id": record["id"]} for record in RECORDS[:40]]
+    assert client.looked_up == ([] if scan_threshold else [record["id"] for record in RECORDS[:40]])
+
+
+class TransactionClient(FakeDatastoreClient):
+    """Fake Datastore client that counts transactions."""
+
+    def __init__(self):
+        super().__init__()
+        self.transactions = 0
+
+    def transaction(self):
+        self.transactions += 1
+        return super().transaction()
+
+
+class FlakyClient(FakeDatastoreClient):
+    """Fake Datastore client that fails the first request of every get and put."""
+
+    def __init__(self):
+        super().__init__()
+        self.failures = 0
+
+    def _fail_once(self):
+        self.failures += 1
+        if self.failures % 2:
+            raise exceptions.ServiceUnavailable("unavailable")
+
+    def get(self, key):
+        self._fail_once()
+        return super().get(key)
+
+    def put(self, entity):
+        self._fail_once()
+        return super().put(entity)
+
+
+def test_version_written_once_on_flush():
+    client = TransactionClient()
+    state = GoogleCloudDatastore(chunk_size=10, client=client)
+
+    state.put_multi(RECORDS[:50], "Kind", "id")
+    state.put_multi(RECORDS[50:], "Kind", "id")
+    state.delete_multi(RECORDS[:10], "Kind", "id")
+    state.put_multi(RECORDS[:10], "Other", "id")
+    assert client.transactions == 0
+
+    state.flush()
+    assert client.transactions == 2
+    assert client.key(GoogleCloudDatastore.metadata_kind, "Kind/version") in client.entities
+    assert client.key(GoogleCloudDatastore.metadata_kind, "Other/version") in client.entities
+
+    state.flush()
+    assert client.transactions == 2
+
+
+def test_metadata_retried(monkeypatch):
+    monkeypatch.setattr(retry.api.time, "sleep", lambda seconds: None)
+    state = GoogleCloudDatastore(client=FlakyClient())
+
+    state.put_metadata("Kind", "fingerprint", {"md5": "abc"})
+
+    assert state.get_metadata("Kind", "fingerprint") == {"md5": "abc"}
+
+
+def test_cache_invalidated_by_other_instance():
+    client = FakeDatastoreClient()
+    cache = DigestCache()
+
+    state = GoogleCloudDatastore(client=client, cache=cache)
+    state.put_multi(state.diff(RECORDS, "Kind", "id").records, "Kind", "id")
+    state.flush()
+
+    # The next invocation of the same instance skips the lookups
+    requests = client.requests
+    assert GoogleCloudDatastore(client=client, cache=cache).diff(RECORDS, "Kind", "id").records == []
+    assert cache.hits == len(RECORDS)
+    assert client.requests == requests + 1
+
+    # Another instance, without a cache, changes a record
+    other = GoogleCloudDatastore(client=client)
+    other.put_multi(changed(RECORDS, "R003"), "Kind", "id")
+    other.flush()
+
+    assert GoogleCloudDatastore(client=client, cache=cache).diff(RECORDS, "Kind", "id").changed == {"R003"}
+
+
+def test_cache_invalidated_without_version_marker():
+    client = FakeDatastoreClient()
+    cache = DigestCache()
+
+    state = GoogleCloudDatastore(client=client, cache=cache)
+    state.put_multi(RECORDS, "Kind", "id")
+    state.flush()
+    del client.entities[client.key(GoogleCloudDatastore.metadata_kind, "Kind/version")]
+    client.entities[client.key("Kind", "R003")]["name"] = "Other"
+
+    assert GoogleCloudDatastore(client=client, cache=cache).diff(RECORDS, "Kind", "id").changed == {"R003"}
+
+
+def test_cache_kept_after_own_flush():
+    client = FakeDatastoreClient()
+    cache = DigestCache()
+
+    state = GoogleCloudDatastore(client=client, cache=cache)
+    state.diff(RECORDS, "Kind", "id")
+    state.put_multi(RECORDS, "Kind", "id")
+    state.flush()
+
+    assert GoogleCloudDatastore(client=client, cache=cache).diff(RECORDS, "Kind", "id").records == []
+    assert cache.hits == len(RECORDS)
@@ -0,0 +1,126 @@
+import io
+import json
+from datetime import datetime
+
+import pandas as pd
+import pytest
+from dateutil import parser
+
+from event_formatter import Formatter
+from timestamps import DEFAULT_FORMAT, TimestampConverter
+
+TEMPLATE = {
+    "name": {"name": "name", "conversion": {"type": "lowercase"}},
+    "code": {"name": "code", "conversion": {"type": "uppercase"}},
+    "city": {"name": "city", "conversion": {"type": "capitalize"}},
+    "id": [
+        {"name": "id", "conversion": {"type": "numeric"}},
+        {"name": "reference", "conversion": {"type": "prefix_value", "format": "ref-"}},
+    ],
+    "amount": {"name": "amount", "conversion": {"type": "numeric"}},
+    "email": {"name": "email", "conversion": {"type": "hash"}},
+    "created": {"name": "created", "conversion": {"type": "datetime"}},
+    "day": {"name": "day", "conversion": {"type": "datetime", "format": "%d-%m-%Y"}},
+    "longitude": {"name": "geometry", "conversion": {"type": "geojson", "format": "longitude"}},
+    "latitude": {"name": "geometry", "conversion": {"type": "geojson", "format": "latitude"}},
+    "street": {"name": "street"},
+}
+
+CSV = """name,code,city,id,amount,email,created,day,longitude,latitude,street
+Alice,ab1,amsterdam,1,1.25,alice@example.com,2021-01-02 12:30:00,2021-01-02,4.1,52.3,Main Street
+BOB,cd2,haarlem,2,2,bob@example.com,2021-01-03T08:00:00,01/04/2021,4.2,52.4,
+Carol,gh4,utrecht,3,,carol@example.com,2021-02-03 12:30:00,2021-03-04,5.1,52.1,Side Street
+Dave,ef3,rotterdam,4,4.5,dave@example.com,2021-04-05 00:00:00,2021-04-05,4.5,51.9,Dock
+"""
+
+
+def baseline(formatter: Formatter, df: pd.DataFrame) -> list:
+    """Formats the rows of a DataFrame one by one."""
+    return formatter.format(df.to_dict(orient="records"))
+
+
+def dump(records: list) -> str:
+    """Serializes records, so missing values compare equal."""
+    return json.dumps(records)
+
+
+def test_format_frame_equals_per_record():
+    df = pd.read_csv(io.StringIO(CSV))
+    formatter = Formatter(TEMPLATE)
+
+    assert dump(formatter.format_frame(df)) == dump(baseline(formatter, df))
+
+
+def test_format_frame_of_strings_equals_per_record():
+    # Columns of strings, like an xlsx file, of which every value converts
+    df = pd.read_csv(io.StringIO(CSV), dtype=str).dropna().reset_index(drop=True)
+    formatter = Formatter(TEMPLATE)
+
+    assert formatter.format_frame(df) == baseline(formatter, df)
+
+
+def test_format_frame_drops_records_like_per_record():
+    template = {"id": {"name": "id", "conversion": {"type": "numeric"}},
+                "created": {"name": "created", "conversion": {"type": "datetime"}}}
+    df = pd.DataFrame({"id": ["1", "x", "3"], "created": ["2021-01-01", "not a date", "2021-01-03"]})
+    formatter = Formatter(template)
+
+    formatted = formatter.format_frame(df)
+    assert len(formatted) == 2
+    assert formatted == baseline(formatter, df)
+
+
+def test_format_frame_with_subfields():
+    template = dict(TEMPLATE, address={"subfields": {"street": {"name": "street"}, "city": {"name": "town"}}})
+    df = pd.read_csv(io.StringIO(CSV))
+    df["address"] = [{"street": street, "city": city} for street, city in zip(df["street"], df["city"])]
+    formatter = Formatter(template)
+
+    assert dump(formatter.format_frame(df)) == dump(baseline(formatter, df))
+
+
+@pytest.mark.parametrize("layout", [
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%dT%H:%M:%SZ",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d",
+    "%m/%d/%Y %H:%M",
+    "%d %b %Y %H:%M",
+])
+def test_timestamps_equal_dateutil(layout):
+    values = [datetime(2021, month, day, day % 24, month * 4).strftime(layout)
+              for month in range(1, 13) for day in (1, 12, 13, 28)]
+    converter = TimestampConverter()
+
+    assert [converter(value) for value in values] == [
+        parser.parse(value).strftime(DEFAULT_FORMAT) for value in values
+    ]
+
+
+def test_timestamp_memo_shared_by_fields():
+    template = {
+        "created": {"name": "created", "conversion": {"type": "datetime"}},
+        "updated": {"name": "updated", "conversion": {"type": "datetime"}},
+        "day": {"name": "day", "conversion": {"type": "datetime", "format": "%Y-%m-%d"}},
+        "name": {"name": "name", "conversion": {"type": "lowercase"}},
+    }
+    formatter = Formatter(template)
+    value = "2021-01-02 12:30:00"
+
+    formatted = formatter.format([{"created": value, "updated": value, "day": value, "name": "A"}] * 3)
+
+    assert formatted == [{"created": "2021-01-02T12:30:00Z", "updated": "2021-01-02T12:30:00Z",
+                          "day": "2021-01-02", "name": "a"}] * 3
+    stats = formatter.timestamp_stats()
+    assert stats["misses"] == 2
+    assert stats["hits"] == 7
+
+
+def test_format_in_processes():
+    df = pd.concat([pd.read_csv(io.StringIO(CSV))] * 50, ignore_index=True)
+    records = df.to_dict(orient="records")
+    formatter = Formatter(TEMPLATE, workers=2, threshold=10, chunk_size=40)
+
+    assert dump(formatter.format(records)) == dump(Formatter(TEMPLATE).format(records))
+    assert dump(formatter.format(iter(records))) == dump(Formatter(TEMPLATE).format(records))
+    assert dump(formatter.format_frame(df)) == dump(baseline(Formatter(TEMPLATE), df))
@@ -0,0 +1,201 @@
+import base64
+import importlib
+import json
+import logging
+import random
+
+import pytest
+
+import clients
+from fakes import FakeBlob, FakePublisherClient, FakeStorageClient
+
+CONFIG = """
+topic: {{id: topic, project_id: project, subject: data, batch_size: 100}}
+state: {{type: local, directory: {directory}, kind: Kind, property: id, fingerprint: true{state}}}
+format:
+  id: {{name: id}}
+  name: {{name: name, conversion: {{type: {conversion}}}}}
+"""
+
+CSV = b"id,name\n" + b"".join(f"R{i},Name {i}\n".encode() for i in range(250))
+
+EVENT = {"bucket": "bucket", "name": "records.csv"}
+
+
+class Cloud:
+    """Fake storage and Pub/Sub clients of the handler."""
+
+    def __init__(self):
+        self.blob = FakeBlob(CSV, crc32c="AAAAAA==")
+        self.storage = FakeStorageClient({("bucket", "records.csv"): self.blob})
+        self.publisher = FakePublisherClient()
+
+    def published(self) -> list:
+        records = [record for _, data, _ in self.publisher.messages for record in json.loads(data)["data"]]
+        return sorted(records, key=lambda record: int(record["id"][1:]))
+
+
+@pytest.fixture
+def cloud(monkeypatch) -> Cloud:
+    cloud = Cloud()
+    monkeypatch.setattr(clients, "storage_client", lambda: cloud.storage)
+    monkeypatch.setattr(clients, "publisher_client", lambda *args, **kwargs: cloud.publisher)
+    return cloud
+
+
+@pytest.fixture
+def load(tmp_path, monkeypatch):
+    """Imports main with a configuration, returning the module."""
+
+    monkeypatch.chdir(tmp_path)
+
+    def load(conversion: str = "lowercase", extra: str = "", state: str = ""):
+        config = CONFIG.format(directory=tmp_path / "state", conversion=conversion, state=state) + extra
+        (tmp_path / "config.yaml").write_text(config)
+        import main
+
+        return importlib.reload(main)
+
+    return load
+
+
+def test_unchanged_file_not_downloaded(cloud, load):
+    main = load()
+
+    assert main.handler(EVENT, None) == ("OK", 204)
+    assert len(cloud.published()) == 250
+    requests = cloud.blob.requests
+
+    assert main.handler(EVENT, None) == ("OK", 204)
+    assert cloud.blob.requests == requests
+    assert len(cloud.published()) == 250
+
+
+def test_changed_configuration_reprocesses(cloud, load):
+    load().handler(EVENT, None)
+    requests = cloud.blob.requests
+
+    load("uppercase").handler(EVENT, None)
+
+    assert cloud.blob.requests > requests
+    names = [record["name"] for record in cloud.published()]
+    assert len(names) == 500
+    assert {f"NAME {i}" for i in range(250)} <= set(names)
+
+
+def test_changed_file_reprocesses(cloud, load):
+    main = load()
+    main.handler(EVENT, None)
+
+    cloud.blob.data += b"R250,Name 250\n"
+    cloud.blob.size = len(cloud.blob.data)
+    cloud.blob.crc32c = "AAAAAQ=="
+    main.handler(EVENT, None)
+
+    assert cloud.published()[250:] == [{"id": "R250", "name": "name 250"}]
+
+
+def test_fingerprint_stored_after_publishing(cloud, load):
+    main = load()
+    cloud.publisher.fail_rate = 1.0
+
+    assert main.handler(EVENT, None) == ("Bad Request", 400)
+
+    cloud.publisher.fail_rate = 0.0
+    main.handler(EVENT, None)
+
+    assert len(cloud.published()) == 250
+
+
+def rewrite(blob: FakeBlob, data: bytes):
+    """Replaces the content of a blob, changing its checksum."""
+    blob.data = data
+    blob.size = len(data)
+    blob.crc32c = base64.b64encode(len(data).to_bytes(4, "big")).decode()
+
+
+def deleted(cloud: Cloud) -> list:
+    """Keys of the records published as deleted."""
+    return sorted(record["id"] for _, data, attributes in cloud.publisher.messages
+                  if attributes.get("action") == "delete" for record in json.loads(data)["data"])
+
+
+def test_deletions_published(cloud, load):
+    main = load(state=", deletions: true")
+    main.handler(EVENT, None)
+
+    rewrite(cloud.blob, CSV[:CSV.index(b"R200,")])
+    main.handler(EVENT, None)
+
+    assert deleted(cloud) == sorted(f"R{i}" for i in range(200, 250))
+
+
+def test_deletions_skipped_without_records(cloud, load, caplog):
+    main = load(state=", deletions: true")
+    main.handler(EVENT, None)
+
+    rewrite(cloud.blob, b"id,name\n")
+    main.handler(EVENT, None)
+
+    assert deleted(cloud) == []
+    assert "Not publishing deletions" in caplog.text
+
+
+def test_deletions_skipped_when_records_dropped(cloud, load, caplog):
+    main = load(state=", deletions: true", extra="  created: {name: created, conversion: {type: datetime}}\n")
+    rows = [f"R{i},Name {i},2021-01-01\n" for i in range(250)]
+    rewrite(cloud.blob, "".join(["id,name,created\n"] + rows).encode())
+    main.handler(EVENT, None)
+
+    rewrite(cloud.blob, "".join(["id,name,created\n"] + rows[:200] + ["R200,Name 200,not a date\n"]).encode())
+    main.handler(EVENT, None)
+
+    assert deleted(cloud) == []
+    assert "Not publishing deletions" in caplog.text
+
+
+def entries(caplog) -> list:
+    """Metrics entries logged by the handler."""
+    return [json.loads(record.getMessage())["metrics"] for record in caplog.records
+            if record.getMessage().startswith('{"metrics"')]
+
+
+def test_metrics_logged_once(cloud, load, caplog):
+    main = load()
+
+    with caplog.at_level(logging.INFO):
+        main.handler(EVENT, None)
+
+    [entry] = entries(caplog)
+    assert entry["file"] == "records.csv"
+    assert entry["status"] == 204
+    assert entry["counts"]["records_in"] == 250
+    assert entry["counts"]["records_published"] == 250
+    assert entry["counts"]["messages"] == 3
+    assert all(entry["durations"][stage] > 0 for stage in ("parse", "format", "state_diff", "publish"))
+    assert "profile" not in entry
+
+
+def test_metrics_logged_on_failure(cloud, load, caplog):
+    main = load()
+    cloud.publisher.fail_rate = 1.0
+
+    with caplog.at_level(logging.INFO):
+        main.handler(EVENT, None)
+
+    [entry] = entries(caplog)
+    assert entry["status"] == 400
+    assert entry["counts"]["batches_failed"] == 3
+
+
+def test_profile_sampled(cloud, load, caplog):
+    main = load(extra="profiling: {enabled: true, sample_rate: 0.5, memory: true, top: 3}\n")
+    random.seed(0)
+
+    with caplog.at_level(logging.INFO):
+        for _ in range(20):
+            main.handler(EVENT, None)
+
+    profiles = [entry["profile"] for entry in entries(caplog) if "profile" in entry]
+    assert 0 < len(profiles) < 20
+    assert all(len(profile["cpu"]) == 3 and len(profile["memory"]["top"]) == 3 for profile in profiles)
@@ -0,0 +1,61 @@
+import io
+import json
+import logging
+import time
+
+from metrics import STAGES, MeteredReader, Metrics, Profiler
+
+
+def test_nested_stages_exclude_inner_time():
+    metrics = Metrics()
+
+    with metrics.stage("publish"):
+        time.sleep(0.02)
+        with metrics.stage("state_write"):
+            time.sleep(0.05)
+
+    assert 0.02 <= metrics.durations["publish"] < 0.05
+    assert metrics.durations["state_write"] >= 0.05
+
+
+def test_iterate_counts_items():
+    metrics = Metrics()
+
+    assert list(metrics.iterate("parse", range(5), "records_in")) == list(range(5))
+    assert metrics.counts["records_in"] == 5
+    assert "parse" in metrics.durations
+
+
+def test_metered_reader_counts_bytes():
+    metrics = Metrics()
+    reader = io.BufferedReader(MeteredReader(io.BytesIO(b"x" * 1000), metrics, "download", "bytes_downloaded"), 64)
+
+    assert reader.read() == b"x" * 1000
+    assert metrics.counts["bytes_downloaded"] == 1000
+
+
+def test_log_single_json_entry(caplog):
+    metrics = Metrics()
+    metrics.add("records_in", 3)
+    with metrics.stage("custom"):
+        pass
+
+    with caplog.at_level(logging.INFO):
+        metrics.log(file="records.csv", status=204)
+
+    assert len(caplog.records) == 1
+    entry = json.loads(caplog.records[0].getMessage())["metrics"]
+    assert set(STAGES) | {"custom", "total"} == set(entry["durations"])
+    assert entry["counts"] == {"records_in": 3}
+    assert entry["file"] == "records.csv"
+    assert entry["status"] == 204
+
+
+def test_profiler():
+    with Profiler(cpu=True, memory=True, top=5) as profiler:
+        data = [str(i) * 10 for i in range(10000)]
+
+    assert data
+    assert 0 < len(profiler.result["cpu"]) <= 5
+    assert profiler.result["memory"]["peak_bytes"] > 0
+    assert len(profiler.result["memory"]["top"]) <= 5
@@ -0,0 +1,183 @@
+import io
+import json
+
+import pytest
+
+import pipeline
+from configuration import Configuration
+from datastore import GoogleCloudDatastore
+from event_formatter import Formatter
+from fakes import FakeDatastoreClient, FakePublisherClient
+from metrics import Metrics
+from publisher import PublishError, Publisher
+from snapshot import LocalStore, SnapshotState
+from storage import File
+
+CONFIG = """
+topic: {{id: topic, project_id: project, subject: data, batch_size: 50{topic}}}
+state: {{type: datastore, kind: Kind, property: id, deletions: true}}
+format:
+  id: {{name: id}}
+  name: {{name: name, conversion: {{type: lowercase}}}}
+  amount: {{name: amount}}
+"""
+
+RECORDS = [{"id": f"R{i:04d}", "name": f"name {i}", "amount": i * 1.25} for i in range(1000)]
+
+
+class Metadata:
+    """Gobits metadata of the messages."""
+
+    def to_json(self) -> dict:
+        return {"test": True}
+
+
+@pytest.fixture
+def config(tmp_path):
+    """Loads the configuration with extra topic options."""
+
+    def config(topic: str = "") -> Configuration:
+        path = tmp_path / "config.yaml"
+        path.write_text(CONFIG.format(topic=topic))
+        return Configuration(str(path))
+
+    return config
+
+
+def published(client: FakePublisherClient) -> list:
+    """Records of the messages published to a fake client."""
+    records = [record for _, data, _ in client.messages for record in json.loads(data)["data"]]
+    return sorted(records, key=lambda record: record["id"])
+
+
+def datastore(records: list) -> GoogleCloudDatastore:
+    state = GoogleCloudDatastore(client=FakeDatastoreClient())
+    state.put_multi(records, "Kind", "id")
+    return state
+
+
+def test_process_removed(config):
+    state = datastore(RECORDS[:200])
+    client = FakePublisherClient()
+    metrics = Metrics()
+
+    deleted = pipeline.process_removed(
+        config(), {record["id"] for record in RECORDS[:150]}, state, Publisher(client=client), Metadata(), metrics
+    )
+
+    assert deleted == 50
+    assert metrics.counts["records_removed"] == 50
+    assert metrics.counts["records_deleted"] == 50
+    assert {attributes["action"] for _, _, attributes in client.messages} == {"delete"}
+    assert published(client) == RECORDS[150:200]
+    assert state.removed({record["id"] for record in RECORDS[:150]}, "Kind", "id") == []
+
+
+def test_process_removed_delete_action(config):
+    client = FakePublisherClient()
+
+    pipeline.process_removed(
+        config(", delete_action: removed"), set(), datastore(RECORDS[:10]), Publisher(client=client), Metadata(),
+        Metrics(),
+    )
+
+    assert {attributes["action"] for _, _, attributes in client.messages} == {"removed"}
+
+
+def test_process_removed_nothing_removed(config):
+    client = FakePublisherClient()
+
+    deleted = pipeline.process_removed(
+        config(), {record["id"] for record in RECORDS}, datastore(RECORDS[:200]), Publisher(client=client), Metadata(),
+        Metrics(),
+    )
+
+    assert deleted == 0
+    assert client.messages == []
+
+
+def test_process_removed_keeps_failed(config):
+    state = datastore(RECORDS[:200])
+    metrics = Metrics()
+
+    with pytest.raises(PublishError):
+        pipeline.process_removed(
+            config(), set(), state, Publisher(client=FakePublisherClient(fail_rate=1.0)), Metadata(), metrics
+        )
+
+    assert metrics.counts["records_deleted"] == 0
+    assert len(state.removed(set(), "Kind", "id")) == 200
+
+
+def test_run_stages_keeps_order():
+    functions = [lambda x: x + 1, lambda x: x * 2, lambda x: -x]
+
+    assert pipeline.run_stages(range(100), functions, 2) == [-(x + 1) * 2 for x in range(100)]
+
+
+def test_run_stages_raises():
+    def fail(x):
+        if x == 5:
+            raise ValueError(x)
+        return x
+
+    with pytest.raises(ValueError):
+        pipeline.run_stages(range(100), [lambda x: x, fail, lambda x: x], 2)
+
+
+def run(config: Configuration, data: bytes, state, pipelined: bool):
+    """
+    Processes the chunks of a csv file, sequentially or pipelined.
+
+    :return: Number of published records and the records of the messages.
+    """
+
+    client = FakePublisherClient()
+    publisher = Publisher(client=client)
+    file = File("records.csv", io.BytesIO(data))
+    chunks = file.iter_json(Formatter(config.template), 128)
+
+    if pipelined:
+        count = pipeline.process_chunks(config, chunks, state, publisher, Metadata(), Metrics(), 2)
+    else:
+        count = sum(pipeline.process(config, records, state, publisher, Metadata(), Metrics()) for records in chunks)
+    state.flush()
+
+    return count, published(client)
+
+
+def csv(records: list) -> bytes:
+    return ("id,name,amount\n" + "".join(
+        f"{record['id']},{record['name'].title()},{record['amount']}\n" for record in records
+    )).encode()
+
+
+@pytest.mark.parametrize("backend", ["datastore", "snapshot"])
+def test_pipelined_equals_sequential(config, tmp_path, backend):
+    def state(name: str):
+        if backend == "datastore":
+            return GoogleCloudDatastore(client=clients[name])
+        return SnapshotState(LocalStore(str(tmp_path / name)))
+
+    clients = {"sequential": FakeDatastoreClient(), "pipelined": FakeDatastoreClient()}
+    updated = [dict(record, amount=0.5) if i % 7 == 0 else record for i, record in enumerate(RECORDS)]
+
+    for data in (csv(RECORDS[:600]), csv(updated)):
+        sequential = run(config(), data, state("sequential"), False)
+        pipelined = run(config(), data, state("pipelined"), True)
+        assert sequential == pipelined
+
+    assert sequential[0] == 400 + len(updated[:600:7])
+    assert run(config(), csv(updated), state("pipelined"), True) == (0, [])
+
+
+def test_pipelined_stores_published_only(config):
+    client = FakeDatastoreClient()
+    state = GoogleCloudDatastore(client=client)
+    publisher = Publisher(client=FakePublisherClient(fail_rate=1.0))
+    chunks = [RECORDS[i:i + 100] for i in range(0, 300, 100)]
+
+    with pytest.raises(PublishError):
+        pipeline.process_chunks(config(), chunks, state, publisher, Metadata(), Metrics(), 2)
+
+    assert not [key for key in client.entities if key.kind == "Kind"]
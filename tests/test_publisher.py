@@ -0,0 +1,80 @@
+import gzip
+import json
+
+import brotli
+import pytest
+
+from fakes import FakePublisherClient
+from publisher import Publisher
+
+RECORDS = [{"id": f"R{i:04d}", "name": f"name {i}", "amount": i * 1.25} for i in range(1000)]
+
+
+def published(client: FakePublisherClient) -> list:
+    """Records of the messages published to a fake client."""
+
+    records = []
+    for _, data, attributes in client.messages:
+        if attributes.get("content-encoding") == "gzip":
+            data = gzip.decompress(data)
+        elif attributes.get("content-encoding") == "br":
+            data = brotli.decompress(data)
+        records.extend(json.loads(data)["data"])
+
+    return sorted(records, key=lambda record: record["id"])
+
+
+def test_publish_with_flow_control():
+    client = FakePublisherClient(latency=0.001, message_limit=2)
+
+    report = Publisher(client=client).publish("project", "topic", RECORDS, {}, 30)
+
+    assert len(report.batches) == 34
+    assert report.published == RECORDS
+    assert published(client) == RECORDS
+
+
+def test_publish_failures_reported():
+    client = FakePublisherClient(fail_rate=0.5)
+
+    report = Publisher(client=client).publish("project", "topic", RECORDS, {}, 10)
+
+    assert report.failed
+    assert len(report.published) + sum(len(batch.records) for batch in report.failed) == len(RECORDS)
+    assert published(client) == sorted(report.published, key=lambda record: record["id"])
+
+
+def test_publish_packed_by_size():
+    client = FakePublisherClient()
+
+    report = Publisher(client=client).publish("project", "topic", RECORDS, {"test": True}, 100, max_bytes=2000)
+
+    messages = [json.loads(data) for _, data, _ in client.messages]
+    assert report.published == RECORDS
+    assert all(len(data) <= 2000 for _, data, _ in client.messages)
+    assert all(message["gobits"] == [{"test": True}] and len(message["data"]) <= 100 for message in messages)
+    assert published(client) == RECORDS
+
+
+def test_publish_packed_by_count():
+    client = FakePublisherClient()
+
+    Publisher(client=client).publish("project", "topic", RECORDS, {}, 100, max_bytes=1 << 20)
+
+    assert [len(json.loads(data)["data"]) for _, data, _ in client.messages] == [100] * 10
+
+
+@pytest.mark.parametrize("compression", ["gzip", "br"])
+def test_publish_compressed(compression):
+    client = FakePublisherClient()
+
+    report = Publisher(compression=compression, client=client).publish("project", "topic", RECORDS, {}, 100)
+
+    assert all(attributes == {"content-encoding": compression} for _, _, attributes in client.messages)
+    assert published(client) == RECORDS
+    assert report.compression_ratio > 1
+
+
+def test_publish_unknown_compression():
+    with pytest.raises(ValueError):
+        Publisher(compression="zip", client=FakePublisherClient())
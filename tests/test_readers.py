@@ -0,0 +1,110 @@
+import io
+import json
+
+import pytest
+from defusedxml import ElementTree as ET
+
+from event_formatter import Formatter
+from readers import iter_json, iter_lines, iter_xml
+from storage import File
+
+RECORDS = [
+    {"id": i, "name": f"Name é \"{i}\"", "amount": i * 1.25, "tags": ["a", {"b": None}], "valid": i % 2 == 0}
+    for i in range(100)
+]
+
+ATOM = """<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom"
+      xmlns:m="http://schemas.microsoft.com/ado/2007/08/dataservices/metadata"
+      xmlns:d="http://schemas.microsoft.com/ado/2007/08/dataservices">
+  <title>Records</title>
+  {entries}
+</feed>
+"""
+
+ENTRY = """<entry>
+    <id>{i}</id>
+    <content type="application/xml">
+      <m:properties>
+        <d:id>{i}</d:id>
+        <d:name>Name {i}</d:name>
+        <d:empty></d:empty>
+      </m:properties>
+    </content>
+  </entry>"""
+
+TEMPLATE = {"id": {"name": "id"}, "name": {"name": "name", "conversion": {"type": "lowercase"}}}
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 1 << 16])
+def test_iter_json_equals_loads(read_size):
+    data = json.dumps(RECORDS, indent=1).encode()
+
+    assert list(iter_json(io.BytesIO(data), read_size=read_size)) == json.loads(data)
+
+
+@pytest.mark.parametrize("read_size", [3, 1 << 16])
+def test_iter_json_top_level_attribute(read_size):
+    data = json.dumps({"count": 2, "rows": RECORDS, "next": {"rows": []}}).encode()
+
+    assert list(iter_json(io.BytesIO(data), "rows", read_size)) == RECORDS
+
+
+def test_iter_json_single_object():
+    data = json.dumps({"id": 1, "rows": {"nested": True}}).encode()
+
+    assert list(iter_json(io.BytesIO(data), "other")) == [{"id": 1, "rows": {"nested": True}}]
+
+
+def test_iter_lines_equals_loads():
+    data = "".join(json.dumps(record) + "\n" for record in RECORDS).encode()
+
+    assert list(iter_lines(io.BytesIO(data))) == RECORDS
+
+
+def xml_to_json(xml: str) -> list:
+    """Reads the properties of the entries of a whole Atom feed at once."""
+
+    tree = ET.fromstring(xml)
+    namespace = tree.tag[:-4]
+    result = []
+    for entry in tree.findall(f"{namespace}entry"):
+        for properties in entry.find(f"{namespace}content"):
+            if properties.tag.endswith("}properties"):
+                result.append({prop.tag.split("}")[-1]: prop.text for prop in properties if prop.text})
+
+    return result
+
+
+def test_iter_xml_equals_whole_feed():
+    xml = ATOM.format(entries="".join(ENTRY.format(i=i) for i in range(50)))
+
+    records = list(iter_xml(io.BytesIO(xml.encode())))
+
+    assert records == xml_to_json(xml)
+    assert len(records) == 50
+
+
+def assert_chunks_equal_whole_file(name: str, data: str):
+    def read(content):
+        file = File(name, content)
+        file.top_level_attribute = "rows"
+        return file
+
+    formatter = Formatter(TEMPLATE)
+    chunks = list(read(io.BytesIO(data.encode())).iter_json(formatter, 10))
+
+    assert [len(chunk) for chunk in chunks[:-1]] == [10] * (len(chunks) - 1)
+    assert [record for chunk in chunks for record in chunk] == read(data.encode()).to_json(formatter)
+
+
+@pytest.mark.parametrize("name, data", [
+    ("records.csv", "id,name\n" + "".join(f"{i},Name {i}\n" for i in range(95))),
+    ("records.json", json.dumps({"rows": RECORDS})),
+])
+def test_file_chunks_equal_whole_file(name, data):
+    assert_chunks_equal_whole_file(name, data)
+
+
+def test_atom_chunks_equal_whole_file():
+    assert_chunks_equal_whole_file("records.atom", ATOM.format(entries="".join(ENTRY.format(i=i) for i in range(95))))
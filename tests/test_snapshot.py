@@ -0,0 +1,52 @@
+from snapshot import LocalStore, SnapshotState
+
+RECORDS = [{"id": f"R{i}", "name": f"Name {i}"} for i in range(10)]
+
+
+class CountingStore(LocalStore):
+    """LocalStore that counts the snapshots written."""
+
+    def __init__(self, directory: str):
+        super().__init__(directory)
+        self.writes = 0
+
+    def write(self, name: str, data: bytes, generation: int = None) -> int:
+        self.writes += 1
+        return super().write(name, data, generation)
+
+
+def changed(records: list, *keys) -> list:
+    return [dict(record, name=record["name"].upper()) if record["id"] in keys else record for record in records]
+
+
+def test_snapshot_written_once_on_flush(tmp_path):
+    store = CountingStore(str(tmp_path))
+    state = SnapshotState(store)
+
+    assert state.diff(RECORDS, "Kind", "id").added == {record["id"] for record in RECORDS}
+    state.put_multi(RECORDS[:5], "Kind", "id")
+    state.put_multi(RECORDS[5:], "Kind", "id")
+    state.delete_multi(RECORDS[:1], "Kind", "id")
+    assert store.writes == 0
+
+    state.flush()
+    state.flush()
+    assert store.writes == 1
+
+    diff = SnapshotState(LocalStore(str(tmp_path))).diff(changed(RECORDS, "R1"), "Kind", "id")
+    assert diff.added == {"R0"}
+    assert diff.changed == {"R1"}
+
+
+def test_snapshot_merges_concurrent_flush(tmp_path):
+    first = SnapshotState(LocalStore(str(tmp_path)))
+    second = SnapshotState(LocalStore(str(tmp_path)))
+    first.diff(RECORDS, "Kind", "id")
+    second.diff(RECORDS, "Kind", "id")
+
+    first.put_multi(RECORDS[:5], "Kind", "id")
+    second.put_multi(RECORDS[5:], "Kind", "id")
+    first.flush()
+    second.flush()
+
+    assert SnapshotState(LocalStore(str(tmp_path))).diff(RECORDS, "Kind", "id").records == []
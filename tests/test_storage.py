@@ -0,0 +1,169 @@
+import base64
+import datetime
+import decimal
+import gzip
+import io
+import json
+import sys
+
+import brotli
+import google_crc32c
+import pytest
+
+from datastore import GoogleCloudDatastore
+from event_formatter import Formatter
+from fakes import FakeBlob, FakeDatastoreClient, FakeStorageClient
+from metrics import Metrics
+from storage import File, GoogleCloudStorage, open_blob
+
+DATA = json.dumps([{"id": i, "name": f"Name {i}"} for i in range(2000)]).encode()
+
+
+@pytest.mark.parametrize("encoding, compress", [(None, bytes), ("gzip", gzip.compress), ("br", brotli.compress)])
+def test_open_blob(encoding, compress):
+    assert open_blob(FakeBlob(compress(DATA), encoding)).read() == DATA
+
+
+def test_open_blob_from_start():
+    assert open_blob(FakeBlob(DATA), start=100).read() == DATA[100:]
+
+
+@pytest.mark.parametrize("encoding, compress, error", [
+    ("gzip", gzip.compress, EOFError),
+    ("br", brotli.compress, brotli.error),
+])
+def test_open_blob_truncated(encoding, compress, error):
+    compressed = compress(DATA)
+
+    with pytest.raises(error):
+        open_blob(FakeBlob(compressed[:len(compressed) // 2], encoding)).read()
+
+
+def blob(data: bytes) -> FakeBlob:
+    checksum = base64.b64encode(google_crc32c.value(data).to_bytes(4, "big")).decode()
+    return FakeBlob(data, crc32c=checksum)
+
+
+def read_appended(data: bytes, name: str, watermark: dict = None, csv_dialect_parameters: dict = None):
+    storage = GoogleCloudStorage(FakeStorageClient({("bucket", name): blob(data)}))
+    metrics = Metrics()
+    file = storage.read_appended(name, "bucket", watermark, metrics, csv_dialect_parameters)
+
+    return file.content.read(), file.watermark, metrics
+
+
+HEADER = b"id,name\n"
+ROWS = b"".join(f"R{i},Name {i}\n".encode() for i in range(1000))
+
+
+def test_read_appended_tail():
+    content, watermark, _ = read_appended(HEADER + ROWS, "records.csv")
+    assert content == HEADER + ROWS
+    assert watermark["offset"] == len(HEADER + ROWS)
+
+    watermark["rows"] = 1000
+    content, appended, metrics = read_appended(HEADER + ROWS + b"R1000,Name 1000\n", "records.csv", watermark)
+
+    assert content == HEADER + b"R1000,Name 1000\n"
+    assert appended["rows"] == 1000
+    assert metrics.counts["bytes_skipped"] == len(HEADER + ROWS)
+
+
+def test_read_appended_ndjson_tail():
+    data = b'{"id": 1}\n'
+    _, watermark, _ = read_appended(data, "records.ndjson")
+
+    content, _, _ = read_appended(data + b'{"id": 2}\n', "records.ndjson", watermark)
+
+    assert content == b'{"id": 2}\n'
+
+
+@pytest.mark.parametrize("edited, csv_dialect_parameters", [
+    # A row before the watermark changed without changing the size
+    (HEADER + ROWS.replace(b"R500,", b"X500,"), None),
+    # The parameters change which lines are rows
+    (HEADER + ROWS, {"header": None}),
+])
+def test_read_appended_whole_file(edited, csv_dialect_parameters):
+    _, watermark, _ = read_appended(HEADER + ROWS, "records.csv")
+    data = edited + b"R1000,Name 1000\n"
+
+    content, _, metrics = read_appended(data, "records.csv", watermark, csv_dialect_parameters)
+
+    assert content == data
+    assert metrics.counts["bytes_skipped"] == 0
+
+
+def test_read_appended_without_complete_row():
+    _, watermark, _ = read_appended(HEADER + b"R0,Name", "records.csv")
+
+    assert watermark is None
+
+
+def typed_file(extension: str) -> File:
+    """Parquet or Arrow file with typed columns."""
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.feather
+    import pyarrow.parquet
+
+    n = 100
+    table = pa.table({
+        "id": [f"R{i}" for i in range(n)],
+        "count": list(range(n)),
+        "day": pa.array([datetime.date(2021, 1, 1) + datetime.timedelta(days=i) for i in range(n)], pa.date32()),
+        "at": pa.array([datetime.datetime(2021, 1, 1, 12, i % 60) for i in range(n)], pa.timestamp("us")),
+        "utc": pa.array([datetime.datetime(2021, 1, 1, 12, i % 60) if i % 2 else None for i in range(n)],
+                        pa.timestamp("us", tz="UTC")),
+        "time": pa.array([datetime.time(i % 24, 30) for i in range(n)], pa.time64("us")),
+        "amount": pa.array([decimal.Decimal(f"{i}.25") for i in range(n)], pa.decimal128(7, 2)),
+    })
+    buffer = io.BytesIO()
+    if extension == "parquet":
+        pyarrow.parquet.write_table(table, buffer)
+    elif extension == "arrow":
+        pyarrow.feather.write_feather(table, buffer, compression="uncompressed")
+    else:
+        with pa.ipc.new_stream(buffer, table.schema) as writer:
+            writer.write_table(table)
+    return File(f"records.{extension}", buffer.getvalue())
+
+
+TYPED_FORMAT = {name: {"name": name} for name in ("id", "count", "day", "at", "utc", "time", "amount")}
+
+
+@pytest.mark.parametrize("extension", ["parquet", "arrow", "arrows"])
+def test_typed_records_plain(extension):
+    records = typed_file(extension).to_json(Formatter(TYPED_FORMAT))
+
+    assert records[1] == {
+        "id": "R1", "count": 1, "day": "2021-01-02", "at": "2021-01-01T12:01:00",
+        "utc": "2021-01-01T12:01:00+00:00", "time": "01:30:00", "amount": 1.25,
+    }
+    assert records[0]["utc"] is None
+    assert all(type(value) in (str, int, float, type(None)) for record in records for value in record.values())
+
+
+@pytest.mark.parametrize("extension", ["parquet", "arrow", "arrows"])
+def test_typed_chunks_equal_whole_file(extension):
+    file = typed_file(extension)
+    chunks = list(file.iter_json(Formatter(TYPED_FORMAT), 30))
+
+    assert [record for chunk in chunks for record in chunk] == file.to_json(Formatter(TYPED_FORMAT))
+
+
+@pytest.mark.parametrize("mode", ["full", "digest"])
+def test_typed_records_unchanged_in_datastore(mode):
+    records = typed_file("parquet").to_json(Formatter(TYPED_FORMAT))
+    state = GoogleCloudDatastore(mode=mode, client=FakeDatastoreClient())
+
+    state.put_multi(records, "Kind", "id")
+
+    assert state.difference(typed_file("parquet").to_json(Formatter(TYPED_FORMAT)), "Kind", "id") == []
+
+
+def test_typed_file_without_pyarrow(monkeypatch):
+    file = typed_file("parquet")
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+
+    with pytest.raises(ValueError, match="requires pyarrow"):
+        file.to_json(Formatter(TYPED_FORMAT))